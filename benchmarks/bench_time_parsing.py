@@ -0,0 +1,60 @@
+"""
+Micro-benchmark: per-row cost of timetable time parsing
+Compares the strptime chain the class endpoints used with time_utils.parse_clock_time
+
+Run from the repo root:  python benchmarks/bench_time_parsing.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from time_utils import parse_clock_time  # noqa: E402
+
+
+def legacy_parse(value: str):
+    if 'T' in value:
+        return datetime.fromisoformat(value.replace('Z', '')).time()
+    try:
+        return datetime.strptime(value, "%H:%M:%S").time()
+    except ValueError:
+        return datetime.strptime(value, "%H:%M").time()
+
+
+def uncached_parse(value: str):
+    return parse_clock_time.__wrapped__(value)
+
+
+# A realistic week: a few dozen distinct slot boundaries repeated across classes/days,
+# with a share of legacy 'HH:MM' rows that hit the strptime retry
+ROWS = []
+for day in range(6):
+    for cls in range(8):
+        for hour in range(8, 17):
+            fmt = "{:02d}:{:02d}" if (cls + hour) % 4 == 0 else "{:02d}:{:02d}:00"
+            ROWS.append((fmt.format(hour, 0), fmt.format(hour, 50)))
+
+
+def run(parser) -> None:
+    for start, end in ROWS:
+        parser(start)
+        parser(end)
+
+
+def main():
+    number = 20
+    results = {}
+    for name, parser in (("strptime chain", legacy_parse), ("split fast path", uncached_parse), ("memoized", parse_clock_time)):
+        best = min(timeit.repeat(lambda: run(parser), number=number, repeat=5))
+        results[name] = best / (number * len(ROWS)) * 1e6
+    base = results["strptime chain"]
+    print(f"{len(ROWS)} rows per pass")
+    for name, us in results.items():
+        print(f"  {name:<16} {us:7.3f} us/row  ({base / us:5.1f}x)")
+    print("  cache:", parse_clock_time.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Load harness: /ws/chat delivery latency
+Serves the chat socket (ChatSocketServer + EventHub) on localhost with an in-memory
+message store instead of Supabase, opens N sockets paired up as friends, and has
+every socket send messages to its peer. Latency is measured from the sender's
+send() to the peer receiving the pushed `message` event. Clients run in the same
+process and event loop as the server, so figures include client-side overhead; a
+small --interval-ms drives the server into saturation (queueing latency).
+
+Run from the repo root:  python benchmarks/bench_ws_chat.py --clients 200 --messages 20
+Needs the `websockets` package (installed with uvicorn[standard]).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+from fastapi import FastAPI, WebSocket  # noqa: E402
+
+from chat_socket import ChatSocketServer  # noqa: E402
+from event_hub import EventHub  # noqa: E402
+
+
+def build_app(hub: EventHub) -> tuple[FastAPI, ChatSocketServer]:
+    ids = itertools.count(1)
+
+    def send_message(data: dict) -> dict:
+        # Stand-in for the messages insert; publishes exactly like the REST handler
+        row = dict(data, id=f"m{next(ids)}", is_read=False, created_at=datetime.now(timezone.utc).isoformat())
+        hub.publish([row["receiver_id"], row["sender_id"]], "message", row)
+        return {"data": row}
+
+    server = ChatSocketServer(
+        hub,
+        authenticate=lambda frame: frame.get("user_id"),
+        send_message=send_message,
+        mark_read=lambda user_id, frame: None,
+        can_message=lambda a, b: True,
+    )
+    app = FastAPI()
+
+    @app.websocket("/ws/chat")
+    async def chat(websocket: WebSocket):
+        await server.serve(websocket)
+
+    return app, server
+
+
+async def client(url: str, user_id: str, peer_id: str, messages: int, interval: float,
+                 start: asyncio.Event, latencies: list[float]):
+    async with websockets.connect(url, max_queue=None) as ws:
+        await ws.send(json.dumps({"type": "auth", "user_id": user_id}))
+        await ws.recv()  # ready
+        expected = messages
+
+        async def receive():
+            nonlocal expected
+            while expected:
+                frame = json.loads(await ws.recv())
+                data = frame.get("data") or {}
+                if frame.get("type") == "message" and data.get("sender_id") == peer_id:
+                    latencies.append(time.perf_counter() - float(data["content"]))
+                    expected -= 1
+
+        reader = asyncio.create_task(receive())
+        await start.wait()
+        for _ in range(messages):
+            await ws.send(json.dumps({"type": "message", "receiver_id": peer_id, "content": repr(time.perf_counter())}))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.wait_for(reader, timeout=60)
+
+
+def pct(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100, help="sockets to open (paired up)")
+    parser.add_argument("--messages", type=int, default=20, help="messages each socket sends")
+    parser.add_argument("--interval-ms", type=float, default=100.0, help="pause between sends per socket")
+    parser.add_argument("--port", type=int, default=8791)
+    args = parser.parse_args()
+    n = args.clients - args.clients % 2
+
+    hub = EventHub(queue_size=max(100, args.messages * 2))
+    app, chat = build_app(hub)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", ws_max_queue=10_000))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    url = f"ws://127.0.0.1:{args.port}/ws/chat"
+    start, latencies = asyncio.Event(), []
+    tasks = [
+        asyncio.create_task(client(url, f"u{i}", f"u{i ^ 1}", args.messages, args.interval_ms / 1000, start, latencies))
+        for i in range(n)
+    ]
+    while hub.stats()["connections"] < n:
+        await asyncio.sleep(0.05)
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    server.should_exit = True
+    await serve_task
+
+    ms = [v * 1000 for v in latencies]
+    print(f"{n} sockets x {args.messages} messages = {len(ms)} deliveries in {elapsed:.2f}s ({len(ms) / elapsed:,.0f}/s)")
+    print(f"  latency ms: p50 {pct(ms, 50):.2f}  p95 {pct(ms, 95):.2f}  p99 {pct(ms, 99):.2f}  "
+          f"max {max(ms):.2f}  mean {statistics.fmean(ms):.2f}")
+    print("  socket:", chat.stats())
+    print("  hub:", {k: v for k, v in hub.stats().items() if k in ("published", "delivered", "dropped")})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
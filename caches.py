@@ -0,0 +1,344 @@
+"""
+In-process lookup caches
+Small TTL/LRU caches that sit in front of hot Supabase lookups
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=_MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # Expired: drop it so it does not count against maxsize
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        return {"size": size, "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+class StudentClassResolver:
+    """Resolve a student's class candidates (raw users.class value + class code).
+
+    users.class may hold either a class row id or the class code string, so callers
+    filter on both. Results are cached per student_id; lookup errors are not cached.
+    """
+
+    def __init__(self, supabase, ttl: float | None = None, maxsize: int | None = None):
+        self.supabase = supabase
+        self.cache = TTLCache(
+            maxsize=maxsize or int(os.getenv("CLASS_CACHE_MAXSIZE", "4096")),
+            ttl=ttl or float(os.getenv("CLASS_CACHE_TTL_SECONDS", "300")),
+        )
+        self.remote_lookups = 0
+
+    def resolve(self, student_id: str | None) -> list[str]:
+        """Return de-duplicated class candidates for a student ([] when unknown)."""
+        if not student_id:
+            return []
+        key = str(student_id)
+        cached = self.cache.get(key)
+        if cached is not _MISSING:
+            return list(cached)
+        candidates: list[str] = []
+        try:
+            self.remote_lookups += 1
+            ures = self.supabase.table("users").select("class").eq("id", key).limit(1).execute()
+            raw_class = (ures.data[0].get("class") if ures.data else None)
+            if raw_class:
+                candidates.append(str(raw_class))
+                # users.class may be a class row id; resolve to the class code when it is
+                try:
+                    cres = self.supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
+                    if cres.data and cres.data[0].get("class"):
+                        candidates.append(str(cres.data[0].get("class")))
+                except Exception:
+                    pass
+        except Exception:
+            # Do not cache failures; the next request retries the lookup
+            return []
+        candidates = list(dict.fromkeys(candidates))
+        self.cache.set(key, tuple(candidates))
+        return candidates
+
+    def invalidate(self, student_id: str | None):
+        if student_id:
+            self.cache.invalidate(str(student_id))
+
+    def invalidate_all(self):
+        """Drop every entry, e.g. after a write to the class table."""
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        out = self.cache.stats()
+        out["remote_lookups"] = self.remote_lookups
+        return out
+
+
+class FacultyCourseIndex:
+    """faculty_id -> course ids, built from one `courses` scan.
+
+    Loaded lazily on first use (or eagerly via warm()) and reloaded once the snapshot
+    is older than `ttl`. Course writes can keep it current through note_course() and
+    forget_course(), or force a reload with invalidate().
+    """
+
+    def __init__(self, supabase, ttl: float | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("FACULTY_COURSES_TTL_SECONDS", "600"))
+        self._by_faculty: dict[str, tuple[str, ...]] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.lookups = 0
+
+    def warm(self) -> bool:
+        """Load the index now; returns False (and stays lazy) if the query fails."""
+        return self._load()
+
+    def _load(self, force: bool = True) -> bool:
+        with self._lock:
+            # A caller that waited on the lock may find another one already reloaded
+            if not force and not self._is_stale():
+                return True
+            try:
+                res = self.supabase.table("courses").select("id, faculty_id").execute()
+            except Exception as e:
+                self.load_errors += 1
+                print("[faculty-courses] load failed:", repr(e))
+                return False
+            by_faculty: dict[str, list[str]] = {}
+            for r in (res.data or []):
+                fid, cid = r.get("faculty_id"), r.get("id")
+                if fid and cid:
+                    by_faculty.setdefault(str(fid), []).append(str(cid))
+            self._by_faculty = {k: tuple(v) for k, v in by_faculty.items()}
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+            return True
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def course_ids(self, faculty_id: str | None) -> list[str]:
+        """Course ids taught by a faculty ([] when none or the index cannot be loaded)."""
+        if not faculty_id:
+            return []
+        self.lookups += 1
+        if self._is_stale():
+            # On failure keep serving the previous snapshot, if any
+            self._load(force=False)
+        return list(self._by_faculty.get(str(faculty_id), ()))
+
+    def note_course(self, course: dict):
+        """Write-through for an inserted/updated course row (needs id and faculty_id)."""
+        cid, fid = course.get("id"), course.get("faculty_id")
+        if not cid:
+            return
+        with self._lock:
+            self._drop(str(cid))
+            if fid:
+                self._by_faculty[str(fid)] = self._by_faculty.get(str(fid), ()) + (str(cid),)
+
+    def forget_course(self, course_id: str):
+        with self._lock:
+            self._drop(str(course_id))
+
+    def _drop(self, course_id: str):
+        for fid, ids in list(self._by_faculty.items()):
+            if course_id in ids:
+                self._by_faculty[fid] = tuple(i for i in ids if i != course_id)
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def stats(self) -> dict:
+        return {
+            "faculty": len(self._by_faculty),
+            "loaded": self._loaded_at is not None,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "lookups": self.lookups,
+        }
+
+
+class EntityCache:
+    """Row cache for one table keyed by id, with batched misses.
+
+    get_many() serves hits from the TTL cache and fetches every miss with a single
+    `in_("id", ...)` query (chunked for very long lists). Ids that do not exist are
+    simply absent from the result and are not cached.
+    """
+
+    CHUNK = 200
+
+    def __init__(self, supabase, table: str, columns: str, ttl: float | None = None, maxsize: int | None = None):
+        self.supabase = supabase
+        self.table = table
+        self.columns = columns
+        env = table.upper()
+        self.cache = TTLCache(
+            maxsize=maxsize or int(os.getenv(f"{env}_CACHE_MAXSIZE", "10000")),
+            ttl=ttl or float(os.getenv(f"{env}_CACHE_TTL_SECONDS", "300")),
+        )
+        self.remote_queries = 0
+
+    def get_many(self, ids) -> dict[str, dict]:
+        """id -> row for every id that exists (rows are copies; callers may mutate)."""
+        found: dict[str, dict] = {}
+        missing: list[str] = []
+        for key in dict.fromkeys(str(i) for i in (ids or []) if i):
+            row = self.cache.get(key)
+            if row is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = dict(row)
+        for i in range(0, len(missing), self.CHUNK):
+            chunk = missing[i:i + self.CHUNK]
+            self.remote_queries += 1
+            res = self.supabase.table(self.table).select(self.columns).in_("id", chunk).execute()
+            for row in (res.data or []):
+                key = str(row.get("id"))
+                self.cache.set(key, row)
+                found[key] = dict(row)
+        return found
+
+    def get(self, entity_id) -> dict | None:
+        if not entity_id:
+            return None
+        return self.get_many([entity_id]).get(str(entity_id))
+
+    def put(self, row: dict):
+        """Write-through after an insert/update; rows missing cached columns just evict."""
+        if not row or not row.get("id"):
+            return
+        cols = [c.strip() for c in self.columns.split(",")]
+        if all(c in row for c in cols):
+            self.cache.set(str(row["id"]), {c: row.get(c) for c in cols})
+        else:
+            self.invalidate(row["id"])
+
+    def invalidate(self, entity_id):
+        if entity_id:
+            self.cache.invalidate(str(entity_id))
+
+    def stats(self) -> dict:
+        out = self.cache.stats()
+        out["remote_queries"] = self.remote_queries
+        return out
+
+
+def is_global_resource(row: dict) -> bool:
+    """A resource with no course and no class is visible to everyone."""
+    def emptyish(v):
+        if v is None:
+            return True
+        s = str(v).strip().lower()
+        return s == "" or s == "null" or s == "none"
+    return emptyish(row.get("course_id")) and emptyish(row.get("class"))
+
+
+class GlobalResourceSet:
+    """The global resources (no course_id, no class), held in memory.
+
+    Loaded with a server-side `is null` filter, so the cost follows the number of
+    global rows rather than the size of the resources table; if that query fails the
+    old full scan + Python filter is used instead. Resource writes call invalidate();
+    the snapshot also expires after `ttl` (download counts drift until then).
+    """
+
+    def __init__(self, supabase, ttl: float | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("GLOBAL_RESOURCES_TTL_SECONDS", "120"))
+        self._rows: tuple[dict, ...] = ()
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.fallback_loads = 0
+        self.load_errors = 0
+        self.lookups = 0
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def _load(self, force: bool = True) -> bool:
+        with self._lock:
+            # Callers queued behind another load find the snapshot fresh and reuse it
+            if not force and not self._is_stale():
+                return True
+            try:
+                try:
+                    res = self.supabase.table("resources").select("*").is_("course_id", "null").is_("class", "null").execute()
+                except Exception as e:
+                    print("[resources] global filter query failed, scanning table:", repr(e))
+                    self.fallback_loads += 1
+                    res = self.supabase.table("resources").select("*").execute()
+            except Exception as e:
+                self.load_errors += 1
+                print("[resources] global resources load failed:", repr(e))
+                return False
+            self._rows = tuple(r for r in (res.data or []) if is_global_resource(r))
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+            return True
+
+    def rows(self) -> list[dict]:
+        """Copies of the global resource rows ([] if they cannot be loaded)."""
+        self.lookups += 1
+        if self._is_stale():
+            # On failure keep serving the previous snapshot, if any
+            self._load(force=False)
+        return [dict(r) for r in self._rows]
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def stats(self) -> dict:
+        return {
+            "rows": len(self._rows),
+            "loaded": self._loaded_at is not None,
+            "loads": self.loads,
+            "fallback_loads": self.fallback_loads,
+            "load_errors": self.load_errors,
+            "lookups": self.lookups,
+        }
@@ -0,0 +1,402 @@
+"""
+Chat read-side helpers
+Conversation summaries (last message + unread count per peer) computed in a bounded
+number of Supabase calls instead of a few queries per friend, keyset-paginated
+history for a single conversation, per-pair activity for cheap delta polling, and
+unread counters maintained on write
+"""
+import heapq
+import os
+import threading
+import time
+from itertools import islice
+
+from query_utils import keyset_after, keyset_before, or_filter, order_by, quote_value
+
+# Message columns plus the sender's name for the chat view
+MESSAGE_SELECT = "*, sender:users!messages_sender_id_fkey(first_name, last_name, email)"
+
+# in_() lists are chunked so request URLs stay well under proxy limits
+PEER_CHUNK = 200
+
+
+def _in_list(values) -> str:
+    return "(" + ",".join(quote_value(v) for v in values) + ")"
+
+
+def _message_key(m: dict):
+    return (str(m.get("created_at") or ""), str(m.get("id") or ""))
+
+
+def conversation_page(supabase, user1_id: str, user2_id: str, limit: int,
+                      before: tuple[str, str] | None = None,
+                      after: tuple[str, str] | None = None) -> tuple[list[dict], bool]:
+    """Up to `limit` messages between two users, oldest first, and whether more exist.
+
+    Without `after` this is the newest page (older than `before` when given); with
+    `after` it is the page immediately following that (created_at, id) position.
+    Each direction is fetched with its own ORDER BY + LIMIT (served by an index on
+    sender_id, receiver_id, created_at), so the cost is independent of thread length;
+    the two sorted streams are then merged and cut at `limit`.
+    """
+    newest_first = after is None
+    streams = []
+    for sender, receiver in ((user1_id, user2_id), (user2_id, user1_id)):
+        q = supabase.table("messages").select(MESSAGE_SELECT).eq("sender_id", sender).eq("receiver_id", receiver)
+        if newest_first:
+            if before:
+                q = keyset_before(q, "created_at", "id", *before)
+            q = order_by(q, "created_at.desc", "id.desc")
+        else:
+            q = order_by(keyset_after(q, "created_at", "id", *after), "created_at.asc", "id.asc")
+        # One extra row per direction tells whether another page exists
+        streams.append(q.limit(limit + 1).execute().data or [])
+    merged = list(islice(heapq.merge(*streams, key=_message_key, reverse=newest_first), limit + 1))
+    has_more = len(merged) > limit
+    page = merged[:limit]
+    if newest_first:
+        page.reverse()
+    return page, has_more
+
+
+class ConversationSummaries:
+    """Latest message and unread count for each of a user's peers.
+
+    Uses the `conversation_summaries` SQL function when it is installed
+    (sql_queries/rpc_functions.sql): one call regardless of friend count. Otherwise
+    falls back to bulk fetches: unread sender ids in pages, plus newest-first pages of
+    the user's messages with those peers until every peer's latest message is seen or
+    the history runs out. The scan is capped at CONVERSATION_SCAN_PAGES pages per peer
+    chunk; peers still unseen after that (long-quiet conversations in a busy inbox)
+    get one limit-1 query each, so the result never depends on history size.
+    """
+
+    RPC_NAME = "conversation_summaries"
+
+    def __init__(self, supabase, page_size: int | None = None, max_pages: int | None = None):
+        self.supabase = supabase
+        self.page_size = page_size or int(os.getenv("CONVERSATION_SCAN_PAGE_SIZE", "500"))
+        self.max_pages = max_pages or int(os.getenv("CONVERSATION_SCAN_PAGES", "4"))
+        self.rpc_retry_seconds = float(os.getenv("CONVERSATION_RPC_RETRY_SECONDS", "600"))
+        self._rpc_unavailable_at: float | None = None
+        self.rpc_calls = 0
+        self.fallback_calls = 0
+        self.peer_lookups = 0
+        self.queries = 0
+
+    def summaries(self, user_id: str, peer_ids: list[str], with_unread: bool = True) -> dict[str, dict]:
+        """peer_id -> {"last_message": row | None, "unread_count": int} for every peer.
+
+        with_unread=False skips the unread scan on the fallback path (counts stay 0)
+        for callers that take unread counts from UnreadCounters.
+        """
+        peers = [str(p) for p in dict.fromkeys(peer_ids) if p]
+        out = {p: {"last_message": None, "unread_count": 0} for p in peers}
+        if not peers:
+            return out
+        rows = self._via_rpc(user_id)
+        if rows is not None:
+            self.rpc_calls += 1
+            for r in rows:
+                pid = str(r.get("peer_id"))
+                if pid in out:
+                    out[pid] = {"last_message": r.get("last_message"), "unread_count": int(r.get("unread_count") or 0)}
+            return out
+        self.fallback_calls += 1
+        for i in range(0, len(peers), PEER_CHUNK):
+            chunk = peers[i:i + PEER_CHUNK]
+            if with_unread:
+                for pid, n in self._unread_counts(user_id, chunk).items():
+                    out[pid]["unread_count"] = n
+            for pid, msg in self._last_messages(user_id, chunk).items():
+                out[pid]["last_message"] = msg
+        return out
+
+    # ------------------------------------------------------------------ RPC path
+    def _via_rpc(self, user_id: str) -> list[dict] | None:
+        if self._rpc_unavailable_at is not None and (time.monotonic() - self._rpc_unavailable_at) < self.rpc_retry_seconds:
+            return None
+        try:
+            self.queries += 1
+            res = self.supabase.rpc(self.RPC_NAME, {"p_user_id": user_id}).execute()
+            self._rpc_unavailable_at = None
+            return res.data or []
+        except Exception as e:
+            if self._rpc_unavailable_at is None:
+                print(f"[chat] {self.RPC_NAME} rpc unavailable, using bulk fallback:", repr(e))
+            self._rpc_unavailable_at = time.monotonic()
+            return None
+
+    # ------------------------------------------------------------------ fallback path
+    def _unread_counts(self, user_id: str, peers: list[str]) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        start = 0
+        while True:
+            self.queries += 1
+            res = (
+                self.supabase.table("messages")
+                .select("id, sender_id")
+                .eq("receiver_id", user_id)
+                .eq("is_read", False)
+                .in_("sender_id", peers)
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+            )
+            page = res.data or []
+            for r in page:
+                sid = str(r.get("sender_id"))
+                counts[sid] = counts.get(sid, 0) + 1
+            if len(page) < self.page_size:
+                return counts
+            start += self.page_size
+
+    def _last_messages(self, user_id: str, peers: list[str]) -> dict[str, dict]:
+        latest: dict[str, dict] = {}
+        wanted = set(peers)
+        me, others = quote_value(user_id), _in_list(peers)
+        cursor = None
+        exhausted = False
+        for _ in range(self.max_pages):
+            q = self.supabase.table("messages").select("*")
+            q = or_filter(q, f"and(sender_id.eq.{me},receiver_id.in.{others}),and(receiver_id.eq.{me},sender_id.in.{others})")
+            if cursor:
+                q = keyset_before(q, "created_at", "id", *cursor)
+            self.queries += 1
+            page = order_by(q, "created_at.desc", "id.desc").limit(self.page_size).execute().data or []
+            for m in page:
+                peer = str(m.get("receiver_id") if str(m.get("sender_id")) == str(user_id) else m.get("sender_id"))
+                if peer in wanted and peer not in latest:
+                    latest[peer] = m
+            if len(page) < self.page_size:
+                exhausted = True
+                break
+            if len(latest) == len(wanted):
+                break
+            cursor = (page[-1].get("created_at"), page[-1].get("id"))
+        if not exhausted:
+            # The window ended before the history did: anyone unseen has only older messages (or none)
+            for peer in peers:
+                if peer not in latest:
+                    msg = self._last_message_with(user_id, peer)
+                    if msg is not None:
+                        latest[peer] = msg
+        return latest
+
+    def _last_message_with(self, user_id: str, peer: str) -> dict | None:
+        me, other = quote_value(user_id), quote_value(peer)
+        q = self.supabase.table("messages").select("*")
+        q = or_filter(q, f"and(sender_id.eq.{me},receiver_id.eq.{other}),and(sender_id.eq.{other},receiver_id.eq.{me})")
+        self.queries += 1
+        self.peer_lookups += 1
+        rows = order_by(q, "created_at.desc", "id.desc").limit(1).execute().data or []
+        return rows[0] if rows else None
+
+    def stats(self) -> dict:
+        return {
+            "rpc_available": self._rpc_unavailable_at is None,
+            "rpc_calls": self.rpc_calls,
+            "fallback_calls": self.fallback_calls,
+            "peer_lookups": self.peer_lookups,
+            "queries": self.queries,
+        }
+
+
+def _pair(a: str, b: str) -> tuple[str, str]:
+    a, b = str(a), str(b)
+    return (a, b) if a <= b else (b, a)
+
+
+class ChatActivity:
+    """Last known activity per conversation pair, for answering empty polls locally.
+
+    For each unordered pair it keeps the newest message position (created_at, id),
+    the stamp of the newest known read-state change, and the stamp from which read
+    changes were last verified against the database. A poll is answered locally
+    only when its read_since is at or after that verified bound; older clients go
+    to the database. send/mark-read on this process update entries directly; an
+    entry is re-verified once it is older than `recheck` seconds, so writes made by
+    other workers still surface.
+    """
+
+    def __init__(self, recheck: float | None = None, maxsize: int | None = None):
+        self.recheck = recheck or float(os.getenv("CHAT_ACTIVITY_RECHECK_SECONDS", "60"))
+        self.maxsize = maxsize or int(os.getenv("CHAT_ACTIVITY_MAXSIZE", "50000"))
+        # pair -> [last (created_at, id), newest read change stamp, monotonic verified-at, read verified-from]
+        self._pairs: dict[tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+        self.local_answers = 0
+        self.db_answers = 0
+
+    def is_quiet(self, a: str, b: str, position: tuple[str, str], read_since: str) -> bool:
+        """True when nothing newer than `position` and no read change after `read_since` is known."""
+        entry = self._pairs.get(_pair(a, b))
+        if entry is None or (time.monotonic() - entry[2]) > self.recheck:
+            return False
+        last, read_at, _, bound = entry
+        if bound is None or not read_since or read_since < bound:
+            # Read changes between read_since and the verified bound are unknown here
+            return False
+        quiet = (last is None or tuple(last) <= tuple(position)) and (not read_at or read_at <= read_since)
+        if quiet:
+            self.local_answers += 1
+        return quiet
+
+    def record(self, a: str, b: str, last: tuple[str, str] | None, read_at: str | None, read_bound: str | None):
+        """Store state just verified against the database.
+
+        read_bound is the stamp read changes were queried from (None when they were
+        not queried); read_at the newest change that query returned. A newer read
+        stamp already noted locally is kept.
+        """
+        self.db_answers += 1
+        key = _pair(a, b)
+        with self._lock:
+            entry = self._pairs.get(key)
+            if entry is None and len(self._pairs) >= self.maxsize:
+                # Forget the least recently verified entries; they are only a shortcut
+                for old, _ in sorted(self._pairs.items(), key=lambda kv: kv[1][2])[: max(1, self.maxsize // 10)]:
+                    del self._pairs[old]
+            if entry is not None:
+                if entry[0] is not None and (last is None or tuple(entry[0]) > tuple(last)):
+                    last = entry[0]
+                if entry[1] and (not read_at or entry[1] > read_at):
+                    read_at = entry[1]
+            self._pairs[key] = [last, read_at, time.monotonic(), read_bound]
+
+    def note_message(self, row: dict):
+        """A message was inserted on this process."""
+        key = _pair(row.get("sender_id"), row.get("receiver_id"))
+        position = (str(row.get("created_at") or ""), str(row.get("id") or ""))
+        with self._lock:
+            entry = self._pairs.get(key)
+            if entry is not None and (entry[0] is None or position > tuple(entry[0])):
+                entry[0] = position
+
+    def note_read(self, a: str, b: str, stamp: str):
+        """Messages between a and b changed read state at `stamp`."""
+        with self._lock:
+            entry = self._pairs.get(_pair(a, b))
+            if entry is not None and (not entry[1] or stamp > entry[1]):
+                entry[1] = stamp
+
+    def stats(self) -> dict:
+        return {
+            "pairs": len(self._pairs),
+            "local_answers": self.local_answers,
+            "db_answers": self.db_answers,
+            "recheck_seconds": self.recheck,
+        }
+
+
+class UnreadCounters:
+    """receiver_id -> {sender_id: unread message count}, maintained on write.
+
+    rebuild() scans the unread messages once (at startup); send/mark-read then adjust
+    the counters in place. A receiver's counts are re-read from the database once
+    they are older than `ttl` seconds, which also picks up writes from other workers.
+    """
+
+    def __init__(self, supabase, ttl: float | None = None, page_size: int | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("UNREAD_COUNTERS_TTL_SECONDS", "300"))
+        self.page_size = page_size or int(os.getenv("UNREAD_COUNTERS_PAGE_SIZE", "1000"))
+        self._counts: dict[str, dict[str, int]] = {}
+        self._refreshed_at: dict[str, float] = {}
+        self._rebuilt_at: float | None = None
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.lookups = 0
+        self.load_errors = 0
+
+    def _scan(self, receiver_id: str | None = None) -> dict[str, dict[str, int]]:
+        counts: dict[str, dict[str, int]] = {}
+        last_id = None
+        while True:
+            q = self.supabase.table("messages").select("id, sender_id, receiver_id").eq("is_read", False)
+            if receiver_id is not None:
+                q = q.eq("receiver_id", receiver_id)
+            if last_id is not None:
+                q = q.gt("id", last_id)
+            page = q.order("id").limit(self.page_size).execute().data or []
+            for r in page:
+                rid, sid = r.get("receiver_id"), r.get("sender_id")
+                if rid and sid:
+                    per = counts.setdefault(str(rid), {})
+                    per[str(sid)] = per.get(str(sid), 0) + 1
+            if len(page) < self.page_size:
+                return counts
+            last_id = page[-1].get("id")
+
+    def rebuild(self) -> bool:
+        """Recount every receiver from `messages`; keeps the old counters on failure."""
+        try:
+            counts = self._scan()
+        except Exception as e:
+            self.load_errors += 1
+            print("[unread] rebuild failed:", repr(e))
+            return False
+        with self._lock:
+            self._counts = counts
+            self._refreshed_at = {}
+            self._rebuilt_at = time.monotonic()
+        self.rebuilds += 1
+        return True
+
+    def _fresh(self, receiver_id: str) -> bool:
+        stamp = max(self._refreshed_at.get(receiver_id, 0.0), self._rebuilt_at or 0.0)
+        return stamp > 0 and (time.monotonic() - stamp) <= self.ttl
+
+    def counts(self, receiver_id: str) -> dict[str, int]:
+        """sender_id -> unread count for a receiver (only senders with unread messages)."""
+        key = str(receiver_id)
+        self.lookups += 1
+        if not self._fresh(key):
+            try:
+                per = self._scan(key).get(key, {})
+                with self._lock:
+                    self._counts[key] = per
+                    self._refreshed_at[key] = time.monotonic()
+                self.refreshes += 1
+            except Exception as e:
+                # Serve what we have; the next lookup retries
+                self.load_errors += 1
+                print("[unread] refresh failed:", repr(e))
+        return dict(self._counts.get(key, {}))
+
+    def total(self, receiver_id: str) -> int:
+        return sum(self.counts(receiver_id).values())
+
+    def increment(self, receiver_id: str, sender_id: str, n: int = 1):
+        with self._lock:
+            per = self._counts.setdefault(str(receiver_id), {})
+            per[str(sender_id)] = per.get(str(sender_id), 0) + n
+
+    def decrement(self, receiver_id: str, sender_id: str, n: int = 1):
+        with self._lock:
+            per = self._counts.get(str(receiver_id))
+            if per is None:
+                return
+            left = per.get(str(sender_id), 0) - n
+            if left > 0:
+                per[str(sender_id)] = left
+            else:
+                per.pop(str(sender_id), None)
+
+    def reset(self, receiver_id: str, sender_id: str):
+        with self._lock:
+            per = self._counts.get(str(receiver_id))
+            if per is not None:
+                per.pop(str(sender_id), None)
+
+    def stats(self) -> dict:
+        return {
+            "receivers": len(self._counts),
+            "unread_total": sum(sum(v.values()) for v in list(self._counts.values())),
+            "rebuilt": self._rebuilt_at is not None,
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+            "lookups": self.lookups,
+            "load_errors": self.load_errors,
+        }
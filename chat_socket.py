@@ -0,0 +1,153 @@
+"""
+WebSocket chat channel
+One persistent connection per client tab: authenticate once, then receive pushed
+messages, typing indicators and read receipts from the EventHub, and send messages,
+typing and read frames. Persistence stays with the REST handlers (messages table)
+"""
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+# Close code for a failed/missing auth frame (4000-4999 are application-defined)
+CLOSE_UNAUTHORIZED = 4401
+
+
+class ChatSocketServer:
+    """Serves /ws/chat on top of an EventHub.
+
+    Client frames (JSON):
+      {"type": "auth", "user_id": ...}                         first frame, required
+      {"type": "message", "receiver_id", "content", "message_type"?, "file_url"?, "client_id"?}
+      {"type": "typing", "to": peer_id, "is_typing": bool}
+      {"type": "read", "friend_id": peer_id} | {"type": "read", "message_id": id}
+      {"type": "ping"}
+    Server frames: {"type": <hub event>, "id", "data", "ts"} for every hub event
+    (message, messages_read, typing, notification, ...), plus ready, ack, error,
+    pong and heartbeat. Everything outbound goes through the connection's bounded
+    hub subscription, so one socket has exactly one writer.
+
+    The callables are the blocking REST-side operations; they run in the threadpool.
+    """
+
+    def __init__(self, hub, authenticate, send_message, mark_read, can_message, auth_timeout: float | None = None):
+        self.hub = hub
+        self.authenticate = authenticate      # frame -> user_id | None
+        self.send_message = send_message      # dict -> {"data": row}
+        self.mark_read = mark_read            # (user_id, frame) -> None
+        self.can_message = can_message        # (user_id, peer_id) -> bool
+        self.auth_timeout = auth_timeout or float(os.getenv("CHAT_WS_AUTH_TIMEOUT_SECONDS", "10"))
+        self.connections = 0
+        self.total_connections = 0
+        self.auth_failures = 0
+        self.frames_in = 0
+        self.messages = 0
+        self.typing = 0
+        self.reads = 0
+        self.errors = 0
+
+    async def serve(self, websocket: WebSocket):
+        await websocket.accept()
+        try:
+            frame = await asyncio.wait_for(websocket.receive_json(), self.auth_timeout)
+            user_id = await run_in_threadpool(self.authenticate, frame) if frame.get("type") == "auth" else None
+        except (asyncio.TimeoutError, WebSocketDisconnect, ValueError, AttributeError):
+            user_id = None
+        if not user_id:
+            self.auth_failures += 1
+            try:
+                await websocket.send_json({"type": "error", "detail": "unauthorized"})
+                await websocket.close(code=CLOSE_UNAUTHORIZED)
+            except Exception:
+                pass
+            return
+
+        user_id = str(user_id)
+        sub = self.hub.subscribe(user_id, asyncio.get_running_loop())
+        self.connections += 1
+        self.total_connections += 1
+        sub.push({"event": "ready", "data": {"user_id": user_id}, "ts": time.time()})
+        writer = asyncio.create_task(self._pump(websocket, sub))
+        try:
+            while True:
+                frame = await websocket.receive_json()
+                self.frames_in += 1
+                await self._handle(user_id, sub, frame)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        except Exception as e:
+            self.errors += 1
+            print(f"[ws] chat socket for {user_id} closed on error:", repr(e))
+        finally:
+            writer.cancel()
+            self.hub.unsubscribe(sub)
+            self.connections -= 1
+
+    async def _pump(self, websocket: WebSocket, sub):
+        try:
+            while True:
+                batch = await sub.next_batch(self.hub.heartbeat_seconds)
+                if not batch:
+                    await websocket.send_json({"type": "heartbeat", "ts": time.time()})
+                    continue
+                for ev in batch:
+                    out = {"type": ev["event"], "data": ev.get("data") or {}, "ts": ev.get("ts")}
+                    if "id" in ev:
+                        out["id"] = ev["id"]
+                    await websocket.send_json(out)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Socket went away mid-send; the reader side sees the disconnect and cleans up
+            pass
+
+    async def _handle(self, user_id: str, sub, frame: dict):
+        kind = frame.get("type") if isinstance(frame, dict) else None
+        ref = frame.get("client_id") if isinstance(frame, dict) else None
+        try:
+            if kind == "message":
+                data = {k: frame.get(k) for k in ("receiver_id", "content", "message_type", "file_url")}
+                data["sender_id"] = user_id
+                data["message_type"] = data.get("message_type") or "text"
+                # The REST handler persists the row and publishes it to both participants
+                result = await run_in_threadpool(self.send_message, data)
+                self.messages += 1
+                self._reply(sub, "ack", {"client_id": ref, "message": (result or {}).get("data")})
+            elif kind == "typing":
+                peer = frame.get("to")
+                if peer and await run_in_threadpool(self.can_message, user_id, peer):
+                    self.typing += 1
+                    # Only the latest typing state per sender matters to a slow reader
+                    self.hub.publish([peer], "typing", {"from": user_id, "is_typing": bool(frame.get("is_typing", True))},
+                                     coalesce_key=user_id)
+            elif kind == "read":
+                await run_in_threadpool(self.mark_read, user_id, frame)
+                self.reads += 1
+            elif kind == "ping":
+                self._reply(sub, "pong", {"client_id": ref})
+            else:
+                self._reply(sub, "error", {"client_id": ref, "detail": f"unknown frame type: {kind}"})
+        except HTTPException as e:
+            self.errors += 1
+            self._reply(sub, "error", {"client_id": ref, "status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            self.errors += 1
+            self._reply(sub, "error", {"client_id": ref, "status": 500, "detail": str(e)})
+
+    @staticmethod
+    def _reply(sub, event: str, data: dict):
+        sub.push({"event": event, "data": data, "ts": time.time()})
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "total_connections": self.total_connections,
+            "auth_failures": self.auth_failures,
+            "frames_in": self.frames_in,
+            "messages": self.messages,
+            "typing": self.typing,
+            "reads": self.reads,
+            "errors": self.errors,
+        }
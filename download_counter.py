@@ -0,0 +1,238 @@
+"""
+Resource download counter
+track_resource_download records downloads in memory; a worker thread periodically
+applies the accumulated per-resource increments atomically and batch-inserts the
+resource_downloads log rows, so the endpoint never waits on Supabase
+"""
+import os
+import threading
+import time
+
+
+class DownloadCounter:
+    """Aggregates download increments per resource_id and flushes them in bulk.
+
+    Counts are applied with the `increment_resource_downloads` SQL function
+    (sql_queries/rpc_functions.sql), one atomic UPDATE for the whole batch. Only when
+    the function is not installed does each resource fall back to a read-modify-write
+    per flush (not per download), which can still race with other workers. A data
+    error (a malformed or rejected id) is narrowed down by splitting the batch, and
+    only the offending resources' increments are dropped. Any other RPC error
+    (timeout, connection reset) may or may not have committed, so the batch is put
+    back and retried through the RPC on the next flush; stop() performs a final flush.
+    Log rows are split the same way, so one bad row does not drop its whole chunk.
+    """
+
+    RPC_NAME = "increment_resource_downloads"
+    # PostgREST "function not found in schema cache" / Postgres undefined_function
+    MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+    # SQLSTATE classes 22 (data exception, e.g. 22P02 bad uuid) and 23 (integrity violation)
+    DATA_ERROR_CLASSES = ("22", "23")
+
+    def __init__(self, supabase, flush_interval: float | None = None, batch_size: int | None = None):
+        self.supabase = supabase
+        self.flush_interval = flush_interval or float(os.getenv("DOWNLOAD_FLUSH_INTERVAL_MS", "2000")) / 1000.0
+        self.batch_size = batch_size or int(os.getenv("DOWNLOAD_LOG_BATCH_SIZE", "500"))
+        self.rpc_retry_seconds = float(os.getenv("DOWNLOAD_RPC_RETRY_SECONDS", "600"))
+        self._counts: dict[str, int] = {}
+        self._logs: list[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._rpc_unavailable_at: float | None = None
+        self._log_table_missing = False
+        # metrics
+        self.recorded = 0
+        self.flushes = 0
+        self.increments_applied = 0
+        self.increments_dropped = 0
+        self.rpc_calls = 0
+        self.fallback_updates = 0
+        self.logs_written = 0
+        self.logs_dropped = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    # ------------------------------------------------------------------ lifecycle
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="download-counter", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the worker and flush everything recorded so far."""
+        self._stop.set()
+        thread = self._thread
+        if thread and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+        with self._lock:
+            left = sum(self._counts.values())
+        if left:
+            print(f"[downloads] {left} increment(s) could not be flushed at shutdown")
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    # ------------------------------------------------------------------ producer side
+    def record(self, resource_id: str, user_id: str | None = None, downloaded_at: str | None = None):
+        """Count one download and queue its log row; returns immediately."""
+        self.start()
+        with self._lock:
+            self._counts[str(resource_id)] = self._counts.get(str(resource_id), 0) + 1
+            if not self._log_table_missing:
+                self._logs.append({"resource_id": resource_id, "user_id": user_id, "downloaded_at": downloaded_at})
+            self.recorded += 1
+
+    def pending(self, resource_id: str) -> int:
+        """Downloads recorded for a resource but not yet flushed."""
+        return self._counts.get(str(resource_id), 0)
+
+    # ------------------------------------------------------------------ flushing
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                logs, self._logs = self._logs, []
+            if not counts and not logs:
+                return
+            started = time.monotonic()
+            if counts:
+                failed = self._apply_counts(counts)
+                if failed:
+                    # Put unapplied increments back; they go out with the next flush
+                    with self._lock:
+                        for rid, n in failed.items():
+                            self._counts[rid] = self._counts.get(rid, 0) + n
+            if logs:
+                self._write_logs(logs)
+            self.flushes += 1
+            self.last_flush_ms = (time.monotonic() - started) * 1000.0
+
+    def _apply_counts(self, counts: dict[str, int]) -> dict[str, int]:
+        """Apply increments; returns the ones that could not be applied."""
+        if self._rpc_available():
+            try:
+                return self._apply_rpc(counts)
+            except Exception as e:
+                if self._rpc_unavailable_at is None:
+                    print(f"[downloads] {self.RPC_NAME} rpc not installed, using per-resource updates:", repr(e))
+                self._rpc_unavailable_at = time.monotonic()
+        failed: dict[str, int] = {}
+        for rid, n in counts.items():
+            try:
+                res = self.supabase.table("resources").select("download_count").eq("id", rid).limit(1).execute()
+                if not res.data:
+                    continue  # resource deleted meanwhile; nothing to count
+                current = res.data[0].get("download_count") or 0
+                self.supabase.table("resources").update({"download_count": current + n}).eq("id", rid).execute()
+                self.fallback_updates += 1
+                self.increments_applied += n
+            except Exception as e:
+                self.flush_errors += 1
+                if self._is_data_error(e):
+                    self.increments_dropped += n
+                    print(f"[downloads] dropping {n} increment(s) for {rid}:", repr(e))
+                    continue
+                print(f"[downloads] count update failed for {rid}:", repr(e))
+                failed[rid] = n
+        return failed
+
+    def _apply_rpc(self, counts: dict[str, int], split: bool = False) -> dict[str, int]:
+        """One RPC for the batch; returns the increments to retry.
+
+        Raises only when the function is missing on the first, unsplit call, so the
+        caller can switch to per-resource updates without double-applying anything.
+        """
+        try:
+            payload = [{"resource_id": rid, "n": n} for rid, n in counts.items()]
+            self.supabase.rpc(self.RPC_NAME, {"p_counts": payload}).execute()
+            self.rpc_calls += 1
+            self.increments_applied += sum(counts.values())
+            self._rpc_unavailable_at = None
+            return {}
+        except Exception as e:
+            if not split and self._is_missing_function(e):
+                raise
+            self.flush_errors += 1
+            if not self._is_data_error(e):
+                print(f"[downloads] {self.RPC_NAME} rpc failed, retrying next flush:", repr(e))
+                return counts
+            if len(counts) == 1:
+                rid, n = next(iter(counts.items()))
+                self.increments_dropped += n
+                print(f"[downloads] dropping {n} increment(s) for {rid}:", repr(e))
+                return {}
+            # The statement is atomic, so nothing was applied; retry each half on its own
+            items = list(counts.items())
+            mid = len(items) // 2
+            failed = self._apply_rpc(dict(items[:mid]), split=True)
+            failed.update(self._apply_rpc(dict(items[mid:]), split=True))
+            return failed
+
+    @classmethod
+    def _is_missing_function(cls, e: Exception) -> bool:
+        code = str(getattr(e, "code", "") or "")
+        return code in cls.MISSING_FUNCTION_CODES or any(c in str(e) for c in cls.MISSING_FUNCTION_CODES)
+
+    @classmethod
+    def _is_data_error(cls, e: Exception) -> bool:
+        code = str(getattr(e, "code", "") or "")
+        return len(code) == 5 and code[:2] in cls.DATA_ERROR_CLASSES
+
+    def _rpc_available(self) -> bool:
+        return self._rpc_unavailable_at is None or (time.monotonic() - self._rpc_unavailable_at) >= self.rpc_retry_seconds
+
+    def _write_logs(self, logs: list[dict]):
+        for i in range(0, len(logs), self.batch_size):
+            if self._log_table_missing:
+                self.logs_dropped += len(logs) - i
+                return
+            self._insert_logs(logs[i:i + self.batch_size])
+
+    def _insert_logs(self, chunk: list[dict]):
+        try:
+            self.supabase.table("resource_downloads").insert(chunk).execute()
+            self.logs_written += len(chunk)
+        except Exception as e:
+            # The log table is optional; stop collecting rows if it does not exist
+            if "resource_downloads" in str(e) and ("does not exist" in str(e) or "42P01" in str(e)):
+                self.logs_dropped += len(chunk)
+                self._log_table_missing = True
+                print("[downloads] resource_downloads table missing; download logging disabled")
+                return
+            self.flush_errors += 1
+            if self._is_data_error(e) and len(chunk) > 1:
+                # Keep the good rows: insert each half separately until the bad row is isolated
+                mid = len(chunk) // 2
+                self._insert_logs(chunk[:mid])
+                self._insert_logs(chunk[mid:])
+                return
+            self.logs_dropped += len(chunk)
+            print("[downloads] log insert failed:", repr(e))
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(self._counts.values())
+            pending_logs = len(self._logs)
+        return {
+            "pending_increments": pending,
+            "pending_logs": pending_logs,
+            "recorded": self.recorded,
+            "flushes": self.flushes,
+            "increments_applied": self.increments_applied,
+            "increments_dropped": self.increments_dropped,
+            "rpc_available": self._rpc_unavailable_at is None,
+            "rpc_calls": self.rpc_calls,
+            "fallback_updates": self.fallback_updates,
+            "logs_written": self.logs_written,
+            "logs_dropped": self.logs_dropped,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "flush_interval_ms": int(self.flush_interval * 1000),
+        }
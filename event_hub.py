@@ -0,0 +1,140 @@
+"""
+In-process pub/sub hub for pushing events to connected clients
+Request handlers (sync, running in the threadpool) publish per-user events; SSE
+connections (async) drain them. Each connection has a bounded buffer so one slow
+client can never hold memory or block publishers
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class Subscription:
+    """One live connection for a user: a bounded, drop-oldest event buffer."""
+
+    def __init__(self, hub: "EventHub", user_id: str, loop: asyncio.AbstractEventLoop, maxlen: int):
+        self.hub = hub
+        self.user_id = user_id
+        self.loop = loop
+        self.maxlen = maxlen
+        self.connected_at = time.time()
+        self._events: deque = deque()
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self.dropped = 0
+
+    def push(self, event: dict, coalesce_key: str | None = None) -> str:
+        """Buffer an event; returns 'queued', 'coalesced' or 'dropped_oldest'."""
+        outcome = "queued"
+        with self._lock:
+            if coalesce_key is not None:
+                # Newer state replaces an undelivered older event with the same key
+                for i, (key, _) in enumerate(self._events):
+                    if key == coalesce_key:
+                        self._events[i] = (coalesce_key, event)
+                        outcome = "coalesced"
+                        break
+            if outcome == "queued":
+                if len(self._events) >= self.maxlen:
+                    self._events.popleft()
+                    self.dropped += 1
+                    outcome = "dropped_oldest"
+                self._events.append((coalesce_key, event))
+        try:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Event loop already closed (server shutting down)
+            pass
+        return outcome
+
+    async def next_batch(self, timeout: float) -> list[dict]:
+        """Wait up to `timeout` seconds for events; [] means send a heartbeat."""
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._wakeup.clear()
+        with self._lock:
+            batch = [ev for _, ev in self._events]
+            self._events.clear()
+        return batch
+
+
+class EventHub:
+    """user_id -> live subscriptions; publish() is safe to call from any thread."""
+
+    def __init__(self, queue_size: int | None = None, heartbeat_seconds: float | None = None):
+        self.queue_size = queue_size or int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+        self.heartbeat_seconds = heartbeat_seconds or float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "15"))
+        self._subs: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.total_connections = 0
+
+    def subscribe(self, user_id: str, loop: asyncio.AbstractEventLoop) -> Subscription:
+        sub = Subscription(self, str(user_id), loop, self.queue_size)
+        with self._lock:
+            self._subs.setdefault(sub.user_id, set()).add(sub)
+            self.total_connections += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user_id]
+
+    def is_online(self, user_id: str) -> bool:
+        return bool(self._subs.get(str(user_id)))
+
+    def publish(self, user_ids, event: str, data: dict | None = None, coalesce_key: str | None = None) -> int:
+        """Push an event to every connection of the given user(s); returns connections reached."""
+        if isinstance(user_ids, str):
+            user_ids = [user_ids]
+        payload = {"id": next(self._ids), "event": event, "data": data or {}, "ts": time.time()}
+        reached = 0
+        for uid in dict.fromkeys(str(u) for u in (user_ids or []) if u):
+            with self._lock:
+                subs = list(self._subs.get(uid, ()))
+            for sub in subs:
+                outcome = sub.push(payload, coalesce_key=f"{event}:{coalesce_key}" if coalesce_key else None)
+                if outcome == "coalesced":
+                    self.coalesced += 1
+                elif outcome == "dropped_oldest":
+                    self.dropped += 1
+                reached += 1
+        self.published += 1
+        self.delivered += reached
+        return reached
+
+    @staticmethod
+    def format_sse(payload: dict) -> str:
+        data = json.dumps(payload.get("data"), default=str)
+        return f"id: {payload['id']}\nevent: {payload['event']}\ndata: {data}\n\n"
+
+    def stats(self) -> dict:
+        with self._lock:
+            connections = sum(len(s) for s in self._subs.values())
+            users = len(self._subs)
+        return {
+            "connections": connections,
+            "users_online": users,
+            "total_connections": self.total_connections,
+            "published": self.published,
+            "delivered": self.delivered,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "queue_size": self.queue_size,
+            "heartbeat_seconds": self.heartbeat_seconds,
+        }
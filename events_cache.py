@@ -0,0 +1,134 @@
+"""
+Month-bucketed events cache
+/api/events and /api/calendar read a month at a time; each (year, month) is fetched
+with one query and split into shared events per class and personal events per
+creator. A user's view is assembled from those partitions in memory, and event
+writes drop only the month buckets they touch
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+EVENT_SELECT = "*, courses(name, code)"
+
+
+def month_range(year: int, month: int) -> tuple[date, date]:
+    """[first day of the month, first day of the next month)."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def month_of(value) -> tuple[int, int] | None:
+    """(year, month) of a 'YYYY-MM-DD...' start_date, or None when unparseable."""
+    try:
+        s = str(value)
+        return int(s[0:4]), int(s[5:7])
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_key(e: dict):
+    return (e.get("start_date") or "", e.get("start_time") or "")
+
+
+class EventBucket:
+    """Events of one range split into the partitions the views are built from.
+
+    `shared` holds non-personal events by class (None for events without a class),
+    `personal` holds personal events by creator. When the table has no is_personal
+    column every event counts as shared, matching the old query fallback.
+    """
+
+    def __init__(self, rows: list[dict]):
+        self.rows = sorted(rows, key=_event_key)
+        self.shared: dict = {}
+        self.personal: dict[str, list[dict]] = {}
+        has_flag = any("is_personal" in e for e in self.rows) or not self.rows
+        for e in self.rows:
+            flag = e.get("is_personal") if has_flag else False
+            if flag is False:
+                self.shared.setdefault(e.get("class"), []).append(e)
+            elif flag is True and e.get("created_by") is not None:
+                self.personal.setdefault(str(e["created_by"]), []).append(e)
+
+    def visible(self, user_id: str | None = None, role: str | None = None, class_code=None) -> list[dict]:
+        """Events one user sees, sorted by (start_date, start_time); copies, safe to mutate.
+
+        No user: every event. Students with a class: their class's shared events;
+        everyone else: all shared events. Plus the user's personal events.
+        """
+        if not user_id:
+            picked = self.rows
+        else:
+            if role == "student" and class_code:
+                picked = list(self.shared.get(class_code, []))
+            else:
+                picked = [e for events in self.shared.values() for e in events]
+            picked += self.personal.get(str(user_id), [])
+            picked.sort(key=_event_key)
+        return [dict(e) for e in picked]
+
+
+class MonthlyEventsCache:
+    """EventBuckets per (year, month), LRU-bounded with a TTL for other workers' writes."""
+
+    def __init__(self, supabase, ttl: float | None = None, max_months: int | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("EVENTS_CACHE_TTL_SECONDS", "300"))
+        self.max_months = max_months or int(os.getenv("EVENTS_CACHE_MAX_MONTHS", "36"))
+        self._buckets: OrderedDict = OrderedDict()
+        # Bumped per month on invalidate so a fetch racing a write is not cached
+        self._generation: dict[tuple[int, int], int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def month(self, year: int, month: int) -> EventBucket:
+        key = (year, month)
+        with self._lock:
+            entry = self._buckets.get(key)
+            if entry is not None and (time.monotonic() - entry[0]) <= self.ttl:
+                self._buckets.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            generation = self._generation.get(key, 0)
+        self.misses += 1
+        start, end = month_range(year, month)
+        res = (
+            self.supabase.table("events").select(EVENT_SELECT)
+            .gte("start_date", start.isoformat()).lt("start_date", end.isoformat())
+            .order("start_date").execute()
+        )
+        bucket = EventBucket(res.data or [])
+        with self._lock:
+            if self._generation.get(key, 0) != generation:
+                return bucket
+            self._buckets[key] = (time.monotonic(), bucket)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_months:
+                self._buckets.popitem(last=False)
+        return bucket
+
+    def invalidate(self, *start_dates):
+        """Drop the month bucket of every given start_date (None values are ignored)."""
+        with self._lock:
+            for value in start_dates:
+                key = month_of(value) if value else None
+                if key is None:
+                    continue
+                self._generation[key] = self._generation.get(key, 0) + 1
+                if self._buckets.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            months = len(self._buckets)
+        return {"months": months, "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
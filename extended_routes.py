@@ -4,9 +4,18 @@ Additional endpoints for complete coverage
 """
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
+from uuid import UUID
 
-def add_extended_routes(app, supabase):
-    """Add all the extended routes to the FastAPI app"""
+from caches import is_global_resource
+from user_search import find_users
+
+def add_extended_routes(app, supabase, *, student_classes, user_profiles, global_resources, download_counter,
+                        resource_ids, search_index, suggestions, enrich_resources, search_rows, search_results_max, notify):
+    """Add all the extended routes to the FastAPI app.
+
+    The app module's shared caches, indexes and helpers are passed in, like the
+    supabase client, so handlers never import the app module back.
+    """
     
     # ============================================================================
     # ADDITIONAL USER ENDPOINTS
@@ -14,6 +23,11 @@ def add_extended_routes(app, supabase):
     
     @app.put("/api/users/me")
     def update_my_profile(data: dict):
+        # A profile change may move the user to another class or rename them; drop cached entries
+        uid = data.get("id") or data.get("user_id")
+        if uid:
+            student_classes.invalidate(uid)
+            user_profiles.invalidate(uid)
         return {"message": "Profile updated", "data": data}
     
     @app.put("/api/users/preferences")
@@ -80,18 +94,7 @@ def add_extended_routes(app, supabase):
             # If a student_id is provided, restrict by that student's class
             if student_id:
                 try:
-                    ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                    raw_class = (ures.data[0].get("class") if ures.data else None)
-                    candidates = []
-                    if raw_class:
-                        candidates.append(str(raw_class))
-                        try:
-                            cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                            if cres.data and cres.data[0].get("class"):
-                                candidates.append(str(cres.data[0].get("class")))
-                        except Exception:
-                            pass
-                    candidates = list(dict.fromkeys(candidates))
+                    candidates = student_classes.resolve(student_id)
                     if candidates:
                         if len(candidates) == 1:
                             q = q.eq("class", candidates[0])
@@ -149,27 +152,7 @@ def add_extended_routes(app, supabase):
             result = query.execute()
             rows = result.data or []
             # Best-effort enrichment
-            try:
-                user_ids = list({r.get("uploaded_by") for r in rows if r.get("uploaded_by")})
-                course_ids = list({r.get("course_id") for r in rows if r.get("course_id")})
-                user_map, course_map = {}, {}
-                if user_ids:
-                    ures = supabase.table("users").select("id, first_name, last_name").in_("id", user_ids).execute()
-                    for u in (ures.data or []):
-                        user_map[u["id"]] = {"first_name": u.get("first_name"), "last_name": u.get("last_name")}
-                if course_ids:
-                    cres = supabase.table("courses").select("id, name, code").in_("id", course_ids).execute()
-                    for c in (cres.data or []):
-                        course_map[c["id"]] = {"name": c.get("name"), "code": c.get("code")}
-                for r in rows:
-                    uid = r.get("uploaded_by")
-                    cid = r.get("course_id")
-                    if uid and uid in user_map:
-                        r["uploader"] = user_map[uid]
-                    if cid and cid in course_map:
-                        r["courses"] = course_map[cid]
-            except Exception:
-                pass
+            enrich_resources(rows)
             return {"resources": rows}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -179,24 +162,7 @@ def add_extended_routes(app, supabase):
         try:
             result = supabase.table("resources").select("*").eq("course_id", course_id).execute()
             rows = result.data or []
-            try:
-                user_ids = list({r.get("uploaded_by") for r in rows if r.get("uploaded_by")})
-                user_map = {}
-                if user_ids:
-                    ures = supabase.table("users").select("id, first_name, last_name").in_("id", user_ids).execute()
-                    for u in (ures.data or []):
-                        user_map[u["id"]] = {"first_name": u.get("first_name"), "last_name": u.get("last_name")}
-                # course is known (course_id), get name/code once
-                c = supabase.table("courses").select("name, code").eq("id", course_id).limit(1).execute()
-                cinfo = {"name": c.data[0].get("name"), "code": c.data[0].get("code")} if c.data else None
-                for r in rows:
-                    uid = r.get("uploaded_by")
-                    if uid and uid in user_map:
-                        r["uploader"] = user_map[uid]
-                    if cinfo:
-                        r["courses"] = cinfo
-            except Exception:
-                pass
+            enrich_resources(rows)
             return {"resources": rows}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -204,23 +170,18 @@ def add_extended_routes(app, supabase):
     @app.post("/api/resources/{resource_id}/download")
     def track_resource_download(resource_id: str, data: dict):
         try:
-            # Increment download count
-            result = supabase.table("resources").update({
-                "download_count": supabase.table("resources").select("download_count").eq("id", resource_id).execute().data[0]["download_count"] + 1
-            }).eq("id", resource_id).execute()
-            
-            # Log download in resource_downloads table
+            # Reject bad ids here: once queued, a bad id would fail the whole flush batch
             try:
-                supabase.table("resource_downloads").insert({
-                    "resource_id": resource_id,
-                    "user_id": data.get("user_id"),
-                    "downloaded_at": datetime.utcnow().isoformat() + "Z",
-                }).execute()
-            except Exception:
-                # Optional table might not exist; ignore logging failure
-                pass
-            
+                UUID(resource_id)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid resource id")
+            if resource_ids.get(resource_id) is None:
+                raise HTTPException(status_code=404, detail="Resource not found")
+            # Count + log in memory; the aggregator flushes atomic increments and log rows in batches
+            download_counter.record(resource_id, data.get("user_id"), datetime.utcnow().isoformat() + "Z")
             return {"message": f"Download tracked for resource {resource_id}"}
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
@@ -277,6 +238,11 @@ def add_extended_routes(app, supabase):
             
             result = supabase.table("resources").insert(resource_data).execute()
             created = result.data[0]
+            resource_ids.put(created)
+            search_index.upsert("resources", created)
+            suggestions.upsert("resource", created)
+            if is_global_resource(created):
+                global_resources.invalidate()
             # Notify target audience
             try:
                 recipients: list[str] = []
@@ -303,7 +269,6 @@ def add_extended_routes(app, supabase):
                         recipients = []
                 if recipients:
                     title = f"New resource: {created.get('title','')}"
-                    from simple_fastapi import notify  # local import to avoid circular during tooling
                     notify(recipients, "resource", title, actor_id=created.get("uploaded_by"), links={"resource_id": created.get("id")})
             except Exception:
                 pass
@@ -322,14 +287,7 @@ def add_extended_routes(app, supabase):
             if not existing_res.data:
                 raise HTTPException(status_code=404, detail="Resource not found")
             existing_row = existing_res.data[0]
-
-            def emptyish(v):
-                if v is None:
-                    return True
-                s = str(v).strip().lower()
-                return s == "" or s == "null" or s == "none"
-
-            is_global = emptyish(existing_row.get("course_id")) and emptyish(existing_row.get("class"))
+            is_global = is_global_resource(existing_row)
 
             # Determine acting user id (from query param or body)
             uid = user_id or data.get("user_id")
@@ -384,6 +342,11 @@ def add_extended_routes(app, supabase):
             
             result = supabase.table("resources").update(update_data).eq("id", resource_id).execute()
             updated = result.data[0]
+            search_index.upsert("resources", updated)
+            suggestions.upsert("resource", updated)
+            # Covers edits to a global row and a row moving into/out of the global set
+            if is_global or is_global_resource(updated):
+                global_resources.invalidate()
             # Notify affected audience
             try:
                 recipients: list[str] = []
@@ -406,7 +369,6 @@ def add_extended_routes(app, supabase):
                         recipients = []
                 if recipients:
                     title = f"Resource updated: {updated.get('title','')}"
-                    from simple_fastapi import notify
                     notify(recipients, "resource", title, actor_id=(user_id or updated.get("uploaded_by")), links={"resource_id": updated.get("id")})
             except Exception:
                 pass
@@ -422,14 +384,7 @@ def add_extended_routes(app, supabase):
             if not existing.data:
                 raise HTTPException(status_code=404, detail="Resource not found")
             row = existing.data[0]
-
-            def emptyish(v):
-                if v is None:
-                    return True
-                s = str(v).strip().lower()
-                return s == "" or s == "null" or s == "none"
-
-            is_global = emptyish(row.get("course_id")) and emptyish(row.get("class"))
+            is_global = is_global_resource(row)
 
             # Enforce permissions when acting user is known
             if user_id:
@@ -458,6 +413,11 @@ def add_extended_routes(app, supabase):
             except Exception:
                 prev_row = None
             result = supabase.table("resources").delete().eq("id", resource_id).execute()
+            resource_ids.invalidate(resource_id)
+            search_index.remove("resources", resource_id)
+            suggestions.remove("resource", resource_id)
+            if is_global:
+                global_resources.invalidate()
             try:
                 if prev_row:
                     recipients: list[str] = []
@@ -479,7 +439,6 @@ def add_extended_routes(app, supabase):
                         except Exception:
                             recipients = []
                     if recipients:
-                        from simple_fastapi import notify
                         notify(recipients, "resource", f"Resource deleted: {prev_row.get('title','')}", actor_id=user_id, links={"resource_id": resource_id})
             except Exception:
                 pass
@@ -496,20 +455,8 @@ def add_extended_routes(app, supabase):
                 raise HTTPException(status_code=400, detail="user_id is required")
             result = supabase.table("resources").select("*").eq("uploaded_by", user_id).order("created_at", desc=True).execute()
             rows = result.data or []
-            # Best-effort enrichment
-            try:
-                course_ids = list({r.get("course_id") for r in rows if r.get("course_id")})
-                course_map = {}
-                if course_ids:
-                    cres = supabase.table("courses").select("id, name, code").in_("id", course_ids).execute()
-                    for c in (cres.data or []):
-                        course_map[c["id"]] = {"name": c.get("name"), "code": c.get("code")}
-                for r in rows:
-                    cid = r.get("course_id")
-                    if cid and cid in course_map:
-                        r["courses"] = course_map[cid]
-            except Exception:
-                pass
+            # Best-effort enrichment (uploader is the caller)
+            enrich_resources(rows)
             return {"resources": rows}
         except HTTPException:
             raise
@@ -589,9 +536,9 @@ def add_extended_routes(app, supabase):
             # Resolve creator_name from users table (best-effort)
             creator_name = "Unknown"
             try:
-                creator = supabase.table("users").select("first_name, last_name").eq("id", creator_id).limit(1).execute()
-                if creator.data:
-                    creator_name = f"{creator.data[0].get('first_name', '')} {creator.data[0].get('last_name', '')}".strip() or "Unknown"
+                creator = user_profiles.get(creator_id)
+                if creator:
+                    creator_name = f"{creator.get('first_name', '')} {creator.get('last_name', '')}".strip() or "Unknown"
             except Exception:
                 pass
 
@@ -820,10 +767,10 @@ def add_extended_routes(app, supabase):
                 raise HTTPException(status_code=400, detail="User is already a member of this project")
             
             # Get user info
-            user = supabase.table("users").select("first_name, last_name").eq("id", user_id).execute()
+            user = user_profiles.get(user_id)
             user_name = "Unknown"
-            if user.data:
-                user_name = f"{user.data[0].get('first_name', '')} {user.data[0].get('last_name', '')}".strip()
+            if user:
+                user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
             
             # Add user to project arrays
             new_member_ids = member_ids + [user_id]
@@ -1042,21 +989,11 @@ def add_extended_routes(app, supabase):
     def search_assignments(q: str = "", student_id: str | None = None):
         try:
             qbuilder = supabase.table("assignments").select("*")
+            candidates = None
             # For students, scope search to their class
             if student_id:
                 try:
-                    ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                    raw_class = (ures.data[0].get("class") if ures.data else None)
-                    candidates = []
-                    if raw_class:
-                        candidates.append(str(raw_class))
-                        try:
-                            cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                            if cres.data and cres.data[0].get("class"):
-                                candidates.append(str(cres.data[0].get("class")))
-                        except Exception:
-                            pass
-                    candidates = list(dict.fromkeys(candidates))
+                    candidates = student_classes.resolve(student_id)
                     if not candidates:
                         return {"assignments": []}
                     if len(candidates) == 1:
@@ -1066,10 +1003,14 @@ def add_extended_routes(app, supabase):
                 except Exception:
                     return {"assignments": []}
             if q:
-                qbuilder = qbuilder.ilike("title", f"%{q}%")
-            else:
-                qbuilder = qbuilder.limit(10)
-            result = qbuilder.execute()
+                allowed = {str(c) for c in candidates} if candidates else None
+                rows = search_rows(
+                    "assignments", q, "title", limit=search_results_max,
+                    where=(lambda a: str(a.get("class")) in allowed) if allowed else None,
+                    fallback_filters={"class": list(candidates)} if candidates else None,
+                )
+                return {"assignments": rows}
+            result = qbuilder.limit(10).execute()
             return {"assignments": result.data}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -1078,9 +1019,8 @@ def add_extended_routes(app, supabase):
     def search_resources_specific(q: str = ""):
         try:
             if q:
-                result = supabase.table("resources").select("*").ilike("title", f"%{q}%").execute()
-            else:
-                result = supabase.table("resources").select("*").limit(10).execute()
+                return {"resources": search_rows("resources", q, "title", limit=search_results_max)}
+            result = supabase.table("resources").select("*").limit(10).execute()
             return {"resources": result.data}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -1089,9 +1029,8 @@ def add_extended_routes(app, supabase):
     def search_courses(q: str = ""):
         try:
             if q:
-                result = supabase.table("courses").select("*").ilike("name", f"%{q}%").execute()
-            else:
-                result = supabase.table("courses").select("*").limit(10).execute()
+                return {"courses": search_rows("courses", q, "name", limit=search_results_max)}
+            result = supabase.table("courses").select("*").limit(10).execute()
             return {"courses": result.data}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -1100,30 +1039,31 @@ def add_extended_routes(app, supabase):
     def search_users_specific(q: str = ""):
         try:
             if q:
-                result = supabase.table("users").select("*").ilike("first_name", f"%{q}%").execute()
-            else:
-                result = supabase.table("users").select("*").limit(10).execute()
+                return {"users": find_users(supabase, q, limit=50)}
+            result = supabase.table("users").select("*").limit(10).execute()
             return {"users": result.data}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
     @app.get("/api/search/suggestions")
-    def get_search_suggestions(q: str = ""):
+    def get_search_suggestions(q: str = "", limit: int = 8):
         try:
             if not q:
                 return {"suggestions": []}
                 
-            # Get suggestions from multiple tables
-            courses = supabase.table("courses").select("name").ilike("name", f"%{q}%").limit(3).execute()
-            assignments = supabase.table("assignments").select("title").ilike("title", f"%{q}%").limit(3).execute()
-            
-            suggestions = []
-            for course in (courses.data or []):
-                suggestions.append({"type": "course", "text": course["name"]})
-            for assignment in (assignments.data or []):
-                suggestions.append({"type": "assignment", "text": assignment["title"]})
+            # Top suggestions by popularity from the in-memory typeahead index
+            items = []
+            try:
+                items = suggestions.suggest(q, k=max(1, min(limit, 20)))
+            except RuntimeError:
+                courses = supabase.table("courses").select("name").ilike("name", f"%{q}%").limit(3).execute()
+                assignments = supabase.table("assignments").select("title").ilike("title", f"%{q}%").limit(3).execute()
+                for course in (courses.data or []):
+                    items.append({"type": "course", "text": course["name"]})
+                for assignment in (assignments.data or []):
+                    items.append({"type": "assignment", "text": assignment["title"]})
                 
-            return {"suggestions": suggestions}
+            return {"suggestions": items}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
@@ -63,6 +63,8 @@ const Chat: React.FC = () => {
   const [searchLoading, setSearchLoading] = useState(false);
   
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Delta-sync cursor for the open conversation (see /api/messages/:a/:b/since)
+  const syncCursorRef = useRef<string | null>(null);
 
   // API Functions
   const fetchConversations = async () => {
@@ -86,6 +88,7 @@ const Chat: React.FC = () => {
     if (!currentUserId) return;
     
     setLoadingMessages(true);
+    syncCursorRef.current = null;
     try {
       const response = await fetch(`${API_BASE_URL}/api/messages/${currentUserId}/${friendId}`);
       const data = await response.json();
@@ -95,6 +98,7 @@ const Chat: React.FC = () => {
         // Ensure ascending chronological order by local time
         list.sort((a, b) => new Date(a.created_at).getTime() - new Date(b.created_at).getTime());
         setMessages(list);
+        syncCursorRef.current = data.after_cursor || null;
         // Only mark messages as read when explicitly requested (when user opens conversation)
         if (markAsRead) {
           markMessagesAsRead(friendId);
@@ -111,6 +115,36 @@ const Chat: React.FC = () => {
     }
   };
 
+  // Background refresh: fetch only new messages and read-state changes
+  const pollMessages = async (friendId: string) => {
+    if (!currentUserId) return;
+    if (!syncCursorRef.current) {
+      fetchMessages(friendId, false);
+      return;
+    }
+    try {
+      const cursor = encodeURIComponent(syncCursorRef.current);
+      const response = await fetch(`${API_BASE_URL}/api/messages/${currentUserId}/${friendId}/since?cursor=${cursor}`);
+      const data = await response.json();
+      if (!response.ok) {
+        console.error('Failed to poll messages:', data);
+        return;
+      }
+      syncCursorRef.current = data.cursor || syncCursorRef.current;
+      const incoming = (data.messages || []) as Message[];
+      const readIds = new Set<string>((data.read_updates || []).map((r: any) => r.message_id));
+      if (incoming.length === 0 && readIds.size === 0) return;
+      setMessages(prev => {
+        const seen = new Set(prev.map(m => m.message_id));
+        const merged = prev.map(m => (readIds.has(m.message_id) ? { ...m, is_read: true } : m));
+        return merged.concat(incoming.filter(m => !seen.has(m.message_id)));
+      });
+      if (data.has_more) pollMessages(friendId);
+    } catch (error) {
+      console.error('Error polling messages:', error);
+    }
+  };
+
   const markMessagesAsRead = async (friendId: string) => {
     if (!currentUserId) return;
     
@@ -340,7 +374,7 @@ const Chat: React.FC = () => {
   useEffect(() => {
     if (selectedConversation && currentUserId) {
       const interval = setInterval(() => {
-        fetchMessages(selectedConversation.friend_id, false); // Don't mark as read on auto-refresh
+        pollMessages(selectedConversation.friend_id); // Delta only; doesn't mark as read
       }, 10000);
 
       return () => clearInterval(interval);
@@ -1104,10 +1104,11 @@ export const filesAPI = {
 
 // Notifications API calls
 export const notificationsAPI = {
-  async list(userId: string, unreadOnly?: boolean): Promise<ApiResponse<{ notifications: Notification[] }>> {
+  async list(userId: string, unreadOnly?: boolean, cursor?: string): Promise<ApiResponse<{ notifications: Notification[]; next_cursor?: string | null }>> {
     const params = new URLSearchParams();
     if (userId) params.set('user_id', userId);
     if (unreadOnly) params.set('unread_only', 'true');
+    if (cursor) params.set('cursor', cursor);
     const qs = params.toString() ? `?${params.toString()}` : '';
     return apiRequest(`/api/notifications${qs}`);
   },
@@ -1131,9 +1132,9 @@ export const notificationsAPI = {
   },
 
   async getUnreadCount(userId: string): Promise<number> {
-    const res = await notificationsAPI.list(userId, true);
+    const res = await apiRequest<{ unread_count: number }>(`/api/notifications/unread-count?user_id=${encodeURIComponent(userId)}`);
     if (res.error) return 0;
-    return res.data?.notifications?.length ?? 0;
+    return res.data?.unread_count ?? 0;
   }
 };
 
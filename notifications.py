@@ -0,0 +1,244 @@
+"""
+Notification write-behind dispatcher
+notify() hands rows to an in-process queue; a worker thread coalesces them into
+chunked bulk inserts so request handlers never wait on notification fan-out
+"""
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class NotificationSchema:
+    """Which recipient/type columns the `notifications` table has.
+
+    Current databases use recipient_id/notif_type; older ones still have user_id/type.
+    The table is probed once (at startup or on first use) and every notification
+    query is then built against the detected columns only. Rows are always handled
+    in the recipient_id/notif_type shape in code; to_storage()/normalize() translate.
+    """
+
+    CURRENT = ("recipient_id", "notif_type")
+    LEGACY = ("user_id", "type")
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self._columns: tuple[str, str] | None = None
+        self._lock = threading.Lock()
+
+    def probe(self) -> tuple[str, str]:
+        """Detect the column pair; an inconclusive probe is retried on the next call."""
+        if self._columns is not None:
+            return self._columns
+        with self._lock:
+            if self._columns is not None:
+                return self._columns
+            for cols in (self.CURRENT, self.LEGACY):
+                try:
+                    self.supabase.table("notifications").select(", ".join(cols)).limit(1).execute()
+                except Exception:
+                    continue
+                self._columns = cols
+                print(f"[notify] notifications schema: {'current' if cols == self.CURRENT else 'legacy'} ({cols[0]}/{cols[1]})")
+                return cols
+            print("[notify] notifications schema probe inconclusive; assuming current columns")
+            return self.CURRENT
+
+    @property
+    def recipient_col(self) -> str:
+        return self.probe()[0]
+
+    @property
+    def type_col(self) -> str:
+        return self.probe()[1]
+
+    def to_storage(self, row: dict) -> dict:
+        """Map a recipient_id/notif_type row onto the detected columns."""
+        recipient_col, type_col = self.probe()
+        if (recipient_col, type_col) == self.CURRENT:
+            return row
+        out = dict(row)
+        out[recipient_col] = out.pop("recipient_id", None)
+        out[type_col] = out.pop("notif_type", None)
+        return out
+
+    def normalize(self, row: dict) -> dict:
+        """Expose recipient_id/notif_type on a stored row whatever the schema."""
+        rr = dict(row)
+        if "recipient_id" not in rr and rr.get("user_id"):
+            rr["recipient_id"] = rr.get("user_id")
+        if "notif_type" not in rr and rr.get("type"):
+            rr["notif_type"] = rr.get("type")
+        return rr
+
+    def stats(self) -> dict:
+        cols = self._columns
+        return {"columns": list(cols) if cols else None, "legacy": cols == self.LEGACY if cols else None}
+
+
+class NotificationDispatcher:
+    """Background batcher for `notifications` inserts.
+
+    Rows are flushed when `batch_size` rows are pending or `flush_interval` seconds
+    after the first pending row, whichever comes first. Rows with different key sets
+    (optional link columns) go out as separate inserts, since PostgREST bulk inserts
+    need uniform keys. If the queue is full the caller writes its rows inline.
+    Rows are mapped onto the probed schema, so each chunk is inserted exactly once.
+    """
+
+    def __init__(self, supabase, schema: NotificationSchema, batch_size: int | None = None,
+                 flush_interval: float | None = None, max_queue: int | None = None):
+        self.supabase = supabase
+        self.schema = schema
+        self.batch_size = batch_size or int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("NOTIFY_FLUSH_INTERVAL_MS", "200")) / 1000.0
+        self._q: queue.Queue = queue.Queue(maxsize=max_queue or int(os.getenv("NOTIFY_QUEUE_MAX", "10000")))
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._pending_rows = 0
+        # metrics
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.flushes = 0
+        self.inline_writes = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # ------------------------------------------------------------------ lifecycle
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything queued so far and stop the worker."""
+        with self._lock:
+            thread = self._thread
+        if not thread or not thread.is_alive():
+            return
+        self._q.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            print(f"[notify] dispatcher did not drain within {timeout}s; {self._pending_rows} row(s) pending")
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything enqueued so far is written (True) or timeout expires."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._q.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # ------------------------------------------------------------------ producer side
+    def enqueue(self, rows: list[dict]):
+        """Queue rows for insertion and return immediately."""
+        if not rows:
+            return
+        self.start()
+        with self._lock:
+            self._pending_rows += len(rows)
+        try:
+            self._q.put_nowait(rows)
+        except queue.Full:
+            with self._lock:
+                self._pending_rows -= len(rows)
+            # Back-pressure: never drop notifications, write them on the caller's thread
+            self.inline_writes += 1
+            print(f"[notify] queue full; writing {len(rows)} row(s) inline")
+            self._write(rows)
+            return
+        self.enqueued += len(rows)
+
+    # ------------------------------------------------------------------ worker side
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._q.get()
+            if item is _STOP:
+                self._q.task_done()
+                break
+            batch, taken = list(item), 1
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.extend(item)
+            try:
+                self._write(batch)
+            finally:
+                with self._lock:
+                    self._pending_rows -= len(batch)
+                for _ in range(taken):
+                    self._q.task_done()
+
+    def _write(self, rows: list[dict]):
+        started = time.monotonic()
+        # Group by key set, then chunk each group to batch_size
+        groups: dict[tuple, list[dict]] = {}
+        for r in rows:
+            groups.setdefault(tuple(sorted(r.keys())), []).append(r)
+        for group in groups.values():
+            for i in range(0, len(group), self.batch_size):
+                chunk = group[i:i + self.batch_size]
+                try:
+                    inserted = self._insert(chunk)
+                except Exception as e:
+                    inserted = 0
+                    print("[notify] batch insert failed:", repr(e))
+                self.written += inserted
+                self.failed += len(chunk) - inserted
+                self.batches += 1
+                self.last_batch_size = len(chunk)
+                self.max_batch_size = max(self.max_batch_size, len(chunk))
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    def _insert(self, rows: list[dict]) -> int:
+        """Insert one uniform chunk using the detected notification columns."""
+        res = self.supabase.table("notifications").insert([self.schema.to_storage(r) for r in rows]).execute()
+        # Some supabase clients return errors without raising; detect by empty data
+        inserted = len(res.data or [])
+        if inserted == 0:
+            print(f"[notify] insert produced no rows for a batch of {len(rows)}")
+        return inserted
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._pending_rows,
+            "queued_calls": self._q.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "flushes": self.flushes,
+            "inline_writes": self.inline_writes,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "batch_size_limit": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+        }
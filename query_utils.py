@@ -0,0 +1,64 @@
+"""
+PostgREST query helpers
+Small builders for filters the pinned postgrest client has no method for
+(or-groups) and for opaque keyset-pagination cursors
+"""
+import base64
+import json
+
+
+def quote_value(value) -> str:
+    """Double-quote a value for use inside an or=(...) / and(...) expression.
+
+    Timestamps and free text contain ':', '.', ',' or parentheses, which PostgREST
+    would otherwise read as syntax.
+    """
+    s = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{s}"'
+
+
+def or_filter(q, expression: str):
+    """Apply `or=(<expression>)` to a query builder; `expression` is the body without parens."""
+    if hasattr(q, "or_"):
+        return q.or_(expression)
+    q.params = q.params.add("or", f"({expression})")
+    return q
+
+
+def order_by(q, *terms: str):
+    """Multi-column ordering, e.g. order_by(q, "created_at.desc", "id.desc").
+
+    Chained .order() calls emit repeated `order` params in this client version;
+    PostgREST wants a single comma-separated list.
+    """
+    q.params = q.params.set("order", ",".join(terms))
+    return q
+
+
+def keyset_before(q, ts_col: str, id_col: str, ts_value, id_value):
+    """Rows older than (ts_value, id_value): the next page in `ts_col desc, id_col desc` order."""
+    ts, rid = quote_value(ts_value), quote_value(id_value)
+    return or_filter(q, f"{ts_col}.lt.{ts},and({ts_col}.eq.{ts},{id_col}.lt.{rid})")
+
+
+def keyset_after(q, ts_col: str, id_col: str, ts_value, id_value):
+    """Rows newer than (ts_value, id_value): the next page in `ts_col asc, id_col asc` order."""
+    ts, rid = quote_value(ts_value), quote_value(id_value)
+    return or_filter(q, f"{ts_col}.gt.{ts},and({ts_col}.eq.{ts},{id_col}.gt.{rid})")
+
+
+def encode_cursor(*parts) -> str:
+    raw = json.dumps([str(p) for p in parts], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 2) -> list[str]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError("malformed cursor")
+    if not isinstance(parts, list) or len(parts) != size or not all(isinstance(p, str) for p in parts):
+        raise ValueError("malformed cursor")
+    return parts
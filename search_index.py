@@ -0,0 +1,454 @@
+"""
+In-process full-text search
+Tokenized inverted index over the searchable text columns of resources, assignments
+and courses, with prefix matching and BM25 ranking. Replaces leading-wildcard ilike
+queries, which no btree index can serve. Also a sorted-key typeahead index for
+search suggestions
+"""
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+PAGE_SIZE = 1000
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# table -> {column: field weight}; "filters" columns are kept for scoping, not indexed
+DEFAULT_SPECS = {
+    "resources": {"fields": {"title": 2.0, "description": 1.0, "tags": 1.5}, "filters": ("class", "course_id")},
+    "assignments": {"fields": {"title": 2.0, "description": 1.0}, "filters": ("class", "course_id")},
+    "courses": {"fields": {"name": 2.0, "code": 3.0}, "filters": ()},
+}
+
+
+def fetch_all(supabase, table: str, columns: str) -> list[dict]:
+    """Every row of `table`, fetched in id-ordered pages of PAGE_SIZE."""
+    rows: list[dict] = []
+    start = 0
+    while True:
+        res = supabase.table(table).select(columns).order("id").range(start, start + PAGE_SIZE - 1).execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
+
+def tokenize(text) -> list[str]:
+    if text is None:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text if t is not None)
+    return [t.casefold() for t in _TOKEN.findall(str(text))]
+
+
+class _TableIndex:
+    """Postings for one table: term -> {doc_id: weighted term frequency}."""
+
+    def __init__(self, fields: dict[str, float], filters: tuple[str, ...]):
+        self.fields = fields
+        self.filters = filters
+        self.postings: dict[str, dict[str, float]] = {}
+        self.doc_terms: dict[str, dict[str, float]] = {}
+        self.doc_len: dict[str, float] = {}
+        self.attrs: dict[str, dict] = {}
+        self.total_len = 0.0
+        self._vocab: list[str] | None = None
+
+    def add(self, row: dict):
+        doc_id = str(row.get("id") or "")
+        if not doc_id:
+            return
+        self.remove(doc_id)
+        terms: dict[str, float] = {}
+        for col, weight in self.fields.items():
+            for tok in tokenize(row.get(col)):
+                terms[tok] = terms.get(tok, 0.0) + weight
+        for term, tf in terms.items():
+            if term not in self.postings:
+                self._vocab = None
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = terms
+        self.doc_len[doc_id] = length
+        self.total_len += length
+        self.attrs[doc_id] = {c: row.get(c) for c in (*self.fields, *self.filters)}
+
+    def remove(self, doc_id: str):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+                    self._vocab = None
+        self.total_len -= self.doc_len.pop(doc_id, 0.0)
+        self.attrs.pop(doc_id, None)
+
+    def vocabulary(self) -> list[str]:
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        return self._vocab
+
+
+class SearchIndex:
+    """BM25 search over several tables, kept in memory.
+
+    Built on first use (or at startup via reload()), refreshed after `ttl` seconds so
+    writes from other workers surface, and updated in place through upsert()/remove()
+    by this process's write endpoints. Every query token must match (as a whole term
+    or as a term prefix); prefix matches score a little lower than exact ones.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    PREFIX_WEIGHT = 0.8
+    MAX_EXPANSIONS = 64
+
+    def __init__(self, supabase, specs: dict | None = None, ttl: float | None = None):
+        self.supabase = supabase
+        self.specs = specs or DEFAULT_SPECS
+        self.ttl = ttl or float(os.getenv("SEARCH_INDEX_TTL_SECONDS", "600"))
+        self._tables: dict[str, _TableIndex] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.RLock()
+        # Serializes builds, so concurrent searches on a cold index wait for one build
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.searches = 0
+        self.updates = 0
+        self.last_load_ms = 0.0
+
+    # ------------------------------------------------------------------ loading
+    def _needs_reload(self) -> bool:
+        return self._loaded_at is None or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def reload(self, force: bool = True) -> bool:
+        """Rebuild every table index; keeps the previous one on failure.
+
+        With force=False the build is skipped when another caller finished one while
+        this one waited for the build lock.
+        """
+        with self._load_lock:
+            if not force and not self._needs_reload():
+                return True
+            started = time.monotonic()
+            tables: dict[str, _TableIndex] = {}
+            try:
+                for table, spec in self.specs.items():
+                    idx = _TableIndex(spec["fields"], tuple(spec.get("filters") or ()))
+                    columns = ", ".join(dict.fromkeys(("id", *idx.fields, *idx.filters)))
+                    for row in fetch_all(self.supabase, table, columns):
+                        idx.add(row)
+                    tables[table] = idx
+            except Exception as e:
+                self.load_errors += 1
+                print("[search] index build failed:", repr(e))
+                return False
+            with self._lock:
+                self._tables = tables
+                self._loaded_at = time.monotonic()
+            self.loads += 1
+            self.last_load_ms = (time.monotonic() - started) * 1000.0
+            return True
+
+    def _ensure_loaded(self):
+        if self._needs_reload():
+            if not self.reload(force=False) and self._loaded_at is None:
+                raise RuntimeError("search index unavailable")
+
+    # ------------------------------------------------------------------ writes
+    def upsert(self, table: str, row: dict):
+        """Re-index a created/updated row (needs the indexed columns, e.g. the returned row)."""
+        with self._lock:
+            idx = self._tables.get(table)
+            if idx is not None and row:
+                idx.add(row)
+                self.updates += 1
+
+    def remove(self, table: str, doc_id):
+        with self._lock:
+            idx = self._tables.get(table)
+            if idx is not None and doc_id:
+                idx.remove(str(doc_id))
+                self.updates += 1
+
+    # ------------------------------------------------------------------ queries
+    def _expand(self, idx: _TableIndex, token: str) -> list[tuple[str, float]]:
+        """Terms matching a query token: the exact term plus terms it is a prefix of."""
+        vocab = idx.vocabulary()
+        out: list[tuple[str, float]] = []
+        i = bisect_left(vocab, token)
+        while i < len(vocab) and vocab[i].startswith(token) and len(out) < self.MAX_EXPANSIONS:
+            out.append((vocab[i], 1.0 if vocab[i] == token else self.PREFIX_WEIGHT))
+            i += 1
+        return out
+
+    def search(self, table: str, query: str, limit: int = 20, where=None) -> list[tuple[str, float]]:
+        """[(doc_id, score)] best first. `where(attrs) -> bool` scopes results (e.g. by class)."""
+        self._ensure_loaded()
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        self.searches += 1
+        with self._lock:
+            idx = self._tables.get(table)
+            if idx is None or not idx.doc_len:
+                return []
+            n_docs = len(idx.doc_len)
+            avgdl = (idx.total_len / n_docs) or 1.0
+            scores: dict[str, float] | None = None
+            for token in tokens:
+                best: dict[str, float] = {}
+                for term, weight in self._expand(idx, token):
+                    docs = idx.postings[term]
+                    idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for doc_id, tf in docs.items():
+                        norm = tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * idx.doc_len[doc_id] / avgdl))
+                        s = weight * idf * norm
+                        if s > best.get(doc_id, 0.0):
+                            best[doc_id] = s
+                # Every token has to match: intersect with the docs matched so far
+                if scores is None:
+                    scores = best
+                else:
+                    scores = {d: sc + best[d] for d, sc in scores.items() if d in best}
+                if not scores:
+                    return []
+            hits = scores.items()
+            if where is not None:
+                hits = [(d, sc) for d, sc in hits if where(idx.attrs.get(d) or {})]
+            ranked = sorted(hits, key=lambda kv: (-kv[1], kv[0]))
+        return ranked[:limit] if limit else ranked
+
+    def attrs(self, table: str, doc_id: str) -> dict:
+        """Indexed/filter column values held for a document ({} when unknown)."""
+        with self._lock:
+            idx = self._tables.get(table)
+            return dict(idx.attrs.get(str(doc_id)) or {}) if idx else {}
+
+    def hydrate(self, table: str, ranked: list[tuple[str, float]], columns: str = "*") -> list[dict]:
+        """Fetch full rows for ranked ids with one in_() query, preserving rank order."""
+        ids = [doc_id for doc_id, _ in ranked]
+        if not ids:
+            return []
+        res = self.supabase.table(table).select(columns).in_("id", ids).execute()
+        by_id = {str(r.get("id")): r for r in (res.data or [])}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            tables = {t: {"docs": len(i.doc_len), "terms": len(i.postings)} for t, i in self._tables.items()}
+        return {
+            "tables": tables,
+            "loaded": self._loaded_at is not None,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "last_load_ms": round(self.last_load_ms, 2),
+            "searches": self.searches,
+            "updates": self.updates,
+        }
+
+
+# Suggestion sources: kind -> (table, columns)
+SUGGESTION_SOURCES = {
+    "course": ("courses", "id, name"),
+    "assignment": ("assignments", "id, title, course_id"),
+    "resource": ("resources", "id, title, course_id, download_count"),
+    "user": ("users", "id, first_name, last_name"),
+}
+
+
+def suggestion_text(kind: str, row: dict) -> str:
+    if kind == "course":
+        return str(row.get("name") or "").strip()
+    if kind == "user":
+        return f"{row.get('first_name') or ''} {row.get('last_name') or ''}".strip()
+    return str(row.get("title") or "").strip()
+
+
+class SuggestionIndex:
+    """Typeahead over course names, assignment and resource titles and user names.
+
+    Every entry is keyed by its text from each word start ("Machine Learning" is found
+    by "mach" and by "learn"). Keys live in one sorted array, so a prefix is a bisect
+    plus a scan of its range; the top-k by popularity per prefix is kept in a small
+    LRU, and a longer prefix whose shorter prefix already had fewer than k matches is
+    answered by filtering that cached list. Popularity is a resource's download_count
+    and, for a course, the number of assignments and resources attached to it.
+    Writes go through upsert()/remove(); the whole index reloads after `ttl` seconds.
+    """
+
+    MAX_WORDS = 8
+
+    def __init__(self, supabase, ttl: float | None = None, cache_size: int | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("SUGGEST_INDEX_TTL_SECONDS", "600"))
+        self.cache_size = cache_size or int(os.getenv("SUGGEST_CACHE_SIZE", "2048"))
+        self._entries: dict[tuple[str, str], dict] = {}
+        self._keys: list[tuple[str, str, str]] = []
+        self._dirty = False
+        self._cache: OrderedDict = OrderedDict()
+        self._loaded_at: float | None = None
+        self._lock = threading.RLock()
+        # Serializes builds, so keystrokes on an expired index wait for one build
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.lookups = 0
+        self.cache_hits = 0
+        self.narrowed = 0
+        self.updates = 0
+
+    @staticmethod
+    def _entry(kind: str, row: dict, popularity: float = 0.0) -> dict | None:
+        text = suggestion_text(kind, row)
+        if not text or not row.get("id"):
+            return None
+        folded = text.casefold()
+        starts = [m.start() for m in _TOKEN.finditer(folded)][:SuggestionIndex.MAX_WORDS]
+        keys = tuple(dict.fromkeys(folded[i:] for i in starts)) or (folded,)
+        return {"type": kind, "id": str(row["id"]), "text": text, "popularity": popularity, "keys": keys}
+
+    def _needs_reload(self) -> bool:
+        return self._loaded_at is None or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def reload(self, force: bool = True) -> bool:
+        """Rebuild every entry; with force=False, skipped if another caller just did."""
+        with self._load_lock:
+            if not force and not self._needs_reload():
+                return True
+            entries: dict[tuple[str, str], dict] = {}
+            try:
+                rows = {kind: fetch_all(self.supabase, table, cols) for kind, (table, cols) in SUGGESTION_SOURCES.items()}
+            except Exception as e:
+                self.load_errors += 1
+                print("[suggest] index build failed:", repr(e))
+                return False
+            attached: dict[str, int] = {}
+            for row in rows["assignment"] + rows["resource"]:
+                if row.get("course_id"):
+                    attached[str(row["course_id"])] = attached.get(str(row["course_id"]), 0) + 1
+            for kind, kind_rows in rows.items():
+                for row in kind_rows:
+                    if kind == "course":
+                        pop = attached.get(str(row.get("id")), 0)
+                    else:
+                        pop = row.get("download_count") or 0
+                    entry = self._entry(kind, row, pop)
+                    if entry:
+                        entries[(kind, entry["id"])] = entry
+            with self._lock:
+                self._entries = entries
+                self._dirty = True
+                self._cache.clear()
+                self._loaded_at = time.monotonic()
+            self.loads += 1
+            return True
+
+    def _ensure_loaded(self):
+        if self._needs_reload():
+            if not self.reload(force=False) and self._loaded_at is None:
+                raise RuntimeError("suggestion index unavailable")
+
+    # ------------------------------------------------------------------ writes
+    def upsert(self, kind: str, row: dict):
+        """Add/refresh one entry; keeps its popularity unless the row carries download_count."""
+        with self._lock:
+            if self._loaded_at is None or not row:
+                return
+            old = self._entries.get((kind, str(row.get("id"))))
+            pop = row.get("download_count")
+            entry = self._entry(kind, row, pop if pop is not None else (old or {}).get("popularity", 0))
+            if entry is None:
+                return
+            self._entries[(kind, entry["id"])] = entry
+            self._dirty = True
+            self._cache.clear()
+            self.updates += 1
+
+    def remove(self, kind: str, doc_id):
+        with self._lock:
+            if self._entries.pop((kind, str(doc_id)), None) is not None:
+                self._dirty = True
+                self._cache.clear()
+                self.updates += 1
+
+    # ------------------------------------------------------------------ queries
+    @staticmethod
+    def _rank(entry: dict):
+        return (-entry["popularity"], len(entry["text"]), entry["text"].casefold())
+
+    def suggest(self, prefix: str, k: int = 8, kinds=None) -> list[dict]:
+        """Top-k entries with a word starting with `prefix`, most popular first."""
+        self._ensure_loaded()
+        needle = " ".join(prefix.casefold().split())
+        if not needle:
+            return []
+        kinds = tuple(sorted(kinds)) if kinds else None
+        self.lookups += 1
+        with self._lock:
+            if self._dirty:
+                self._keys = sorted((key, kind, doc_id) for (kind, doc_id), e in self._entries.items() for key in e["keys"])
+                self._dirty = False
+            cache_key = (needle, k, kinds)
+            hit = self._cache.get(cache_key)
+            if hit is not None:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return [self._public(e) for e in hit[0]]
+            matches = self._narrow(needle, k, kinds)
+            if matches is None:
+                matches = {}
+                i = bisect_left(self._keys, (needle,))
+                while i < len(self._keys) and self._keys[i][0].startswith(needle):
+                    _, kind, doc_id = self._keys[i]
+                    if kinds is None or kind in kinds:
+                        matches[(kind, doc_id)] = self._entries[(kind, doc_id)]
+                    i += 1
+                matches = list(matches.values())
+            else:
+                self.narrowed += 1
+            top = sorted(matches, key=self._rank)[:k]
+            # complete == every match is in `top`, so longer prefixes can filter it
+            self._cache[cache_key] = (top, len(matches) <= k)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return [self._public(e) for e in top]
+
+    def _narrow(self, needle: str, k: int, kinds) -> list[dict] | None:
+        """Matches from a cached complete result for a shorter prefix (typing forward)."""
+        for cut in range(len(needle) - 1, 0, -1):
+            hit = self._cache.get((needle[:cut], k, kinds))
+            if hit is not None:
+                if not hit[1]:
+                    return None
+                return [e for e in hit[0] if any(key.startswith(needle) for key in e["keys"])]
+        return None
+
+    @staticmethod
+    def _public(entry: dict) -> dict:
+        return {"type": entry["type"], "id": entry["id"], "text": entry["text"]}
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+            cached = len(self._cache)
+        return {
+            "entries": entries,
+            "cached_prefixes": cached,
+            "loaded": self._loaded_at is not None,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "lookups": self.lookups,
+            "cache_hits": self.cache_hits,
+            "narrowed": self.narrowed,
+            "updates": self.updates,
+        }
@@ -2,17 +2,33 @@
 Simple FastAPI-Supabase Backend
 Real authentication with Supabase users table
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import bcrypt
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 
 # Import extended routes
 from extended_routes import add_extended_routes
+from caches import EntityCache, FacultyCourseIndex, GlobalResourceSet, StudentClassResolver
+from time_utils import parse_clock_time
+from timetable_engine import SaturdayIndex, Slot, TimetableEngine
+from notifications import NotificationDispatcher, NotificationSchema
+from download_counter import DownloadCounter
+from events_cache import EVENT_SELECT, EventBucket, MonthlyEventsCache
+from query_utils import decode_cursor, encode_cursor, keyset_before, or_filter, order_by, quote_value
+from event_hub import EventHub
+from chat_service import ChatActivity, ConversationSummaries, UnreadCounters, conversation_page
+from chat_socket import ChatSocketServer
+from search_index import SearchIndex, SuggestionIndex
+from user_search import find_users
+from social import FriendGraph, FriendService
 
 # Load environment variables
 load_dotenv()
@@ -33,6 +49,51 @@ try:
 except Exception:
     pass
 
+# Shared student -> class candidates resolver (TTL/LRU cached per student_id)
+student_classes = StudentClassResolver(supabase)
+# faculty_id -> course ids index (lazy, warmed at startup)
+faculty_courses = FacultyCourseIndex(supabase)
+# Shared user profile rows (never includes password_hash)
+USER_PROFILE_COLUMNS = "id, first_name, last_name, email, roll_no, role, dept, class"
+user_profiles = EntityCache(supabase, "users", USER_PROFILE_COLUMNS)
+# Course display info (name/code) for enrichment
+course_info = EntityCache(supabase, "courses", "id, name, code, faculty_id")
+# Resources with no course and no class, shown on every resource page
+global_resources = GlobalResourceSet(supabase)
+# Ranked full-text search over resources, assignments and courses
+search_index = SearchIndex(supabase)
+# Calendar events per (year, month), split into shared-by-class and personal partitions
+events_cache = MonthlyEventsCache(supabase)
+# Typeahead suggestions (course/assignment/resource titles, user names)
+suggestions = SuggestionIndex(supabase)
+# Whole weekly timetable held in memory for current/next/today lookups
+timetable = TimetableEngine(supabase)
+saturday_index = SaturdayIndex(supabase)
+# Background writer for notify(): batched inserts off the request thread
+notification_schema = NotificationSchema(supabase)
+notifier = NotificationDispatcher(supabase, notification_schema)
+# Batched, atomic resource download counting (flushed every DOWNLOAD_FLUSH_INTERVAL_MS)
+download_counter = DownloadCounter(supabase)
+# Known resource ids, so a download for a missing resource is rejected before it is counted
+resource_ids = EntityCache(supabase, "resources", "id")
+# Push channel for connected clients (SSE at /api/stream/{user_id})
+hub = EventHub()
+# Chat list summaries (RPC when installed, bulk fallback otherwise)
+conversation_summaries = ConversationSummaries(supabase)
+# Newest message / read change per chat pair, so idle delta polls skip Supabase
+chat_activity = ChatActivity()
+# receiver -> sender -> unread count, rebuilt at startup and adjusted on every write
+unread_counters = UnreadCounters(supabase)
+# Friendship adjacency sets for are_friends() checks on the chat paths
+friend_graph = FriendGraph(supabase)
+friend_service = FriendService(supabase, user_profiles)
+# Largest page /api/messages/{user1_id}/{user2_id} will return
+MESSAGES_PAGE_MAX = int(os.getenv("MESSAGES_PAGE_MAX", "200"))
+# Read-state changes are re-read this far back on each delta poll
+CHAT_READ_SKEW_SECONDS = 2
+# Longest span /api/classes/range will expand (a month view plus padding)
+CLASS_RANGE_MAX_DAYS = int(os.getenv("CLASS_RANGE_MAX_DAYS", "62"))
+
 # Create FastAPI app
 app = FastAPI(
     title="AIE Portal API - Supabase Simple",
@@ -60,11 +121,14 @@ app.add_middleware(
 # ----------------------------------------------------------------------------
 def notify(recipients: list[str] | None, notif_type: str, title: str, message: str | None = None, actor_id: str | None = None, meta: dict | None = None,
            links: dict | None = None):
-    """Insert notifications for given recipients. Best-effort: swallow errors."""
+    """Queue notifications for given recipients. Best-effort: never raises.
+
+    Rows are written in the background by `notifier` (batched inserts), so callers
+    return without waiting for the fan-out.
+    """
     if not recipients:
         return
     try:
-        print(f"[notify] attempting insert; recipients={len(recipients)} type={notif_type} title={title[:40]!r}")
         rows = []
         for rid in recipients:
             row = {
@@ -80,66 +144,16 @@ def notify(recipients: list[str] | None, notif_type: str, title: str, message: s
                 for k, v in links.items():
                     row[k] = v
             rows.append(row)
-        if rows:
-            res = supabase.table("notifications").insert(rows).execute()
-            # Some supabase clients return errors without raising; detect by empty data
-            inserted = 0
-            try:
-                inserted = len(res.data or [])
-            except Exception:
-                inserted = 0
-            if inserted > 0:
-                print(f"[notify] ok; inserted={inserted}")
-            else:
-                print("[notify] primary insert produced no rows; attempting legacy fallback")
-                # Legacy fallback inline (user_id/type columns)
-                legacy_rows = []
-                for rid in (recipients or []):
-                    row = {
-                        "user_id": rid,
-                        "actor_id": actor_id,
-                        "type": notif_type,
-                        "title": title,
-                        "message": message,
-                        "meta": meta or {},
-                    }
-                    if links:
-                        for k, v in links.items():
-                            row[k] = v
-                    legacy_rows.append(row)
-                if legacy_rows:
-                    res2 = supabase.table("notifications").insert(legacy_rows).execute()
-                    try:
-                        inserted2 = len(res2.data or [])
-                    except Exception:
-                        inserted2 = 0
-                    print(f"[notify] legacy insert {'ok' if inserted2>0 else 'no-rows'}; inserted={inserted2}")
+        notifier.enqueue(rows)
+        print(f"[notify] queued; recipients={len(rows)} type={notif_type} title={title[:40]!r}")
+        hub.publish(recipients, "notification", {
+            "notif_type": notif_type, "title": title, "message": message,
+            "actor_id": actor_id, "meta": meta or {}, **(links or {}),
+        })
     except Exception as e:
         # do not break main flow on notification failure, but log for diagnosis
         try:
             print("[notify] failed:", repr(e))
-            # Legacy fallback: some DBs may still have user_id/type columns
-            try:
-                legacy_rows = []
-                for rid in (recipients or []):
-                    row = {
-                        "user_id": rid,  # legacy recipient_id
-                        "actor_id": actor_id,
-                        "type": notif_type,  # legacy notif_type
-                        "title": title,
-                        "message": message,
-                        "meta": meta or {},
-                    }
-                    if links:
-                        for k, v in links.items():
-                            row[k] = v
-                    legacy_rows.append(row)
-                if legacy_rows:
-                    res2 = supabase.table("notifications").insert(legacy_rows).execute()
-                    inserted2 = len(res2.data or [])
-                    print(f"[notify] legacy insert ok; inserted={inserted2}")
-            except Exception as e2:
-                print("[notify] legacy fallback failed:", repr(e2))
         except Exception:
             pass
 
@@ -150,41 +164,19 @@ def notifications_self_test(data: dict):
         rid = data.get("recipient_id")
         if not rid:
             raise HTTPException(status_code=400, detail="recipient_id is required")
-        test_title = data.get("title") or "Test notification"
-        test_type = data.get("notif_type") or "system"
         payload = {
             "recipient_id": rid,
             "actor_id": data.get("actor_id"),
-            "notif_type": test_type,
-            "title": test_title,
+            "notif_type": data.get("notif_type") or "system",
+            "title": data.get("title") or "Test notification",
             "message": data.get("message"),
             "meta": data.get("meta") or {"source": "self-test"}
         }
-        # Primary attempt
-        res = None
-        first_err = None
-        try:
-            res = supabase.table("notifications").insert(payload).execute()
-        except Exception as e1:
-            first_err = str(e1)
+        res = supabase.table("notifications").insert(notification_schema.to_storage(payload)).execute()
+        columns = notification_schema.stats()["columns"]
         if res and getattr(res, 'data', None):
-            return {"ok": True, "inserted": len(res.data or []), "row": (res.data[0] if res.data else None)}
-        # Legacy fallback (user_id/type)
-        legacy = {
-            "user_id": rid,
-            "actor_id": data.get("actor_id"),
-            "type": test_type,
-            "title": test_title,
-            "message": data.get("message"),
-            "meta": data.get("meta") or {"source": "self-test"}
-        }
-        try:
-            res2 = supabase.table("notifications").insert(legacy).execute()
-            if res2 and getattr(res2, 'data', None):
-                return {"ok": True, "inserted": len(res2.data or []), "row": (res2.data[0] if res2.data else None), "note": "legacy-insert"}
-            return {"ok": False, "error": "Insert returned no rows for both variants", "first_error": first_err}
-        except Exception as e2:
-            return {"ok": False, "error": str(e2), "first_error": first_err}
+            return {"ok": True, "inserted": len(res.data or []), "row": (res.data[0] if res.data else None), "columns": columns}
+        return {"ok": False, "error": "Insert returned no rows", "columns": columns}
     except HTTPException:
         raise
     except Exception as e:
@@ -192,105 +184,70 @@ def notifications_self_test(data: dict):
         return {"ok": False, "error": str(e)}
 
 # Basic notifications endpoints (list, read, read-all, delete, create)
-@app.get("/api/notifications")
-def list_notifications(user_id: str | None = None, unread_only: bool = False):
-    try:
-        # Collect from BOTH new schema (recipient_id) and legacy (user_id) and then merge + sort.
-        collected: list[dict] = []
+NOTIFICATIONS_PAGE_MAX = 200
 
-        # New schema query
-        try:
-            q = supabase.table("notifications").select("*")
-            if user_id:
-                q = q.eq("recipient_id", user_id)
-            if unread_only:
-                try:
-                    q = q.eq("is_read", False)
-                except Exception:
-                    pass
-            try:
-                q = q.order("created_at", desc=True)
-            except Exception:
-                try:
-                    q = q.order("id", desc=True)
-                except Exception:
-                    pass
-            res = q.limit(100).execute()
-            collected.extend(res.data or [])
-        except Exception:
-            pass
+@app.get("/api/notifications")
+def list_notifications(user_id: str | None = None, unread_only: bool = False, limit: int = 100, cursor: str | None = None):
+    """Newest-first notifications, keyset-paginated on (created_at, id).
 
-        # Legacy schema query (only when filtering by a specific user)
+    Pass the returned next_cursor back as `cursor` for the following page; it is
+    null on the last page. Filters line up with idx_notifications_recipient.
+    """
+    try:
+        limit = max(1, min(limit, NOTIFICATIONS_PAGE_MAX))
+        # One query against whichever recipient column the schema probe found
+        q = supabase.table("notifications").select("*")
         if user_id:
+            q = q.eq(notification_schema.recipient_col, user_id)
+        if unread_only:
+            q = q.eq("is_read", False)
+        if cursor:
             try:
-                q2 = supabase.table("notifications").select("*")
-                q2 = q2.eq("user_id", user_id)
-                if unread_only:
-                    try:
-                        q2 = q2.eq("is_read", False)
-                    except Exception:
-                        pass
-                try:
-                    q2 = q2.order("created_at", desc=True)
-                except Exception:
-                    try:
-                        q2 = q2.order("id", desc=True)
-                    except Exception:
-                        pass
-                res2 = q2.limit(100).execute()
-                collected.extend(res2.data or [])
-            except Exception:
-                pass
+                ts, last_id = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            q = keyset_before(q, "created_at", "id", ts, last_id)
+        # Fetch one extra row to know whether another page exists
+        res = order_by(q, "created_at.desc", "id.desc").limit(limit + 1).execute()
+        rows = res.data or []
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].get("created_at"), rows[-1].get("id"))
+        return {"notifications": [notification_schema.normalize(r) for r in rows], "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Normalize keys and de-duplicate by id
-        norm_map: dict[str, dict] = {}
-        for r in collected:
-            rr = dict(r)
-            if "recipient_id" not in rr and rr.get("user_id"):
-                rr["recipient_id"] = rr.get("user_id")
-            if "notif_type" not in rr and rr.get("type"):
-                rr["notif_type"] = rr.get("type")
-            rid = str(rr.get("id")) if rr.get("id") is not None else None
-            if rid and rid not in norm_map:
-                norm_map[rid] = rr
-            elif not rid:
-                # If row has no id (shouldn't happen), include using a synthetic key
-                norm_map[f"noid-{len(norm_map)}"] = rr
-
-        # Sort by created_at desc when available
-        def sort_key(item: tuple[str, dict]):
-            r = item[1]
-            ts = r.get("created_at")
-            return (ts or ""), str(r.get("id") or "")
-
-        # Limit to 100 after merge
-        merged = [v for _, v in sorted(norm_map.items(), key=sort_key, reverse=True)][:100]
-        return {"notifications": merged}
+@app.get("/api/notifications/unread-count")
+def get_unread_notification_count(user_id: str):
+    """Unread badge count only; no rows are transferred."""
+    try:
+        # count=exact is read from Content-Range; a 1-row limit keeps the body trivial
+        # (this client drops the count on head-only requests)
+        res = (
+            supabase.table("notifications")
+            .select("id", count="exact")
+            .eq(notification_schema.recipient_col, user_id)
+            .eq("is_read", False)
+            .limit(1)
+            .execute()
+        )
+        return {"unread_count": res.count or 0}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/notifications/{notification_id}/read")
 def mark_notification_read(notification_id: str, user_id: str | None = None):
     try:
-        updated = 0
-        # Try new schema first
-        try:
-            q = supabase.table("notifications").update({"is_read": True}).eq("id", notification_id)
-            if user_id:
-                q = q.eq("recipient_id", user_id)
-            res = q.execute()
-            updated = len(res.data or [])
-        except Exception:
-            updated = 0
-        # If nothing updated and user_id provided, try legacy user_id column
-        if updated == 0 and user_id:
-            try:
-                q2 = supabase.table("notifications").update({"is_read": True}).eq("id", notification_id).eq("user_id", user_id)
-                res2 = q2.execute()
-                updated = len(res2.data or [])
-            except Exception:
-                pass
-        return {"message": "Notification marked as read", "updated": updated}
+        q = supabase.table("notifications").update({"is_read": True}).eq("id", notification_id)
+        if user_id:
+            q = q.eq(notification_schema.recipient_col, user_id)
+        res = q.execute()
+        if user_id and res.data:
+            hub.publish(user_id, "notifications_read", {"ids": [r.get("id") for r in res.data]})
+        return {"message": "Notification marked as read", "updated": len(res.data or [])}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -299,33 +256,16 @@ def mark_all_notifications_read(user_id: str):
     try:
         if not user_id:
             raise HTTPException(status_code=400, detail="user_id is required")
-        updated = 0
-        # New schema attempt
-        try:
-            res = (
-                supabase
-                .table("notifications")
-                .update({"is_read": True})
-                .eq("recipient_id", user_id)
-                .eq("is_read", False)
-                .execute()
-            )
-            updated = len(res.data or [])
-        except Exception:
-            updated = 0
-        # Legacy fallback if nothing updated
-        if updated == 0:
-            try:
-                q2 = supabase.table("notifications").update({"is_read": True}).eq("user_id", user_id)
-                try:
-                    q2 = q2.eq("is_read", False)
-                except Exception:
-                    pass
-                res2 = q2.execute()
-                updated = len(res2.data or [])
-            except Exception:
-                pass
-        return {"message": "All notifications marked as read", "updated": updated}
+        res = (
+            supabase
+            .table("notifications")
+            .update({"is_read": True})
+            .eq(notification_schema.recipient_col, user_id)
+            .eq("is_read", False)
+            .execute()
+        )
+        hub.publish(user_id, "notifications_read", {"all": True}, coalesce_key="all")
+        return {"message": "All notifications marked as read", "updated": len(res.data or [])}
     except HTTPException:
         raise
     except Exception as e:
@@ -334,22 +274,11 @@ def mark_all_notifications_read(user_id: str):
 @app.delete("/api/notifications/{notification_id}")
 def delete_notification(notification_id: str, user_id: str | None = None):
     try:
-        deleted = 0
-        try:
-            q = supabase.table("notifications").delete().eq("id", notification_id)
-            if user_id:
-                q = q.eq("recipient_id", user_id)
-            res = q.execute()
-            deleted = len(res.data or []) if hasattr(res, 'data') else 1
-        except Exception:
-            deleted = 0
-        if deleted == 0 and user_id:
-            try:
-                q2 = supabase.table("notifications").delete().eq("id", notification_id).eq("user_id", user_id)
-                res2 = q2.execute()
-                deleted = len(res2.data or []) if hasattr(res2, 'data') else 1
-            except Exception:
-                pass
+        q = supabase.table("notifications").delete().eq("id", notification_id)
+        if user_id:
+            q = q.eq(notification_schema.recipient_col, user_id)
+        res = q.execute()
+        deleted = len(res.data or []) if hasattr(res, 'data') else 1
         return {"message": "Notification deleted", "deleted": deleted}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -372,8 +301,8 @@ def create_notification(data: dict):
         for key in ["resource_id", "assignment_id", "event_id", "timetable_id", "saturday_row_id"]:
             if data.get(key) is not None:
                 row[key] = data.get(key)
-        res = supabase.table("notifications").insert(row).execute()
-        return {"message": "Notification created", "notification": res.data[0] if res.data else None}
+        res = supabase.table("notifications").insert(notification_schema.to_storage(row)).execute()
+        return {"message": "Notification created", "notification": notification_schema.normalize(res.data[0]) if res.data else None}
     except HTTPException:
         raise
     except Exception as e:
@@ -392,6 +321,58 @@ def health_check():
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.on_event("startup")
+def warm_caches():
+    """Pre-load lookup indexes so the first requests do not pay for the scan."""
+    if faculty_courses.warm():
+        print(f"[boot] faculty->courses index warmed ({faculty_courses.stats()['faculty']} faculty)")
+    if timetable.reload():
+        print(f"[boot] timetable loaded ({timetable.stats()['rows']} rows)")
+    saturday_index.reload()
+    friend_graph.reload()
+    if search_index.reload():
+        print(f"[boot] search index built ({search_index.stats()['last_load_ms']} ms)")
+    if suggestions.reload():
+        print(f"[boot] suggestion index built ({suggestions.stats()['entries']} entries)")
+    if unread_counters.rebuild():
+        print(f"[boot] unread counters built ({unread_counters.stats()['unread_total']} unread)")
+    notification_schema.probe()
+    notifier.start()
+    download_counter.start()
+
+@app.on_event("shutdown")
+def flush_background_writers():
+    """Drain queued notifications and download counts before the process exits."""
+    notifier.stop()
+    download_counter.stop()
+    search_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/debug/metrics")
+def debug_metrics():
+    """Hit/miss counters and sizes for the in-process caches."""
+    return {
+        "student_classes": student_classes.stats(),
+        "faculty_courses": faculty_courses.stats(),
+        "user_profiles": user_profiles.stats(),
+        "course_info": course_info.stats(),
+        "global_resources": global_resources.stats(),
+        "search_index": search_index.stats(),
+        "suggestions": suggestions.stats(),
+        "events_cache": events_cache.stats(),
+        "friend_graph": friend_graph.stats(),
+        "timetable": timetable.stats(),
+        "saturday_class": saturday_index.stats(),
+        "notifications": notifier.stats(),
+        "downloads": download_counter.stats(),
+        "notification_schema": notification_schema.stats(),
+        "realtime": hub.stats(),
+        "chat_socket": chat_socket.stats(),
+        "conversations": conversation_summaries.stats(),
+        "chat_activity": chat_activity.stats(),
+        "unread_counters": unread_counters.stats(),
+        "time_parse": parse_clock_time.cache_info()._asdict(),
+    }
+
 @app.get("/debug/saturday-classes")
 def debug_saturday_classes():
     try:
@@ -688,6 +669,10 @@ def register(data: dict):
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to create user")
 
+        # Drop any empty mapping cached for this id before the row existed
+        student_classes.invalidate(result.data[0].get("id"))
+        suggestions.upsert("user", result.data[0])
+
         # Shape response without password_hash and add compatibility fields
         user_response = {k: v for k, v in result.data[0].items() if k != "password_hash"}
         if "roll_no" in user_response and "student_id" not in user_response:
@@ -759,30 +744,8 @@ def search_users(query: str = ""):
             result = supabase.table("users").select("*").limit(20).execute()
             return {"users": result.data or []}
 
-        # Robust multi-field search only on text columns to avoid DB errors
-        pattern = f"%{q}%"
-        combined_results = []
-        seen_ids = set()
-        text_fields = ["first_name", "last_name", "email", "roll_no", "dept"]  # include new signup fields
-
-        for field in text_fields:
-            try:
-                res = (
-                    supabase
-                    .table("users")
-                    .select("*")
-                    .ilike(field, pattern)
-                    .limit(50)
-                    .execute()
-                )
-                for row in (res.data or []):
-                    uid = row.get("id")
-                    if uid and uid not in seen_ids:
-                        combined_results.append(row)
-                        seen_ids.add(uid)
-            except Exception:
-                # Continue to next field if any single search fails
-                continue
+        # One ranked query across first_name/last_name/email/roll_no/dept
+        combined_results = find_users(supabase, q, limit=50)
 
         # As a last resort, if nothing matched, return a small sample to avoid empty UI
         if not combined_results:
@@ -844,21 +807,7 @@ def get_dashboard(faculty_id: str | None = None, student_id: str | None = None):
         )
         if student_id:
             # resolve student's class code string; users.class may store id or code
-            class_candidates: list[str] = []
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                if raw_class:
-                    class_candidates.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            class_candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-            except Exception:
-                class_candidates = []
-            class_candidates = list(dict.fromkeys(class_candidates))
+            class_candidates = student_classes.resolve(student_id)
             if class_candidates:
                 if len(class_candidates) == 1:
                     q_classes = q_classes.eq("class", class_candidates[0])
@@ -867,11 +816,7 @@ def get_dashboard(faculty_id: str | None = None, student_id: str | None = None):
             else:
                 q_classes = q_classes.limit(0)
         elif faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if course_ids:
                 q_classes = q_classes.in_("course_id", course_ids)
             else:
@@ -879,23 +824,8 @@ def get_dashboard(faculty_id: str | None = None, student_id: str | None = None):
         classes = q_classes.limit(5).execute()
         # Recent assignments, optionally filtered to courses taught by a faculty or student's class
         if student_id:
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                # Build class candidates: include raw value and resolved class code (if raw is an id)
-                class_candidates = []
-                if raw_class:
-                    class_candidates.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            class_candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-                # Deduplicate
-                class_candidates = list(dict.fromkeys(class_candidates))
-            except Exception:
-                class_candidates = []
+            # Same cached candidates as above (raw value + resolved class code)
+            class_candidates = student_classes.resolve(student_id)
             # If we cannot resolve student's class, do NOT leak all assignments; return none
             if not class_candidates:
                 assignments = type('obj', (object,), {'data': []})()
@@ -907,11 +837,7 @@ def get_dashboard(faculty_id: str | None = None, student_id: str | None = None):
                     qa = qa.in_("class", class_candidates)
                 assignments = qa.order("due_date").limit(5).execute()
         elif faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if course_ids:
                 assignments = (
                     supabase
@@ -949,82 +875,39 @@ def get_current_class(faculty_id: str | None = None, student_id: str | None = No
         now = datetime.now()
         current_day = now.strftime('%A').lower()  # Get day name: monday, tuesday, etc.
         current_time = now.time()
-        # Get all classes for today (updated for ENUM day_of_week), optionally filtered by faculty's courses
+        # Today's classes come from the in-memory timetable, optionally filtered by faculty's courses
         course_ids = None
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
-        q = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", current_day)
-        if course_ids is not None:
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"current_class": None}
-            q = q.in_("course_id", course_ids)
+        class_candidates = None
         if student_id:
-            class_candidates: list[str] = []
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                if raw_class:
-                    class_candidates.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            class_candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-            except Exception:
-                class_candidates = []
-            class_candidates = list(dict.fromkeys(class_candidates))
+            class_candidates = student_classes.resolve(student_id)
             if not class_candidates:
                 return {"current_class": None}
-            if len(class_candidates) == 1:
-                q = q.eq("class", class_candidates[0])
-            else:
-                q = q.in_("class", class_candidates)
-        result = q.execute()
-        if not result.data:
+        slot = timetable.current(current_day, current_time, classes=class_candidates, course_ids=course_ids)
+        if not slot:
             return {"current_class": None}
-        # Find current class (if any)
-        for class_item in result.data:
-            start_time_str = class_item["start_time"]
-            end_time_str = class_item["end_time"]
-            if 'T' in start_time_str:
-                start_time = datetime.fromisoformat(start_time_str.replace('Z', '')).time()
-            else:
-                try:
-                    start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-                except ValueError:
-                    start_time = datetime.strptime(start_time_str, "%H:%M").time()
-            if 'T' in end_time_str:
-                end_time = datetime.fromisoformat(end_time_str.replace('Z', '')).time()
-            else:
-                try:
-                    end_time = datetime.strptime(end_time_str, "%H:%M:%S").time()
-                except ValueError:
-                    end_time = datetime.strptime(end_time_str, "%H:%M").time()
-            if start_time <= current_time <= end_time:
-                start_datetime = datetime.combine(now.date(), start_time)
-                end_datetime = datetime.combine(now.date(), end_time)
-                total_duration = end_datetime - start_datetime
-                elapsed_time = now - start_datetime
-                time_remaining = end_datetime - now
-                progress_percentage = min(100, max(0, (elapsed_time.total_seconds() / total_duration.total_seconds()) * 100))
-                minutes_remaining = int(time_remaining.total_seconds() / 60)
-                if minutes_remaining <= 1:
-                    class_item["time_remaining"] = "Ending soon"
-                elif minutes_remaining < 60:
-                    class_item["time_remaining"] = f"{minutes_remaining} min left"
-                else:
-                    hours = minutes_remaining // 60
-                    mins = minutes_remaining % 60
-                    class_item["time_remaining"] = f"{hours}h {mins}m left"
-                class_item["status"] = "ongoing"
-                class_item["progress_percentage"] = round(progress_percentage, 1)
-                return {"current_class": class_item}
-        return {"current_class": None}
+        class_item, start_time, end_time = slot.row, slot.start, slot.end
+        start_datetime = datetime.combine(now.date(), start_time)
+        end_datetime = datetime.combine(now.date(), end_time)
+        total_duration = end_datetime - start_datetime
+        elapsed_time = now - start_datetime
+        time_remaining = end_datetime - now
+        progress_percentage = min(100, max(0, (elapsed_time.total_seconds() / total_duration.total_seconds()) * 100)) if total_duration.total_seconds() > 0 else 100
+        minutes_remaining = int(time_remaining.total_seconds() / 60)
+        if minutes_remaining <= 1:
+            class_item["time_remaining"] = "Ending soon"
+        elif minutes_remaining < 60:
+            class_item["time_remaining"] = f"{minutes_remaining} min left"
+        else:
+            hours = minutes_remaining // 60
+            mins = minutes_remaining % 60
+            class_item["time_remaining"] = f"{hours}h {mins}m left"
+        class_item["status"] = "ongoing"
+        class_item["progress_percentage"] = round(progress_percentage, 1)
+        return {"current_class": class_item}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1037,127 +920,51 @@ def get_next_class(faculty_id: str | None = None, student_id: str | None = None)
         current_day = now.strftime('%A').lower()
         current_time = now.time()
         next_class = None
-        min_time_diff = None
         course_ids = None
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
-        q_today = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", current_day)
-        if course_ids is not None:
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"next_class": None}
-            q_today = q_today.in_("course_id", course_ids)
+        class_candidates = None
         if student_id:
-            class_candidates: list[str] = []
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                if raw_class:
-                    class_candidates.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            class_candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-            except Exception:
-                class_candidates = []
-            class_candidates = list(dict.fromkeys(class_candidates))
+            class_candidates = student_classes.resolve(student_id)
             if not class_candidates:
                 return {"next_class": None}
-            if len(class_candidates) == 1:
-                q_today = q_today.eq("class", class_candidates[0])
+        slot = timetable.next_after(current_day, current_time, classes=class_candidates, course_ids=course_ids)
+        if slot:
+            next_class = slot.row
+            time_diff = datetime.combine(now.date(), slot.start) - now
+            hours = int(time_diff.total_seconds() / 3600)
+            minutes = int((time_diff.total_seconds() % 3600) / 60)
+            if hours > 0:
+                next_class["time_until"] = f"Starts in {hours}h {minutes}m"
             else:
-                q_today = q_today.in_("class", class_candidates)
-        today_result = q_today.execute()
-        if today_result.data:
-            for class_item in today_result.data:
-                start_time_str = class_item["start_time"]
-                if 'T' in start_time_str:
-                    start_time = datetime.fromisoformat(start_time_str.replace('Z', '')).time()
+                if minutes <= 5:
+                    next_class["time_until"] = "Starting soon"
                 else:
-                    try:
-                        start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-                    except ValueError:
-                        start_time = datetime.strptime(start_time_str, "%H:%M").time()
-                if start_time > current_time:
-                    start_datetime = datetime.combine(now.date(), start_time)
-                    time_diff = start_datetime - now
-                    if min_time_diff is None or time_diff < min_time_diff:
-                        min_time_diff = time_diff
-                        next_class = class_item
-                        if time_diff.days == 0:
-                            hours = int(time_diff.total_seconds() / 3600)
-                            minutes = int((time_diff.total_seconds() % 3600) / 60)
-                            if hours > 0:
-                                next_class["time_until"] = f"Starts in {hours}h {minutes}m"
-                            else:
-                                if minutes <= 5:
-                                    next_class["time_until"] = "Starting soon"
-                                else:
-                                    next_class["time_until"] = f"Starts in {minutes} min"
-                        next_class["status"] = "upcoming"
+                    next_class["time_until"] = f"Starts in {minutes} min"
+            next_class["status"] = "upcoming"
         if not next_class:
+            # Walk forward through the week (same weekday next week included)
             for day_offset in range(1, 8):
                 check_date = now + timedelta(days=day_offset)
                 check_day = check_date.strftime('%A').lower()
-                q_day = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", check_day)
-                if course_ids is not None:
-                    if not course_ids:
-                        return {"next_class": None}
-                    q_day = q_day.in_("course_id", course_ids)
-                if student_id:
-                    class_candidates: list[str] = []
-                    try:
-                        ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                        raw_class = (ures.data[0].get("class") if ures.data else None)
-                        if raw_class:
-                            class_candidates.append(str(raw_class))
-                            try:
-                                cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                                if cres.data and cres.data[0].get("class"):
-                                    class_candidates.append(str(cres.data[0].get("class")))
-                            except Exception:
-                                pass
-                    except Exception:
-                        class_candidates = []
-                    class_candidates = list(dict.fromkeys(class_candidates))
-                    if not class_candidates:
-                        return {"next_class": None}
-                    if len(class_candidates) == 1:
-                        q_day = q_day.eq("class", class_candidates[0])
-                    else:
-                        q_day = q_day.in_("class", class_candidates)
-                day_result = q_day.execute()
-                if day_result.data:
-                    earliest_class = min(day_result.data, key=lambda x: x["start_time"])
-                    start_time_str = earliest_class["start_time"]
-                    if 'T' in start_time_str:
-                        start_time = datetime.fromisoformat(start_time_str.replace('Z', '')).time()
-                    else:
-                        try:
-                            start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-                        except ValueError:
-                            start_time = datetime.strptime(start_time_str, "%H:%M").time()
-                    start_datetime = datetime.combine(check_date.date(), start_time)
-                    time_diff = start_datetime - now
-                    if min_time_diff is None or time_diff < min_time_diff:
-                        min_time_diff = time_diff
-                        next_class = earliest_class
-                        if time_diff.days == 0:
-                            hours = int(time_diff.total_seconds() / 3600)
-                            minutes = int((time_diff.total_seconds() % 3600) / 60)
-                            next_class["time_until"] = f"Starts in {hours}h {minutes}m"
-                        elif time_diff.days == 1:
-                            next_class["time_until"] = f"Tomorrow at {start_time.strftime('%I:%M %p')}"
-                        else:
-                            day_name = calendar.day_name[check_date.weekday()]
-                            next_class["time_until"] = f"{day_name} at {start_time.strftime('%I:%M %p')}"
-                        next_class["status"] = "upcoming"
-                    break
+                slot = timetable.first_on(check_day, classes=class_candidates, course_ids=course_ids)
+                if not slot:
+                    continue
+                next_class, start_time = slot.row, slot.start
+                time_diff = datetime.combine(check_date.date(), start_time) - now
+                if time_diff.days == 0:
+                    hours = int(time_diff.total_seconds() / 3600)
+                    minutes = int((time_diff.total_seconds() % 3600) / 60)
+                    next_class["time_until"] = f"Starts in {hours}h {minutes}m"
+                elif time_diff.days == 1:
+                    next_class["time_until"] = f"Tomorrow at {start_time.strftime('%I:%M %p')}"
+                else:
+                    day_name = calendar.day_name[check_date.weekday()]
+                    next_class["time_until"] = f"{day_name} at {start_time.strftime('%I:%M %p')}"
+                next_class["status"] = "upcoming"
+                break
         return {"next_class": next_class}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1178,32 +985,14 @@ def get_current_session():
 def get_all_classes(faculty_id: str | None = None, student_id: str | None = None):
     try:
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"classes": []}
             result = supabase.table("timetable").select("*, courses(name, code)").in_("course_id", course_ids).execute()
         else:
             q = supabase.table("timetable").select("*, courses(name, code)")
             if student_id:
-                class_candidates: list[str] = []
-                try:
-                    ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                    raw_class = (ures.data[0].get("class") if ures.data else None)
-                    if raw_class:
-                        class_candidates.append(str(raw_class))
-                        try:
-                            cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                            if cres.data and cres.data[0].get("class"):
-                                class_candidates.append(str(cres.data[0].get("class")))
-                        except Exception:
-                            pass
-                except Exception:
-                    class_candidates = []
-                class_candidates = list(dict.fromkeys(class_candidates))
+                class_candidates = student_classes.resolve(student_id)
                 if not class_candidates:
                     return {"classes": []}
                 if len(class_candidates) == 1:
@@ -1232,6 +1021,7 @@ def create_class(data: dict):
             "day_of_week": str(data["day_of_week"]).lower()
         }
         res = supabase.table("timetable").insert(insert_data).execute()
+        timetable.invalidate()
         if not res.data:
             raise HTTPException(status_code=500, detail="Failed to create class")
         return {"message": "Class created", "class": res.data[0]}
@@ -1253,6 +1043,7 @@ def update_class(class_id: str, data: dict):
         if not update_data:
             raise HTTPException(status_code=400, detail="No updatable fields provided")
         res = supabase.table("timetable").update(update_data).eq("id", class_id).execute()
+        timetable.invalidate()
         updated = res.data[0] if res.data else None
         # Notify students of the class about timetable update
         try:
@@ -1303,6 +1094,7 @@ def delete_class(class_id: str):
         except Exception:
             row = type("obj", (), {"data": None})()  # simple empty holder
         supabase.table("timetable").delete().eq("id", class_id).execute()
+        timetable.invalidate()
         try:
             cls_code = None
             if row and row.data:
@@ -1368,6 +1160,7 @@ def admin_create_timetable_row(data: dict):
             "day_of_week": str(data["day_of_week"]).lower(),
         }
         res = supabase.table("timetable").insert(insert_data).execute()
+        timetable.invalidate()
         if not res.data:
             raise HTTPException(status_code=500, detail="Failed to create timetable row")
         created = res.data[0]
@@ -1425,6 +1218,7 @@ def admin_create_saturday_class(data: dict):
             "tt_followed": str(data["tt_followed"]).lower(),
         }
         res = supabase.table("saturday_class").insert(payload).execute()
+        saturday_index.invalidate()
         if not res.data:
             raise HTTPException(status_code=500, detail="Failed to create saturday_class row")
         created = res.data[0]
@@ -1461,6 +1255,27 @@ def admin_create_saturday_class(data: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _saturday_slots(date: str, class_filters: list[str] | None, allowed_course_ids: list[str] | None, label: str) -> list[Slot]:
+    """Timetable slots for a Saturday: each saturday_class mapping for the date pulls its
+    class's rows from the weekday it follows (class matched case-insensitively)."""
+    mappings = saturday_index.mappings_for(date)
+    # Optionally filter by class if provided
+    if class_filters:
+        mappings = [r for r in mappings if r.get("class") in class_filters]
+    if allowed_course_ids is not None and not allowed_course_ids:
+        return []
+    slots: list[Slot] = []
+    for mapping in mappings:
+        followed_day = str(mapping.get("tt_followed", "")).lower()
+        # No class specified in mapping: safest is to return none rather than leaking all
+        if not followed_day or not mapping.get("class"):
+            continue
+        for slot in timetable.day_slots(followed_day, classes=[mapping["class"]], course_ids=allowed_course_ids, ignore_case=True):
+            # Annotate for UI clarity
+            slot.row["info"] = f"{label} • Class {mapping.get('class', '')} • Follows {followed_day.capitalize()}"
+            slots.append(slot)
+    return slots
+
 @app.get("/api/classes/today")
 def get_todays_classes(section: str | None = None, faculty_id: str | None = None, student_id: str | None = None, class_code: str | None = None):
     try:
@@ -1468,129 +1283,23 @@ def get_todays_classes(section: str | None = None, faculty_id: str | None = None
         now = datetime.now()
         current_day = now.strftime('%A').lower()
         current_time = now.time()
-        classes: list[dict] = []
+        slots: list[Slot] = []
 
-        # Resolve allowed course_ids if filtering for a faculty
-        allowed_course_ids: list[str] | None = None
-        if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                allowed_course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                allowed_course_ids = []
-
-        # Resolve student class if provided
-        stu_classes: list[str] = []
-        if student_id and not class_code:
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                if raw_class:
-                    stu_classes.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            stu_classes.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-                stu_classes = list(dict.fromkeys(stu_classes))
-            except Exception:
-                stu_classes = []
+        # Effective class filter value(s) and faculty course scope
+        class_filters, allowed_course_ids = _class_scope(faculty_id, student_id, class_code)
 
-        # Determine effective class filter value(s)
-        class_filters: list[str] | None = None
-        if class_code:
-            class_filters = [class_code]
-        elif stu_classes:
-            class_filters = stu_classes
-
-        # Handle Saturday differently by reading saturday_class mapping for today's date
+        # Handle Saturday differently by following the saturday_class mapping for today's date
         if current_day == "saturday":
-            # Prefer exact date match, but gracefully fallback if 'date' column is missing or empty
-            sat_mappings = []
-            try:
-                sat_rows = supabase.table("saturday_class").select("*").eq("date", now.date().isoformat()).execute()
-                sat_mappings = sat_rows.data or []
-            except Exception:
-                # Column 'date' may not exist yet; fallback to latest rows
-                try:
-                    sat_rows = supabase.table("saturday_class").select("*").order("created_at", desc=True).limit(5).execute()
-                    sat_mappings = sat_rows.data or []
-                except Exception:
-                    sat_mappings = []
-
-            # Optionally filter by class if provided
-            if class_filters:
-                sat_mappings = [r for r in sat_mappings if r.get("class") in class_filters]
-
-            if not sat_mappings:
-                return {"classes": []}
-
-            aggregated: list[dict] = []
-            for mapping in sat_mappings:
-                followed_day = str(mapping.get("tt_followed", "")).lower()
-                if not followed_day:
-                    continue
-                # First try with section filter (if provided)
-                base_q = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", followed_day).order("start_time")
-                # When a mapping has a class, strictly filter to that class; do NOT fallback to all classes
-                if mapping.get("class"):
-                    q = base_q
-                    # Case-insensitive exact match on class code
-                    try:
-                        q = q.ilike("class", str(mapping["class"]))
-                    except Exception:
-                        q = q.eq("class", mapping["class"])  # fallback to eq if ilike not supported
-                    if allowed_course_ids is not None:
-                        if not allowed_course_ids:
-                            day_classes = type('obj', (object,), {'data': []})()
-                        else:
-                            day_classes = q.in_("course_id", allowed_course_ids).execute()
-                    else:
-                        day_classes = q.execute()
-                else:
-                    # No class specified in mapping: safest is to return none rather than leaking all
-                    day_classes = type('obj', (object,), {'data': []})()
-                for class_item in (day_classes.data or []):
-                    # Annotate for UI clarity
-                    class_item["info"] = f"Saturday • Class {mapping.get('class', '')} • Follows {followed_day.capitalize()}"
-                    aggregated.append(class_item)
-            classes = aggregated
+            slots = _saturday_slots(now.date().isoformat(), class_filters, allowed_course_ids, "Saturday")
         else:
-            # Mon-Fri: query regular class table
-            q = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", current_day).order("start_time")
-            if class_filters:
-                if len(class_filters) == 1:
-                    q = q.eq("class", class_filters[0])
-                else:
-                    q = q.in_("class", class_filters)
-            if allowed_course_ids is not None:
-                if not allowed_course_ids:
-                    return {"classes": []}
-                q = q.in_("course_id", allowed_course_ids)
-            result = q.execute()
-            classes = result.data or []
+            # Mon-Fri: read the in-memory timetable buckets
+            if allowed_course_ids is not None and not allowed_course_ids:
+                return {"classes": []}
+            slots = timetable.day_slots(current_day, classes=class_filters, course_ids=allowed_course_ids)
 
         # Process class timings and status
         processed: list[dict] = []
-        for class_item in classes:
-            start_time_str = class_item["start_time"]
-            end_time_str = class_item["end_time"]
-            if 'T' in start_time_str:
-                start_time = datetime.fromisoformat(start_time_str.replace('Z', '')).time()
-            else:
-                try:
-                    start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-                except ValueError:
-                    start_time = datetime.strptime(start_time_str, "%H:%M").time()
-            if 'T' in end_time_str:
-                end_time = datetime.fromisoformat(end_time_str.replace('Z', '')).time()
-            else:
-                try:
-                    end_time = datetime.strptime(end_time_str, "%H:%M:%S").time()
-                except ValueError:
-                    end_time = datetime.strptime(end_time_str, "%H:%M").time()
-
+        for start_time, end_time, class_item in slots:
             if start_time <= current_time <= end_time:
                 class_item["status"] = "ongoing"
             elif current_time < start_time:
@@ -1612,24 +1321,8 @@ def list_saturday_class(class_code: str | None = None, student_id: str | None =
 
         # If a student_id is provided, restrict results to that student's class only
         if student_id:
-            try:
-                # Resolve student's class which may be stored as a UUID id or class code string
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                candidates: list[str] = []
-                if raw_class:
-                    candidates.append(str(raw_class))
-                    # Try resolving UUID to class code via class table
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-                # Deduplicate
-                candidates = list(dict.fromkeys(candidates))
-            except Exception:
-                candidates = []
+            # Resolve student's class which may be stored as a UUID id or class code string
+            candidates = student_classes.resolve(student_id)
 
             # If we cannot resolve student's class, do not leak all mappings
             if not candidates:
@@ -1663,6 +1356,7 @@ def create_saturday_class(data: dict):
             "tt_followed": str(data["tt_followed"]).lower()
         }
         res = supabase.table("saturday_class").insert(to_insert).execute()
+        saturday_index.invalidate()
         if not res.data:
             raise HTTPException(status_code=500, detail="Failed to create saturday mapping")
         created = res.data[0]
@@ -1709,6 +1403,7 @@ def update_saturday_class(row_id: str, data: dict):
         if not update_data:
             raise HTTPException(status_code=400, detail="No updatable fields provided")
         res = supabase.table("saturday_class").update(update_data).eq("id", row_id).execute()
+        saturday_index.invalidate()
         updated = res.data[0] if res.data else None
         try:
             cls_code = None
@@ -1760,6 +1455,7 @@ def delete_saturday_class(row_id: str):
         except Exception:
             row = type("obj", (), {"data": None})()
         supabase.table("saturday_class").delete().eq("id", row_id).execute()
+        saturday_index.invalidate()
         try:
             if row and row.data and row.data[0].get("class"):
                 cls_code = row.data[0].get("class")
@@ -1803,6 +1499,46 @@ def get_monthly_classes():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/classes/range")
+def get_classes_in_range(
+    from_date: str = Query(..., alias="from"),
+    to: str = Query(...),
+    section: str | None = None,
+    faculty_id: str | None = None,
+    student_id: str | None = None,
+    class_code: str | None = None,
+):
+    """Classes for every date in [from, to] (YYYY-MM-DD, inclusive), grouped by date.
+
+    Same scoping and Saturday handling as /api/classes/by-date, but the student class,
+    faculty courses and timetable are resolved once for the whole range.
+    Example: /api/classes/range?from=2025-10-06&to=2025-10-12&student_id=<uuid>
+    """
+    try:
+        from datetime import datetime, timedelta
+        try:
+            start = datetime.strptime(from_date, "%Y-%m-%d").date()
+            end = datetime.strptime(to, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        if end < start:
+            raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+        span = (end - start).days + 1
+        if span > CLASS_RANGE_MAX_DAYS:
+            raise HTTPException(status_code=400, detail=f"Range too large (max {CLASS_RANGE_MAX_DAYS} days)")
+
+        class_filters, allowed_course_ids = _class_scope(faculty_id, student_id, class_code)
+        current_time = datetime.now().time()
+        by_date: dict[str, list[dict]] = {}
+        for offset in range(span):
+            day = start + timedelta(days=offset)
+            by_date[day.isoformat()] = _classes_for_date(day, class_filters, allowed_course_ids, current_time)
+        return {"from": start.isoformat(), "to": end.isoformat(), "classes_by_date": by_date}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/classes/{class_id}")
 def get_class_by_id(class_id: str):
     try:
@@ -1873,16 +1609,8 @@ def get_daily_classes(section: str | None = None):
 
         # Add status to each class
         for class_item in result.data or []:
-            start_time_str = class_item["start_time"]
-            end_time_str = class_item["end_time"]
-            try:
-                start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-            except ValueError:
-                start_time = datetime.strptime(start_time_str, "%H:%M").time()
-            try:
-                end_time = datetime.strptime(end_time_str, "%H:%M:%S").time()
-            except ValueError:
-                end_time = datetime.strptime(end_time_str, "%H:%M").time()
+            start_time = parse_clock_time(class_item["start_time"])
+            end_time = parse_clock_time(class_item["end_time"])
 
             if start_time <= current_time <= end_time:
                 class_item["status"] = "ongoing"
@@ -1895,6 +1623,44 @@ def get_daily_classes(section: str | None = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _class_scope(faculty_id: str | None, student_id: str | None, class_code: str | None) -> tuple[list[str] | None, list[str] | None]:
+    """(class_filters, allowed_course_ids) for the class-listing endpoints; None means unfiltered."""
+    # Resolve allowed course_ids if filtering for a faculty
+    allowed_course_ids: list[str] | None = None
+    if faculty_id:
+        allowed_course_ids = faculty_courses.course_ids(faculty_id)
+    # Resolve student class if provided
+    stu_classes: list[str] = []
+    if student_id and not class_code:
+        stu_classes = student_classes.resolve(student_id)
+    class_filters: list[str] | None = None
+    if class_code:
+        class_filters = [class_code]
+    elif stu_classes:
+        class_filters = stu_classes
+    return class_filters, allowed_course_ids
+
+def _classes_for_date(target_date, class_filters: list[str] | None, allowed_course_ids: list[str] | None, current_time) -> list[dict]:
+    """Classes on one calendar date (Saturday mappings applied), with status vs current_time."""
+    date_str = target_date.isoformat()
+    if target_date.weekday() == 5:
+        slots = _saturday_slots(date_str, class_filters, allowed_course_ids, date_str)
+    else:
+        if allowed_course_ids is not None and not allowed_course_ids:
+            return []
+        slots = timetable.day_slots(target_date.strftime('%A').lower(), classes=class_filters, course_ids=allowed_course_ids)
+    # Assign status based on current time of the request day (best-effort)
+    processed: list[dict] = []
+    for start_time, end_time, class_item in slots:
+        if start_time <= current_time <= end_time:
+            class_item["status"] = "ongoing"
+        elif current_time < start_time:
+            class_item["status"] = "upcoming"
+        else:
+            class_item["status"] = "completed"
+        processed.append(class_item)
+    return processed
+
 @app.get("/api/classes/by-date")
 def get_classes_by_date(date: str, section: str | None = None, faculty_id: str | None = None, student_id: str | None = None, class_code: str | None = None):
     """Get classes for a specific date (YYYY-MM-DD), with Saturday mapping support.
@@ -1907,131 +1673,12 @@ def get_classes_by_date(date: str, section: str | None = None, faculty_id: str |
         from datetime import datetime
         # Parse date
         try:
-            target_date = datetime.strptime(date, "%Y-%m-%d")
+            target_date = datetime.strptime(date, "%Y-%m-%d").date()
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-        weekday_name = target_date.strftime('%A').lower()
-        current_time = datetime.now().time()
-
-        classes: list[dict] = []
-
-        # Resolve allowed course_ids if filtering for a faculty
-        allowed_course_ids: list[str] | None = None
-        if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                allowed_course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                allowed_course_ids = []
-
-        # Resolve student class if provided
-        stu_classes: list[str] = []
-        if student_id and not class_code:
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                if raw_class:
-                    stu_classes.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            stu_classes.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-                stu_classes = list(dict.fromkeys(stu_classes))
-            except Exception:
-                stu_classes = []
-        class_filters: list[str] | None = None
-        if class_code:
-            class_filters = [class_code]
-        elif stu_classes:
-            class_filters = stu_classes
-
-        if weekday_name == "saturday":
-            mappings = []
-            try:
-                sat_rows = supabase.table("saturday_class").select("*").eq("date", date).execute()
-                mappings = sat_rows.data or []
-            except Exception:
-                # Fallback to latest rows if 'date' column missing
-                try:
-                    sat_rows = supabase.table("saturday_class").select("*").order("created_at", desc=True).limit(5).execute()
-                    mappings = sat_rows.data or []
-                except Exception:
-                    mappings = []
-            if class_filters:
-                # Only keep mappings whose class matches one of the student's class candidates
-                mappings = [r for r in mappings if r.get("class") in class_filters]
-            if not mappings:
-                return {"classes": []}
-
-            collected: list[dict] = []
-            for m in mappings:
-                followed_day = str(m.get("tt_followed", "")).lower()
-                if not followed_day:
-                    continue
-                base_q = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", followed_day).order("start_time")
-                # Strictly filter to the mapped class; do not fallback to unfiltered day
-                if m.get("class"):
-                    q = base_q
-                    try:
-                        q = q.ilike("class", str(m["class"]))
-                    except Exception:
-                        q = q.eq("class", m["class"])  # fallback
-                    if allowed_course_ids is not None:
-                        if not allowed_course_ids:
-                            day_classes = type('obj', (object,), {'data': []})()
-                        else:
-                            day_classes = q.in_("course_id", allowed_course_ids).execute()
-                    else:
-                        day_classes = q.execute()
-                else:
-                    day_classes = type('obj', (object,), {'data': []})()
-                for c in (day_classes.data or []):
-                    c["info"] = f"{date} • Class {m.get('class','')} • Follows {followed_day.capitalize()}"
-                    collected.append(c)
-            classes = collected
-        else:
-            q = supabase.table("timetable").select("*, courses(name, code)").eq("day_of_week", weekday_name).order("start_time")
-            if class_filters:
-                if len(class_filters) == 1:
-                    q = q.eq("class", class_filters[0])
-                else:
-                    q = q.in_("class", class_filters)
-            if allowed_course_ids is not None:
-                if not allowed_course_ids:
-                    return {"classes": []}
-                q = q.in_("course_id", allowed_course_ids)
-            res = q.execute()
-            classes = res.data or []
-
-        # Assign status based on current time of the request day (best-effort)
-        processed: list[dict] = []
-        for class_item in classes:
-            start_time_str = class_item.get("start_time")
-            end_time_str = class_item.get("end_time")
-            if not start_time_str or not end_time_str:
-                processed.append(class_item)
-                continue
-            try:
-                start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-            except ValueError:
-                start_time = datetime.strptime(start_time_str, "%H:%M").time()
-            try:
-                end_time = datetime.strptime(end_time_str, "%H:%M:%S").time()
-            except ValueError:
-                end_time = datetime.strptime(end_time_str, "%H:%M").time()
-
-            if start_time <= current_time <= end_time:
-                class_item["status"] = "ongoing"
-            elif current_time < start_time:
-                class_item["status"] = "upcoming"
-            else:
-                class_item["status"] = "completed"
-            processed.append(class_item)
-
-        return {"classes": processed}
+        class_filters, allowed_course_ids = _class_scope(faculty_id, student_id, class_code)
+        return {"classes": _classes_for_date(target_date, class_filters, allowed_course_ids, datetime.now().time())}
     except HTTPException:
         raise
     except Exception as e:
@@ -2127,6 +1774,21 @@ def get_course_students(course_id: str):
 # RESOURCES
 # ============================================================================
 
+def enrich_resources(rows: list[dict]):
+    """Attach uploader {first_name, last_name} and courses {name, code} from the shared caches (best-effort)."""
+    try:
+        users = user_profiles.get_many([r.get("uploaded_by") for r in rows])
+        courses = course_info.get_many([r.get("course_id") for r in rows])
+    except Exception:
+        return
+    for r in rows:
+        u = users.get(str(r.get("uploaded_by")))
+        if u:
+            r["uploader"] = {"first_name": u.get("first_name"), "last_name": u.get("last_name")}
+        c = courses.get(str(r.get("course_id")))
+        if c:
+            r["courses"] = {"name": c.get("name"), "code": c.get("code")}
+
 @app.get("/api/resources")
 def get_all_resources(faculty_id: str | None = None, student_id: str | None = None):
     try:
@@ -2138,8 +1800,7 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
         if faculty_id and not student_id:
             try:
                 # Find courses taught by the faculty
-                courses_res = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [c.get("id") for c in (courses_res.data or []) if c.get("id")]
+                course_ids = faculty_courses.course_ids(faculty_id)
 
                 # Query resources uploaded by faculty
                 uploaded_res = supabase.table("resources").select("*").eq("uploaded_by", faculty_id).execute()
@@ -2151,21 +1812,8 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
                     course_res = supabase.table("resources").select("*").in_("course_id", course_ids).execute()
                     by_courses = course_res.data or []
 
-                # Global resources: robust fallback — fetch all and filter course_id falsy AND class empty/null
-                try:
-                    all_res = supabase.table("resources").select("*").execute()
-                    def is_global(row):
-                        cid = row.get("course_id")
-                        cls = row.get("class")
-                        def emptyish(v):
-                            if v is None:
-                                return True
-                            s = str(v).strip().lower()
-                            return s == "" or s == "null" or s == "none"
-                        return emptyish(cid) and emptyish(cls)
-                    globals_list = [r for r in (all_res.data or []) if is_global(r)]
-                except Exception:
-                    globals_list = []
+                # Global resources (no course and no class), served from memory
+                globals_list = global_resources.rows()
 
                 # Merge uniquely by id
                 seen = set()
@@ -2182,21 +1830,7 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
             if student_id:
                 try:
                     # Determine student's class candidates (could be UUID id or class code string)
-                    ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                    raw_class = (ures.data[0].get("class") if ures.data else None)
-                    candidates: list[str] = []
-                    if raw_class:
-                        # include raw value
-                        candidates.append(str(raw_class))
-                        # also try to resolve to class code string via class table when raw is id
-                        try:
-                            cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                            if cres.data and cres.data[0].get("class"):
-                                candidates.append(str(cres.data[0].get("class")))
-                        except Exception:
-                            pass
-                    # de-duplicate while preserving order
-                    candidates = list(dict.fromkeys(candidates))
+                    candidates = student_classes.resolve(student_id)
                     # Fetch resources for the student's class (if available)
                     class_rows = []
                     if candidates:
@@ -2208,20 +1842,7 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
                         result = q.execute()
                         class_rows = result.data or []
                     # Always include global resources (no course and no class)
-                    try:
-                        all_res = supabase.table("resources").select("*").execute()
-                        def is_global(row):
-                            cid = row.get("course_id")
-                            cls = row.get("class")
-                            def emptyish(v):
-                                if v is None:
-                                    return True
-                                s = str(v).strip().lower()
-                                return s == "" or s == "null" or s == "none"
-                            return emptyish(cid) and emptyish(cls)
-                        globals_list = [r for r in (all_res.data or []) if is_global(r)]
-                    except Exception:
-                        globals_list = []
+                    globals_list = global_resources.rows()
                     # Merge unique
                     seen = set()
                     rows = []
@@ -2231,52 +1852,15 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
                             seen.add(rid)
                             rows.append(r)
                 except Exception:
-                    # On failure to resolve, still attempt to return global resources
-                    try:
-                        all_res = supabase.table("resources").select("*").execute()
-                        def is_global(row):
-                            cid = row.get("course_id")
-                            cls = row.get("class")
-                            def emptyish(v):
-                                if v is None:
-                                    return True
-                                s = str(v).strip().lower()
-                                return s == "" or s == "null" or s == "none"
-                            return emptyish(cid) and emptyish(cls)
-                        rows = [r for r in (all_res.data or []) if is_global(r)]
-                    except Exception:
-                        rows = []
+                    # On failure to resolve, still return global resources
+                    rows = global_resources.rows()
             else:
                 # No scoping input; return all resources
                 result = supabase.table("resources").select("*").execute()
                 rows = result.data or []
 
         # Enrich with uploader names and course info
-        try:
-            user_ids = list({r.get("uploaded_by") for r in rows if r.get("uploaded_by")})
-            course_ids = list({r.get("course_id") for r in rows if r.get("course_id")})
-
-            user_map = {}
-            course_map = {}
-            if user_ids:
-                ures = supabase.table("users").select("id, first_name, last_name").in_("id", user_ids).execute()
-                for u in (ures.data or []):
-                    user_map[u["id"]] = {"first_name": u.get("first_name"), "last_name": u.get("last_name")}
-            if course_ids:
-                cres = supabase.table("courses").select("id, name, code").in_("id", course_ids).execute()
-                for c in (cres.data or []):
-                    course_map[c["id"]] = {"name": c.get("name"), "code": c.get("code")}
-
-            for r in rows:
-                uid = r.get("uploaded_by")
-                cid = r.get("course_id")
-                if uid and uid in user_map:
-                    r["uploader"] = user_map[uid]
-                if cid and cid in course_map:
-                    r["courses"] = course_map[cid]
-        except Exception:
-            # Best-effort enrichment only
-            pass
+        enrich_resources(rows)
 
         return {"resources": rows}
     except Exception as e:
@@ -2285,36 +1869,14 @@ def get_all_resources(faculty_id: str | None = None, student_id: str | None = No
 @app.get("/api/resources/search")
 def search_resources(q: str = ""):
     try:
-        # Base query
+        # Base query: ranked index lookup, ilike only if the index is unavailable
         if q:
-            result = supabase.table("resources").select("*").ilike("title", f"%{q}%").execute()
+            rows = search_rows("resources", q, "title", limit=SEARCH_RESULTS_MAX)
         else:
-            result = supabase.table("resources").select("*").limit(10).execute()
-        rows = result.data or []
+            rows = supabase.table("resources").select("*").limit(10).execute().data or []
 
         # Enrich
-        try:
-            user_ids = list({r.get("uploaded_by") for r in rows if r.get("uploaded_by")})
-            course_ids = list({r.get("course_id") for r in rows if r.get("course_id")})
-            user_map = {}
-            course_map = {}
-            if user_ids:
-                ures = supabase.table("users").select("id, first_name, last_name").in_("id", user_ids).execute()
-                for u in (ures.data or []):
-                    user_map[u["id"]] = {"first_name": u.get("first_name"), "last_name": u.get("last_name")}
-            if course_ids:
-                cres = supabase.table("courses").select("id, name, code").in_("id", course_ids).execute()
-                for c in (cres.data or []):
-                    course_map[c["id"]] = {"name": c.get("name"), "code": c.get("code")}
-            for r in rows:
-                uid = r.get("uploaded_by")
-                cid = r.get("course_id")
-                if uid and uid in user_map:
-                    r["uploader"] = user_map[uid]
-                if cid and cid in course_map:
-                    r["courses"] = course_map[cid]
-        except Exception:
-            pass
+        enrich_resources(rows)
 
         return {"resources": rows}
     except Exception as e:
@@ -2327,20 +1889,8 @@ def get_resource_by_id(resource_id: str):
         row = result.data[0] if result.data else None
         if not row:
             return {"resource": None}
-        try:
-            # Enrich single row
-            uid = row.get("uploaded_by")
-            cid = row.get("course_id")
-            if uid:
-                u = supabase.table("users").select("first_name, last_name").eq("id", uid).limit(1).execute()
-                if u.data:
-                    row["uploader"] = {"first_name": u.data[0].get("first_name"), "last_name": u.data[0].get("last_name")}
-            if cid:
-                c = supabase.table("courses").select("name, code").eq("id", cid).limit(1).execute()
-                if c.data:
-                    row["courses"] = {"name": c.data[0].get("name"), "code": c.data[0].get("code")}
-        except Exception:
-            pass
+        # Enrich single row
+        enrich_resources([row])
         return {"resource": row}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2349,11 +1899,13 @@ def get_resource_by_id(resource_id: str):
 def get_resource_stats(resource_id: str):
     try:
         try:
-            downloads = supabase.table("resource_downloads").select("*").eq("resource_id", resource_id).execute()
-            count = len(downloads.data) if downloads.data else 0
+            # Exact count from Content-Range instead of transferring every log row
+            downloads = supabase.table("resource_downloads").select("resource_id", count="exact").eq("resource_id", resource_id).limit(1).execute()
+            count = downloads.count or 0
         except Exception:
             count = 0
-        return {"download_count": count}
+        # Include downloads recorded but not yet flushed
+        return {"download_count": count + download_counter.pending(resource_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2412,17 +1964,10 @@ def get_all_projects():
             project_ids = [r.get("id") for r in rows if r.get("id")]
             creator_ids = list({r.get("creator_id") for r in rows if r.get("creator_id")})
 
-            # Build creator map
+            # Build creator map from the shared profile cache
             creator_map = {}
             if creator_ids:
-                ures = (
-                    supabase
-                    .table("users")
-                    .select("id, first_name, last_name, avatar_url")
-                    .in_("id", creator_ids)
-                    .execute()
-                )
-                for u in (ures.data or []):
+                for u in user_profiles.get_many(creator_ids).values():
                     creator_map[u["id"]] = {
                         "id": u.get("id"),
                         "first_name": u.get("first_name"),
@@ -2546,21 +2091,7 @@ def get_all_assignments(faculty_id: str | None = None, student_id: str | None =
         # If filtering for students by class
         if student_id:
             # Resolve student's class and build candidates (raw + resolved code)
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                raw_class = (ures.data[0].get("class") if ures.data else None)
-                class_candidates = []
-                if raw_class:
-                    class_candidates.append(str(raw_class))
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", raw_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            class_candidates.append(str(cres.data[0].get("class")))
-                    except Exception:
-                        pass
-                class_candidates = list(dict.fromkeys(class_candidates))
-            except Exception:
-                class_candidates = []
+            class_candidates = student_classes.resolve(student_id)
             # If no class is set for the student, do not return all assignments
             if not class_candidates:
                 return {"assignments": []}
@@ -2572,11 +2103,7 @@ def get_all_assignments(faculty_id: str | None = None, student_id: str | None =
             result = q.order("due_date").execute()
             return {"assignments": result.data or []}
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"assignments": []}
             result = (
@@ -2599,18 +2126,9 @@ def get_upcoming_assignments(faculty_id: str | None = None, student_id: str | No
         from datetime import datetime
         today_iso = datetime.now().date().isoformat()
         if student_id:
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                stu_class = (ures.data[0].get("class") if ures.data else None)
-                if stu_class:
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", stu_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            stu_class = cres.data[0].get("class")
-                    except Exception:
-                        pass
-            except Exception:
-                stu_class = None
+            # Prefer the resolved class code (last candidate) over a raw class id
+            class_candidates = student_classes.resolve(student_id)
+            stu_class = class_candidates[-1] if class_candidates else None
             if not stu_class:
                 return {"assignments": []}
             q = (
@@ -2623,11 +2141,7 @@ def get_upcoming_assignments(faculty_id: str | None = None, student_id: str | No
             result = q.order("due_date").execute()
             return {"assignments": result.data or []}
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"assignments": []}
             result = (
@@ -2658,18 +2172,9 @@ def get_overdue_assignments(faculty_id: str | None = None, student_id: str | Non
         from datetime import datetime
         today_iso = datetime.now().date().isoformat()
         if student_id:
-            try:
-                ures = supabase.table("users").select("class").eq("id", student_id).limit(1).execute()
-                stu_class = (ures.data[0].get("class") if ures.data else None)
-                if stu_class:
-                    try:
-                        cres = supabase.table("class").select("class").eq("id", stu_class).limit(1).execute()
-                        if cres.data and cres.data[0].get("class"):
-                            stu_class = cres.data[0].get("class")
-                    except Exception:
-                        pass
-            except Exception:
-                stu_class = None
+            # Prefer the resolved class code (last candidate) over a raw class id
+            class_candidates = student_classes.resolve(student_id)
+            stu_class = class_candidates[-1] if class_candidates else None
             if not stu_class:
                 return {"assignments": []}
             q = (
@@ -2682,11 +2187,7 @@ def get_overdue_assignments(faculty_id: str | None = None, student_id: str | Non
             result = q.order("due_date").execute()
             return {"assignments": result.data or []}
         if faculty_id:
-            try:
-                cids = supabase.table("courses").select("id").eq("faculty_id", faculty_id).execute()
-                course_ids = [r["id"] for r in (cids.data or [])]
-            except Exception:
-                course_ids = []
+            course_ids = faculty_courses.course_ids(faculty_id)
             if not course_ids:
                 return {"assignments": []}
             result = (
@@ -2761,6 +2262,8 @@ def create_assignment(data: dict):
         if not res.data:
             raise HTTPException(status_code=500, detail="Failed to create assignment")
         created = res.data[0]
+        search_index.upsert("assignments", created)
+        suggestions.upsert("assignment", created)
         # Notify: students enrolled in the class (if class provided), otherwise all students in course timetable
         try:
             recipients: list[str] = []
@@ -2827,6 +2330,9 @@ def update_assignment(assignment_id: str, data: dict):
             raise HTTPException(status_code=400, detail="No updatable fields provided")
         res = supabase.table("assignments").update(update_data).eq("id", assignment_id).execute()
         updated = res.data[0] if res.data else None
+        if updated:
+            search_index.upsert("assignments", updated)
+            suggestions.upsert("assignment", updated)
         # Notify impacted students
         try:
             if updated:
@@ -2884,6 +2390,8 @@ def delete_assignment(assignment_id: str, user_id: str | None = None):
         # Read before delete to notify correctly
         row = supabase.table("assignments").select("*").eq("id", assignment_id).limit(1).execute()
         supabase.table("assignments").delete().eq("id", assignment_id).execute()
+        search_index.remove("assignments", assignment_id)
+        suggestions.remove("assignment", assignment_id)
         try:
             if row.data:
                 prev = row.data[0]
@@ -3016,22 +2524,68 @@ def get_conversation_messages(conversation_id: str):
 # SEARCH & QUICK ACCESS
 # ============================================================================
 
+# Upper bound on rows a single search returns
+SEARCH_RESULTS_MAX = int(os.getenv("SEARCH_RESULTS_MAX", "100"))
+
+def search_rows(table: str, q: str, fallback_column: str, limit: int = 20, where=None,
+                fallback_filters: dict | None = None) -> list[dict]:
+    """Ranked rows for `q` from search_index, hydrated with one in_() query.
+
+    Falls back to the old `ilike %q%` query on `fallback_column` when the index cannot
+    be built. `where(attrs)` scopes indexed hits; fallback_filters ({column: value or
+    list}) applies the same scope to the fallback query.
+    """
+    try:
+        ranked = search_index.search(table, q, limit=limit, where=where)
+    except RuntimeError:
+        query = supabase.table(table).select("*").ilike(fallback_column, f"%{q}%")
+        for col, value in (fallback_filters or {}).items():
+            query = query.in_(col, value) if isinstance(value, list) else query.eq(col, value)
+        return query.limit(limit).execute().data or []
+    return search_index.hydrate(table, ranked)
+
+# Global search runs its per-table sub-searches side by side on this pool
+search_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SEARCH_POOL_WORKERS", "8")), thread_name_prefix="search")
+# Per-source budget; a source that misses it contributes no rows to the response
+GLOBAL_SEARCH_TIMEOUT_MS = int(os.getenv("GLOBAL_SEARCH_TIMEOUT_MS", "1500"))
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    rows = fn(*args, **kwargs)
+    return rows, (time.perf_counter() - started) * 1000.0
+
 @app.get("/api/search/global")
 def global_search(q: str = ""):
     try:
         if not q:
             return {"results": []}
             
-        # Search across multiple tables
-        courses = supabase.table("courses").select("*").ilike("name", f"%{q}%").limit(5).execute()
-        assignments = supabase.table("assignments").select("*").ilike("title", f"%{q}%").limit(5).execute()
-        resources = supabase.table("resources").select("*").ilike("title", f"%{q}%").limit(5).execute()
-        
+        # Search across multiple tables (best 5 of each), concurrently
+        sources = {"courses": "name", "assignments": "title", "resources": "title"}
+        started = time.perf_counter()
+        futures = {name: search_pool.submit(_timed, search_rows, name, q, column, limit=5) for name, column in sources.items()}
+        # A timed-out sub-search keeps running in the pool; its result is dropped
+        wait(futures.values(), timeout=GLOBAL_SEARCH_TIMEOUT_MS / 1000.0)
+        results, timings = {}, {}
+        for name, fut in futures.items():
+            if not fut.done():
+                results[name] = []
+                timings[name] = {"status": "timeout", "ms": GLOBAL_SEARCH_TIMEOUT_MS}
+                continue
+            try:
+                rows, ms = fut.result()
+                results[name] = rows
+                timings[name] = {"status": "ok", "ms": round(ms, 2), "count": len(rows)}
+            except Exception as e:
+                print(f"[search] global search on {name} failed:", repr(e))
+                results[name] = []
+                timings[name] = {"status": "error", "detail": str(e)}
         return {
-            "results": {
-                "courses": courses.data,
-                "assignments": assignments.data, 
-                "resources": resources.data
+            "results": results,
+            "meta": {
+                "sources": timings,
+                "partial": any(t["status"] != "ok" for t in timings.values()),
+                "total_ms": round((time.perf_counter() - started) * 1000.0, 2)
             }
         }
     except Exception as e:
@@ -3241,6 +2795,16 @@ def get_search_history():
 # CALENDAR / EVENTS
 # ============================================================================
 
+def _event_viewer(user_id: str | None) -> tuple[str | None, str | None]:
+    """(role, class code) deciding which shared events a user sees, from the profile cache."""
+    if not user_id:
+        return None, None
+    try:
+        profile = user_profiles.get(user_id) or {}
+    except Exception:
+        return None, None
+    return str(profile.get("role") or "").lower() or None, profile.get("class")
+
 @app.get("/api/events")
 def get_events(month: int = None, year: int = None, user_id: str = None):
     """Get events for calendar view, optionally filtered by month/year and/or user personal events.
@@ -3250,91 +2814,13 @@ def get_events(month: int = None, year: int = None, user_id: str = None):
     Without user_id, returns all events (both personal and non-personal) in the time range.
     """
     try:
-        from datetime import datetime, date
-
-        base_select = "*, courses(name, code)"
-        base_table = "events"
-        base = supabase.table(base_table).select(base_select)
-        
-        # Filter by month and year if provided
+        role, user_class_code = _event_viewer(user_id)
         if month and year:
-            start_date = date(year, month, 1)
-            # Get last day of month
-            if month == 12:
-                end_date = date(year + 1, 1, 1)
-            else:
-                end_date = date(year, month + 1, 1)
-            
-            base = base.gte("start_date", start_date.isoformat()).lt("start_date", end_date.isoformat())
-
-        events = []
-        seen = set()
-
-        if not user_id:
-            # Without user filter, return all events in range (both personal and non-personal)
-            allq = supabase.table(base_table).select(base_select)
-            if month and year:
-                allq = allq.gte("start_date", start_date.isoformat()).lt("start_date", end_date.isoformat())
-            allq = allq.order("start_date", desc=False).execute()
-            events = allq.data or []
+            # One cached bucket per month, shared by every user
+            bucket = events_cache.month(year, month)
         else:
-            # Determine role and (for students) class code
-            role = None
-            user_class_code = None
-            try:
-                ures = supabase.table("users").select("role, class").eq("id", user_id).limit(1).execute()
-                if ures.data:
-                    role = str(ures.data[0].get("role", "")).lower()
-                    user_class_code = ures.data[0].get("class")
-            except Exception:
-                pass
-
-            # Non-personal events
-            try:
-                q1 = supabase.table(base_table).select(base_select)
-                if month and year:
-                    q1 = q1.gte("start_date", start_date.isoformat()).lt("start_date", end_date.isoformat())
-                q1 = q1.eq("is_personal", False)
-                # If student, restrict by class code
-                if role == "student" and user_class_code:
-                    q1 = q1.eq("class", user_class_code)
-                q1 = q1.execute()
-                if q1.data:
-                    for e in q1.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-            except Exception:
-                # If schema lacks is_personal, fall back to base query (still apply class filter for students)
-                q1 = supabase.table(base_table).select(base_select)
-                if month and year:
-                    q1 = q1.gte("start_date", start_date.isoformat()).lt("start_date", end_date.isoformat())
-                if role == "student" and user_class_code:
-                    q1 = q1.eq("class", user_class_code)
-                q1 = q1.execute()
-                if q1.data:
-                    for e in q1.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-
-            # Personal events for user
-            try:
-                q2 = supabase.table(base_table).select(base_select)
-                if month and year:
-                    q2 = q2.gte("start_date", start_date.isoformat()).lt("start_date", end_date.isoformat())
-                q2 = q2.eq("is_personal", True).eq("created_by", user_id).execute()
-                if q2.data:
-                    for e in q2.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-            except Exception:
-                # If schema lacks is_personal, skip
-                pass
-
-        # Sort by start_date
-        events.sort(key=lambda x: (x.get('start_date') or '', x.get('start_time') or ''))
+            bucket = EventBucket(supabase.table("events").select(EVENT_SELECT).order("start_date", desc=False).execute().data or [])
+        events = bucket.visible(user_id, role, user_class_code)
 
         result = type('obj', (object,), {'data': events})()
         return {"events": result.data}
@@ -3496,6 +2982,7 @@ def create_event(event_data: dict):
         if not result.data:
             raise HTTPException(status_code=500, detail="Failed to create event")
         created = result.data[0]
+        events_cache.invalidate(created.get("start_date") or payload.get("start_date"))
         # Notify: for non-personal events, notify students in the target class
         try:
             if not created.get("is_personal") and created.get("class"):
@@ -3700,6 +3187,8 @@ def update_event(event_id: str, event_data: dict):
         if not result.data:
             raise HTTPException(status_code=404, detail="Event not found after update")
         updated = result.data[0]
+        # Old and new month, in case the event moved
+        events_cache.invalidate(current_event.get("start_date"), updated.get("start_date"))
         # Notify: non-personal event updates go to class students
         try:
             if not updated.get("is_personal") and updated.get("class"):
@@ -3723,7 +3212,7 @@ def delete_event(event_id: str, user_id: str | None = None):
     """Delete an event"""
     try:
         # Always fetch the row first for permission checks and notifications
-        pre = supabase.table("events").select("id, created_by, is_personal, class, title").eq("id", event_id).limit(1).execute()
+        pre = supabase.table("events").select("id, created_by, is_personal, class, title, start_date").eq("id", event_id).limit(1).execute()
         if not pre.data:
             raise HTTPException(status_code=404, detail="Event not found")
 
@@ -3748,6 +3237,7 @@ def delete_event(event_id: str, user_id: str | None = None):
 
         # Perform deletion
         result = supabase.table("events").delete().eq("id", event_id).execute()
+        events_cache.invalidate(pre.data[0].get("start_date"))
         if not result.data:
             raise HTTPException(status_code=404, detail="Event not found")
 
@@ -3799,7 +3289,6 @@ def get_calendar_month(year: int, month: int, user_id: str | None = None):
     If user_id provided, include both global events and that user's personal events (is_personal=true, created_by=user_id).
     """
     try:
-        from datetime import date, timedelta
         import calendar as cal
         
         # Validate month and year
@@ -3808,79 +3297,9 @@ def get_calendar_month(year: int, month: int, user_id: str | None = None):
         if year < 1900 or year > 2100:
             raise HTTPException(status_code=400, detail="Year must be between 1900 and 2100")
         
-        # Get first and last day of the month
-        first_day = date(year, month, 1)
-        last_day = date(year, month, cal.monthrange(year, month)[1])
-        
-        # Base params
-        base_select = "*, courses(name, code)"
-        base_table = "events"
-
-        events = []
-        seen = set()
-
-        if not user_id:
-            # No user filter => include everything in range
-            fb = supabase.table(base_table).select(base_select).gte("start_date", first_day.isoformat()).lte("start_date", last_day.isoformat()).order("start_date").execute()
-            events = fb.data or []
-        else:
-            # Determine role and class code for student
-            role = None
-            user_class_code = None
-            try:
-                ures = supabase.table("users").select("role, class").eq("id", user_id).limit(1).execute()
-                if ures.data:
-                    role = str(ures.data[0].get("role", "")).lower()
-                    user_class_code = ures.data[0].get("class")
-            except Exception:
-                pass
-
-            # Non-personal first
-            try:
-                q1 = (
-                    supabase
-                    .table(base_table)
-                    .select(base_select)
-                    .gte("start_date", first_day.isoformat())
-                    .lte("start_date", last_day.isoformat())
-                    .eq("is_personal", False)
-                )
-                if role == "student" and user_class_code:
-                    q1 = q1.eq("class", user_class_code)
-                q1 = q1.order("start_date").execute()
-                if q1.data:
-                    for e in q1.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-            except Exception:
-                # If schema lacks is_personal, just get all (still filter by class for students)
-                q1 = (
-                    supabase
-                    .table(base_table)
-                    .select(base_select)
-                    .gte("start_date", first_day.isoformat())
-                    .lte("start_date", last_day.isoformat())
-                )
-                if role == "student" and user_class_code:
-                    q1 = q1.eq("class", user_class_code)
-                q1 = q1.order("start_date").execute()
-                if q1.data:
-                    for e in q1.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-
-            # Add personal events for the user
-            try:
-                q2 = supabase.table(base_table).select(base_select).gte("start_date", first_day.isoformat()).lte("start_date", last_day.isoformat()).eq("is_personal", True).eq("created_by", user_id).order("start_date").execute()
-                if q2.data:
-                    for e in q2.data:
-                        if e.get('id') not in seen:
-                            events.append(e)
-                            seen.add(e.get('id'))
-            except Exception:
-                pass
+        # Month bucket from the events cache; the user's view is assembled in memory
+        role, user_class_code = _event_viewer(user_id)
+        events = events_cache.month(year, month).visible(user_id, role, user_class_code)
 
         # Group events by date
         events_by_date = {}
@@ -3911,81 +3330,19 @@ def search_users(q: str = "", limit: int = 20, current_user_id: str = ""):
         if not q or len(q.strip()) < 2:
             return {"users": [], "total": 0}
         
-        search_term = f"%{q.strip().lower()}%"
-        
-        # Search users excluding current user
-        base_query = supabase.table("users").select("id, first_name, last_name, email, roll_no, dept").limit(limit)
-        
-        if current_user_id:
-            base_query = base_query.neq("id", current_user_id)
-            
-        # Search in first_name, last_name, email, and student_id using individual queries and combine results
-        all_users = []
-        seen_ids = set()
-        
-        # Search in first_name
-        try:
-            first_name_results = base_query.ilike("first_name", search_term).execute()
-            if first_name_results.data:
-                for user in first_name_results.data:
-                    if user['id'] not in seen_ids:
-                        # Combine first_name and last_name into name field
-                        user['name'] = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-                        # Backward compatibility
-                        if 'roll_no' in user and 'student_id' not in user:
-                            user['student_id'] = user['roll_no']
-                        all_users.append(user)
-                        seen_ids.add(user['id'])
-        except Exception:
-            pass
-            
-        # Search in last_name
-        try:
-            last_name_results = base_query.ilike("last_name", search_term).execute()
-            if last_name_results.data:
-                for user in last_name_results.data:
-                    if user['id'] not in seen_ids:
-                        user['name'] = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-                        if 'roll_no' in user and 'student_id' not in user:
-                            user['student_id'] = user['roll_no']
-                        all_users.append(user)
-                        seen_ids.add(user['id'])
-        except Exception:
-            pass
-            
-        # Search in email
-        try:
-            email_results = base_query.ilike("email", search_term).execute()
-            if email_results.data:
-                for user in email_results.data:
-                    if user['id'] not in seen_ids:
-                        user['name'] = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-                        if 'roll_no' in user and 'student_id' not in user:
-                            user['student_id'] = user['roll_no']
-                        all_users.append(user)
-                        seen_ids.add(user['id'])
-        except Exception:
-            pass
-            
-        # Search in student_id
-        try:
-            student_id_results = base_query.ilike("roll_no", search_term).execute()
-            if student_id_results.data:
-                for user in student_id_results.data:
-                    if user['id'] not in seen_ids:
-                        user['name'] = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-                        if 'roll_no' in user and 'student_id' not in user:
-                            user['student_id'] = user['roll_no']
-                        all_users.append(user)
-                        seen_ids.add(user['id'])
-        except Exception:
-            pass
-            
-        result = type('obj', (object,), {'data': all_users[:limit]})()
-        
+        # Single ranked query across name, email, roll number and dept, excluding current user
+        users = find_users(supabase, q.strip(), limit=limit, exclude_id=current_user_id or None,
+                           columns="id, first_name, last_name, email, roll_no, dept")
+        for user in users:
+            # Combine first_name and last_name into name field
+            user['name'] = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+            # Backward compatibility
+            if 'roll_no' in user and 'student_id' not in user:
+                user['student_id'] = user['roll_no']
+
         return {
-            "users": result.data or [],
-            "total": len(result.data) if result.data else 0
+            "users": users,
+            "total": len(users)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4004,11 +3361,8 @@ def send_friend_request(data: dict):
         if sender_id == receiver_id:
             raise HTTPException(status_code=400, detail="Cannot send friend request to yourself")
             
-        # Check if friendship already exists - using separate queries
-        friendship_check1 = supabase.table("friendships").select("*").eq("user1_id", sender_id).eq("user2_id", receiver_id).execute()
-        friendship_check2 = supabase.table("friendships").select("*").eq("user1_id", receiver_id).eq("user2_id", sender_id).execute()
-        
-        if (friendship_check1.data and len(friendship_check1.data) > 0) or (friendship_check2.data and len(friendship_check2.data) > 0):
+        # Check if friendship already exists (in-memory graph)
+        if friend_graph.are_friends(sender_id, receiver_id):
             raise HTTPException(status_code=409, detail="Friendship already exists")
             
         # Check if request already exists - using separate queries
@@ -4068,6 +3422,17 @@ def friend_requests_self_test(data: dict):
         # Surface as much detail as possible
         return {"ok": False, "error": str(e) or repr(e)}
 
+def _attach_profiles(rows: list[dict], id_key: str, target_key: str):
+    """Set row[target_key] = {id, first_name, last_name, email} from one batched profile lookup."""
+    try:
+        profiles = user_profiles.get_many([r.get(id_key) for r in rows])
+    except Exception:
+        return
+    for r in rows:
+        p = profiles.get(str(r.get(id_key)))
+        if p:
+            r[target_key] = {k: p.get(k) for k in ("id", "first_name", "last_name", "email")}
+
 @app.get("/api/friend-requests/{user_id}")
 def get_friend_requests(user_id: str, type: str = "received"):
     """Get friend requests for a user (received or sent)"""
@@ -4076,30 +3441,14 @@ def get_friend_requests(user_id: str, type: str = "received"):
             result = supabase.table("friend_requests").select("*").eq("receiver_id", user_id).eq("status", "pending").execute()
             requests = result.data or []
             # Enrich with sender details for display purposes
-            enriched = []
-            for req in requests:
-                try:
-                    sender_res = supabase.table("users").select("id, first_name, last_name, email").eq("id", req.get("sender_id")).execute()
-                    if sender_res.data:
-                        req["sender"] = sender_res.data[0]
-                except Exception:
-                    pass
-                enriched.append(req)
-            return {"requests": enriched, "total": len(enriched)}
+            _attach_profiles(requests, "sender_id", "sender")
+            return {"requests": requests, "total": len(requests)}
         else:
             result = supabase.table("friend_requests").select("*").eq("sender_id", user_id).execute()
             requests = result.data or []
             # Enrich with receiver details for display in "sent" tab
-            enriched = []
-            for req in requests:
-                try:
-                    recv_res = supabase.table("users").select("id, first_name, last_name, email").eq("id", req.get("receiver_id")).execute()
-                    if recv_res.data:
-                        req["receiver"] = recv_res.data[0]
-                except Exception:
-                    pass
-                enriched.append(req)
-            return {"requests": enriched, "total": len(enriched)}
+            _attach_profiles(requests, "receiver_id", "receiver")
+            return {"requests": requests, "total": len(requests)}
     except Exception as e:
         return {"requests": [], "total": 0}
 
@@ -4110,16 +3459,8 @@ def get_sent_friend_requests(user_id: str):
         result = supabase.table("friend_requests").select("*").eq("sender_id", user_id).execute()
         requests = result.data or []
         # Enrich with receiver details
-        enriched = []
-        for req in requests:
-            try:
-                recv_res = supabase.table("users").select("id, first_name, last_name, email").eq("id", req.get("receiver_id")).execute()
-                if recv_res.data:
-                    req["receiver"] = recv_res.data[0]
-            except Exception:
-                pass
-            enriched.append(req)
-        return {"requests": enriched, "total": len(enriched)}
+        _attach_profiles(requests, "receiver_id", "receiver")
+        return {"requests": requests, "total": len(requests)}
     except Exception as e:
         return {"requests": [], "total": 0}
 
@@ -4149,15 +3490,22 @@ def respond_to_friend_request(request_id: str, data: dict):
             user1_id = min(friend_request["sender_id"], friend_request["receiver_id"])
             user2_id = max(friend_request["sender_id"], friend_request["receiver_id"])
             
-            supabase.table("friendships").insert({
+            fres = supabase.table("friendships").insert({
                 "user1_id": user1_id,
                 "user2_id": user2_id
             }).execute()
+            created_at = (fres.data[0].get("created_at") if fres.data else None) or datetime.now().isoformat()
+            friend_graph.add(user1_id, user2_id, created_at)
             
         # Notify sender about the outcome
         try:
             outcome = "accepted" if action == "accept" else "rejected"
             notify([friend_request["sender_id"]], "friend_request", f"Your friend request was {outcome}", actor_id=friend_request["receiver_id"])
+            # Both sides refresh their friend/request lists from this event
+            hub.publish([friend_request["sender_id"], friend_request["receiver_id"]], "friend_request", {
+                "request_id": request_id, "status": outcome,
+                "sender_id": friend_request["sender_id"], "receiver_id": friend_request["receiver_id"],
+            })
         except Exception:
             pass
         return {"message": f"Friend request {action}ed successfully"}
@@ -4165,45 +3513,17 @@ def respond_to_friend_request(request_id: str, data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/friends/{user_id}")
-def get_user_friends(user_id: str):
-    """Get all friends for a user"""
+def get_user_friends(user_id: str, limit: int | None = None, offset: int = 0):
+    """Get all friends for a user.
+
+    Pass `limit` (and `offset`) for a page of friends, newest friendship first;
+    the page response also carries `next_offset`.
+    """
     try:
-        # Get friendships where user is either user1 or user2
-        friendships1 = supabase.table("friendships").select("*, user2_id").eq("user1_id", user_id).execute()
-        friendships2 = supabase.table("friendships").select("*, user1_id").eq("user2_id", user_id).execute()
-        
-        friends = []
-        
-        # Process friendships where user is user1
-        if friendships1.data:
-            for friendship in friendships1.data:
-                friend_id = friendship["user2_id"]
-                # Get friend details
-                user_result = supabase.table("users").select("id, first_name, last_name, email").eq("id", friend_id).execute()
-                if user_result.data:
-                    user_data = user_result.data[0]
-                    friends.append({
-                        "friend_id": friend_id,
-                        "friend_name": f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}".strip(),
-                        "friend_email": user_data.get('email', ''),
-                        "friendship_created_at": friendship.get('created_at', '')
-                    })
-        
-        # Process friendships where user is user2
-        if friendships2.data:
-            for friendship in friendships2.data:
-                friend_id = friendship["user1_id"]
-                # Get friend details
-                user_result = supabase.table("users").select("id, first_name, last_name, email").eq("id", friend_id).execute()
-                if user_result.data:
-                    user_data = user_result.data[0]
-                    friends.append({
-                        "friend_id": friend_id,
-                        "friend_name": f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}".strip(),
-                        "friend_email": user_data.get('email', ''),
-                        "friendship_created_at": friendship.get('created_at', '')
-                    })
-        
+        if limit is not None:
+            limit = max(1, min(limit, 200))
+            return friend_service.list_friends_page(user_id, limit, max(0, offset))
+        friends = friend_service.list_friends(user_id)
         return {"friends": friends, "total": len(friends)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4221,11 +3541,8 @@ def send_message(data: dict):
         if not all([sender_id, receiver_id, content]):
             raise HTTPException(status_code=400, detail="sender_id, receiver_id, and content are required")
             
-        # Check if users are friends - using separate queries
-        friendship_check1 = supabase.table("friendships").select("*").eq("user1_id", sender_id).eq("user2_id", receiver_id).execute()
-        friendship_check2 = supabase.table("friendships").select("*").eq("user1_id", receiver_id).eq("user2_id", sender_id).execute()
-        
-        if not ((friendship_check1.data and len(friendship_check1.data) > 0) or (friendship_check2.data and len(friendship_check2.data) > 0)):
+        # Check if users are friends (in-memory graph)
+        if not friend_graph.are_friends(sender_id, receiver_id):
             raise HTTPException(status_code=403, detail="Can only message friends")
             
         # Send message
@@ -4244,6 +3561,10 @@ def send_message(data: dict):
             notify([receiver_id], "chat", "New message", message=preview, actor_id=sender_id)
         except Exception:
             pass
+        # Push the stored row to both participants (sender's other tabs stay in sync)
+        chat_activity.note_message(result.data[0])
+        unread_counters.increment(receiver_id, sender_id)
+        hub.publish([receiver_id, sender_id], "message", result.data[0])
         return {"message": "Message sent successfully", "data": result.data[0]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4256,31 +3577,16 @@ def get_user_conversations(user_id: str):
         friends_response = get_user_friends(user_id)
         friends = friends_response["friends"]
         
+        # Latest message for every friend in a bounded number of calls; unread counts from memory
+        summary = conversation_summaries.summaries(user_id, [f["friend_id"] for f in friends], with_unread=False)
+        unread = unread_counters.counts(user_id)
         conversations = []
-        
         for friend in friends:
-            # Get last message in conversation - using separate queries and combining
-            last_message1 = supabase.table("messages").select("*").eq("sender_id", user_id).eq("receiver_id", friend['friend_id']).order("created_at", desc=True).limit(1).execute()
-            last_message2 = supabase.table("messages").select("*").eq("sender_id", friend['friend_id']).eq("receiver_id", user_id).order("created_at", desc=True).limit(1).execute()
-            
-            # Get the most recent message
-            last_message_data = None
-            if last_message1.data and last_message2.data:
-                msg1_time = last_message1.data[0]['created_at']
-                msg2_time = last_message2.data[0]['created_at']
-                last_message_data = last_message1.data[0] if msg1_time > msg2_time else last_message2.data[0]
-            elif last_message1.data:
-                last_message_data = last_message1.data[0]
-            elif last_message2.data:
-                last_message_data = last_message2.data[0]
-            
-            # Count unread messages
-            unread_count = supabase.table("messages").select("id", count="exact").eq("sender_id", friend['friend_id']).eq("receiver_id", user_id).eq("is_read", False).execute()
-            
+            peer = summary.get(str(friend["friend_id"])) or {}
             conversations.append({
                 "friend": friend,
-                "last_message": last_message_data,
-                "unread_count": unread_count.count or 0
+                "last_message": peer.get("last_message"),
+                "unread_count": unread.get(str(friend["friend_id"]), 0)
             })
         
         # Sort by last message time
@@ -4290,64 +3596,151 @@ def get_user_conversations(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/messages/unread-summary/{user_id}")
+def get_unread_message_summary(user_id: str):
+    """Unread direct messages for a user: total for the badge plus a per-sender breakdown."""
+    try:
+        by_sender = unread_counters.counts(user_id)
+        return {"user_id": user_id, "total_unread": sum(by_sender.values()), "by_sender": by_sender}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _format_chat_message(msg: dict) -> dict:
+    sender_name = "Unknown User"
+    if msg.get('sender') and isinstance(msg['sender'], dict):
+        sender_data = msg['sender']
+        if sender_data.get('first_name') and sender_data.get('last_name'):
+            sender_name = f"{sender_data['first_name']} {sender_data['last_name']}"
+        elif sender_data.get('first_name'):
+            sender_name = sender_data['first_name']
+        elif sender_data.get('email'):
+            sender_name = sender_data['email'].split('@')[0]
+    return {
+        "message_id": msg['id'],
+        "sender_id": msg['sender_id'],
+        "sender_name": sender_name,
+        "content": msg['content'],
+        "message_type": msg['message_type'] or 'text',
+        "is_read": msg['is_read'],
+        "created_at": msg['created_at']
+    }
+
 @app.get("/api/messages/{user1_id}/{user2_id}")
-def get_conversation_messages(user1_id: str, user2_id: str, limit: int = 50):
-    """Get messages between two users"""
+def get_conversation_messages(user1_id: str, user2_id: str, limit: int = 50,
+                              before: str | None = None, after: str | None = None):
+    """Get messages between two users, oldest first.
+
+    Returns the latest `limit` messages by default. Pass `before_cursor` back as
+    `before` to load older history, or `after_cursor` as `after` to fetch what
+    arrived since; `has_more` says whether that direction has further pages.
+    """
     try:
-        # Check if users are friends - using separate queries
-        friendship_check1 = supabase.table("friendships").select("*").eq("user1_id", user1_id).eq("user2_id", user2_id).execute()
-        friendship_check2 = supabase.table("friendships").select("*").eq("user1_id", user2_id).eq("user2_id", user1_id).execute()
-        
-        if not ((friendship_check1.data and len(friendship_check1.data) > 0) or (friendship_check2.data and len(friendship_check2.data) > 0)):
+        # Check if users are friends (in-memory graph)
+        if not friend_graph.are_friends(user1_id, user2_id):
             raise HTTPException(status_code=403, detail="Can only view messages with friends")
-            
-        # Get conversation messages directly from messages table
-        # Get messages where (sender=user1 AND receiver=user2) OR (sender=user2 AND receiver=user1)
-        messages_query1 = supabase.table("messages").select("*, sender:users!messages_sender_id_fkey(first_name, last_name, email)").eq("sender_id", user1_id).eq("receiver_id", user2_id).execute()
-        messages_query2 = supabase.table("messages").select("*, sender:users!messages_sender_id_fkey(first_name, last_name, email)").eq("sender_id", user2_id).eq("receiver_id", user1_id).execute()
-        
-        # Combine and sort messages by timestamp
-        all_messages = []
-        if messages_query1.data:
-            all_messages.extend(messages_query1.data)
-        if messages_query2.data:
-            all_messages.extend(messages_query2.data)
-            
-        # Sort by created_at timestamp
-        all_messages.sort(key=lambda x: x['created_at'])
+        if before and after:
+            raise HTTPException(status_code=400, detail="Pass either before or after, not both")
+        limit = max(1, min(limit or 50, MESSAGES_PAGE_MAX))
+        try:
+            before_key = tuple(decode_cursor(before)) if before else None
+            after_key = tuple(decode_cursor(after)) if after else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        # Newest `limit` messages per direction, merged and cut at `limit`
+        all_messages, has_more = conversation_page(supabase, user1_id, user2_id, limit, before_key, after_key)
         
         # Transform to match expected format
-        formatted_messages = []
-        for msg in all_messages:
-            sender_name = "Unknown User"
-            if msg.get('sender') and isinstance(msg['sender'], dict):
-                sender_data = msg['sender']
-                if sender_data.get('first_name') and sender_data.get('last_name'):
-                    sender_name = f"{sender_data['first_name']} {sender_data['last_name']}"
-                elif sender_data.get('first_name'):
-                    sender_name = sender_data['first_name']
-                elif sender_data.get('email'):
-                    sender_name = sender_data['email'].split('@')[0]
-            
-            formatted_messages.append({
-                "message_id": msg['id'],
-                "sender_id": msg['sender_id'],
-                "sender_name": sender_name,
-                "content": msg['content'],
-                "message_type": msg['message_type'] or 'text',
-                "is_read": msg['is_read'],
-                "created_at": msg['created_at']
-            })
-        
-        # Apply limit
-        if limit and len(formatted_messages) > limit:
-            formatted_messages = formatted_messages[-limit:]  # Get most recent messages
+        formatted_messages = [_format_chat_message(msg) for msg in all_messages]
         
-        return {"messages": formatted_messages, "total": len(formatted_messages)}
+        before_cursor = after_cursor = None
+        if all_messages:
+            before_cursor = encode_cursor(all_messages[0].get("created_at"), all_messages[0].get("id"))
+            after_cursor = encode_cursor(all_messages[-1].get("created_at"), all_messages[-1].get("id"))
+        elif after:
+            after_cursor = after
+        return {
+            "messages": formatted_messages,
+            "total": len(formatted_messages),
+            "has_more": has_more,
+            "before_cursor": before_cursor,
+            "after_cursor": after_cursor,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error getting messages: {e}")  # Debug logging
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/messages/{user1_id}/{user2_id}/since")
+def get_conversation_delta(user1_id: str, user2_id: str, cursor: str | None = None, limit: int = 100):
+    """Messages newer than `cursor` plus read-state changes since the previous poll.
+
+    `cursor` is the after_cursor from /api/messages/{user1_id}/{user2_id} or the
+    cursor returned by this endpoint; without one the latest page is returned.
+    When nothing changed, the answer comes from chat_activity without a query.
+    """
+    try:
+        if not friend_graph.are_friends(user1_id, user2_id):
+            raise HTTPException(status_code=403, detail="Can only view messages with friends")
+        limit = max(1, min(limit or 100, MESSAGES_PAGE_MAX))
+        position, read_since = None, None
+        if cursor:
+            try:
+                parts = decode_cursor(cursor, 3)
+            except ValueError:
+                try:
+                    parts = decode_cursor(cursor, 2) + [None]
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="Invalid cursor")
+            position = (parts[0], parts[1])
+            # A history cursor carries no poll stamp: read changes since that message
+            read_since = parts[2] or parts[0]
+            if chat_activity.is_quiet(user1_id, user2_id, position, read_since):
+                return {"messages": [], "read_updates": [], "has_more": False, "cursor": cursor}
+
+        polled_at = datetime.now(timezone.utc)
+        rows, has_more = conversation_page(supabase, user1_id, user2_id, limit, after=position)
+        read_updates = []
+        if read_since:
+            # Changes stamped just before the last poll may have committed after it; re-sending is harmless
+            read_from = _shift_stamp(read_since, -CHAT_READ_SKEW_SECONDS)
+            a, b = quote_value(user1_id), quote_value(user2_id)
+            q = supabase.table("messages").select("id, sender_id, updated_at")
+            q = or_filter(q, f"and(sender_id.eq.{a},receiver_id.eq.{b}),and(sender_id.eq.{b},receiver_id.eq.{a})")
+            res = order_by(q.eq("is_read", True).gt("updated_at", read_from), "updated_at.asc").limit(MESSAGES_PAGE_MAX).execute()
+            read_updates = [
+                {"message_id": r.get("id"), "sender_id": r.get("sender_id"), "is_read": True, "updated_at": r.get("updated_at")}
+                for r in (res.data or [])
+            ]
+
+        last = position
+        if rows:
+            last = (str(rows[-1].get("created_at")), str(rows[-1].get("id")))
+        if not has_more:
+            latest_read = max((r["updated_at"] for r in read_updates if r.get("updated_at")), default=None)
+            chat_activity.record(user1_id, user2_id, last, latest_read, read_since)
+        next_cursor = encode_cursor(last[0], last[1], polled_at.isoformat()) if last else None
+        return {
+            "messages": [_format_chat_message(m) for m in rows],
+            "read_updates": read_updates,
+            "has_more": has_more,
+            "cursor": next_cursor,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _shift_stamp(stamp: str, seconds: float) -> str:
+    try:
+        dt = datetime.fromisoformat(str(stamp).replace("Z", "+00:00"))
+    except ValueError:
+        return stamp
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt + timedelta(seconds=seconds)).isoformat()
+
 @app.put("/api/messages/mark-read")
 def mark_conversation_messages_read(data: dict):
     """Mark all messages in a conversation as read"""
@@ -4358,8 +3751,14 @@ def mark_conversation_messages_read(data: dict):
         if not user_id or not friend_id:
             raise HTTPException(status_code=400, detail="user_id and friend_id are required")
         
-        # Mark all messages from friend_id to user_id as read
-        result = supabase.table("messages").update({"is_read": True}).eq("sender_id", friend_id).eq("receiver_id", user_id).execute()
+        # Mark all messages from friend_id to user_id as read; updated_at feeds the delta poll
+        stamp = datetime.now(timezone.utc).isoformat()
+        result = supabase.table("messages").update({"is_read": True, "updated_at": stamp}).eq("sender_id", friend_id).eq("receiver_id", user_id).eq("is_read", False).execute()
+        unread_counters.reset(user_id, friend_id)
+        if result.data:
+            chat_activity.note_read(user_id, friend_id, stamp)
+        # Read receipt for the sender; the reader's other tabs clear their badge
+        hub.publish([friend_id, user_id], "messages_read", {"reader_id": user_id, "peer_id": friend_id}, coalesce_key=f"{user_id}:{friend_id}")
         
         return {"message": "Conversation messages marked as read", "updated_count": len(result.data) if result.data else 0}
     except Exception as e:
@@ -4372,14 +3771,98 @@ def mark_message_read(message_id: str, data: dict):
         user_id = data.get("user_id")
         
         # Update message as read
-        result = supabase.table("messages").update({"is_read": True}).eq("id", message_id).eq("receiver_id", user_id).execute()
+        stamp = datetime.now(timezone.utc).isoformat()
+        # Only an unread row is updated, so every returned row is a real unread -> read change
+        result = supabase.table("messages").update({"is_read": True, "updated_at": stamp}).eq("id", message_id).eq("receiver_id", user_id).eq("is_read", False).execute()
+        for row in (result.data or []):
+            unread_counters.decrement(user_id, row.get("sender_id"))
+            chat_activity.note_read(user_id, row.get("sender_id"), stamp)
+            hub.publish([row.get("sender_id"), user_id], "messages_read", {"reader_id": user_id, "peer_id": row.get("sender_id"), "message_id": message_id})
         
         return {"message": "Message marked as read"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================================
+# REALTIME (Server-Sent Events)
+# ============================================================================
+
+@app.get("/api/stream/{user_id}")
+async def stream_events(user_id: str, request: Request):
+    """Push notifications, chat messages, read receipts and friend-request updates.
+
+    Events: notification, notifications_read, message, messages_read, friend_request.
+    A comment line is sent every heartbeat interval so proxies keep the connection open.
+    """
+    import asyncio
+    sub = hub.subscribe(user_id, asyncio.get_running_loop())
+
+    async def event_source():
+        try:
+            yield "retry: 5000\n\n"
+            yield hub.format_sse({"id": 0, "event": "ready", "data": {"user_id": user_id}})
+            while True:
+                if await request.is_disconnected():
+                    break
+                events = await sub.next_batch(timeout=hub.heartbeat_seconds)
+                if not events:
+                    yield ": heartbeat\n\n"
+                    continue
+                for payload in events:
+                    yield hub.format_sse(payload)
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _authenticate_chat_socket(frame: dict) -> str | None:
+    """The API has no session tokens; a socket identifies as an existing user, like the REST calls."""
+    try:
+        user_id = frame.get("user_id")
+        return str(user_id) if user_id and user_profiles.get(user_id) else None
+    except Exception:
+        return None
+
+def _mark_read_from_socket(user_id: str, frame: dict):
+    if frame.get("message_id"):
+        mark_message_read(frame["message_id"], {"user_id": user_id})
+    elif frame.get("friend_id"):
+        mark_conversation_messages_read({"user_id": user_id, "friend_id": frame["friend_id"]})
+    else:
+        raise HTTPException(status_code=400, detail="friend_id or message_id is required")
+
+chat_socket = ChatSocketServer(
+    hub,
+    authenticate=_authenticate_chat_socket,
+    send_message=send_message,
+    mark_read=_mark_read_from_socket,
+    can_message=friend_graph.are_friends,
+)
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """Bidirectional chat: messages, typing indicators and read receipts (see chat_socket.py)."""
+    await chat_socket.serve(websocket)
+
 # Add all extended routes
-add_extended_routes(app, supabase)
+add_extended_routes(
+    app, supabase,
+    student_classes=student_classes,
+    user_profiles=user_profiles,
+    global_resources=global_resources,
+    download_counter=download_counter,
+    resource_ids=resource_ids,
+    search_index=search_index,
+    suggestions=suggestions,
+    enrich_resources=enrich_resources,
+    search_rows=search_rows,
+    search_results_max=SEARCH_RESULTS_MAX,
+    notify=notify,
+)
 
 if __name__ == "__main__":
     # Run on localhost for development
@@ -0,0 +1,175 @@
+"""
+Friend list service
+In-memory friendship graph for permission checks, plus friend lists hydrated in one
+batched lookup through the shared user-profile cache
+"""
+import os
+import threading
+import time
+
+from query_utils import or_filter, quote_value
+
+PAGE_SIZE = 1000
+
+
+def _friend_entry(friend_id: str, created_at, profile: dict) -> dict:
+    return {
+        "friend_id": friend_id,
+        "friend_name": f"{profile.get('first_name', '')} {profile.get('last_name', '')}".strip(),
+        "friend_email": profile.get('email', ''),
+        "friendship_created_at": created_at or '',
+    }
+
+
+class FriendGraph:
+    """Undirected friendship graph: user_id -> {friend_id: friendship created_at}.
+
+    Loaded from `friendships` in pages, reloaded after `ttl` seconds (other workers
+    may have written), and kept current in-process through add()/remove(). A negative
+    are_friends() answer is confirmed with one query before it is trusted, so a
+    friendship made on another worker is never refused; positives cost no query.
+    """
+
+    def __init__(self, supabase, ttl: float | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("FRIEND_GRAPH_TTL_SECONDS", "300"))
+        self._adj: dict[str, dict[str, str]] = {}
+        self._edges = 0
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.checks = 0
+        self.confirm_queries = 0
+
+    def _needs_reload(self) -> bool:
+        return self._loaded_at is None or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def reload(self, force: bool = True) -> bool:
+        with self._lock:
+            # Callers that queued behind another reload find the graph fresh
+            if not force and not self._needs_reload():
+                return True
+            try:
+                rows: list[dict] = []
+                start = 0
+                while True:
+                    res = (
+                        self.supabase.table("friendships")
+                        .select("id, user1_id, user2_id, created_at")
+                        .order("id")
+                        .range(start, start + PAGE_SIZE - 1)
+                        .execute()
+                    )
+                    page = res.data or []
+                    rows.extend(page)
+                    if len(page) < PAGE_SIZE:
+                        break
+                    start += PAGE_SIZE
+            except Exception as e:
+                self.load_errors += 1
+                print("[friends] graph load failed:", repr(e))
+                return False
+            adj: dict[str, dict[str, str]] = {}
+            for r in rows:
+                a, b = r.get("user1_id"), r.get("user2_id")
+                if a and b:
+                    adj.setdefault(str(a), {})[str(b)] = r.get("created_at") or ''
+                    adj.setdefault(str(b), {})[str(a)] = r.get("created_at") or ''
+            self._adj = adj
+            self._edges = sum(len(v) for v in adj.values()) // 2
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+            return True
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._needs_reload():
+            if not self.reload(force=False) and self._loaded_at is None:
+                raise RuntimeError("friendships could not be loaded")
+
+    def are_friends(self, a: str, b: str) -> bool:
+        if not a or not b:
+            return False
+        self._ensure_loaded()
+        self.checks += 1
+        if str(b) in self._adj.get(str(a), {}):
+            return True
+        return self._confirm(str(a), str(b))
+
+    def _confirm(self, a: str, b: str) -> bool:
+        """One round-trip check for an edge the snapshot does not have."""
+        self.confirm_queries += 1
+        qa, qb = quote_value(a), quote_value(b)
+        q = self.supabase.table("friendships").select("user1_id, user2_id, created_at")
+        q = or_filter(q, f"and(user1_id.eq.{qa},user2_id.eq.{qb}),and(user1_id.eq.{qb},user2_id.eq.{qa})")
+        rows = q.limit(1).execute().data or []
+        if rows:
+            self.add(a, b, rows[0].get("created_at"))
+        return bool(rows)
+
+    def add(self, a: str, b: str, created_at: str | None = None):
+        with self._lock:
+            a, b = str(a), str(b)
+            if b not in self._adj.get(a, {}):
+                self._edges += 1
+            self._adj.setdefault(a, {})[b] = created_at or ''
+            self._adj.setdefault(b, {})[a] = created_at or ''
+
+    def remove(self, a: str, b: str):
+        """Drop an edge, e.g. after an unfriend deletes the friendships row."""
+        with self._lock:
+            a, b = str(a), str(b)
+            if self._adj.get(a, {}).pop(b, None) is not None:
+                self._edges -= 1
+            self._adj.get(b, {}).pop(a, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._adj),
+            "edges": self._edges,
+            "loaded": self._loaded_at is not None,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "checks": self.checks,
+            "confirm_queries": self.confirm_queries,
+        }
+
+
+class FriendService:
+    """Friend lists built from `friendships` plus one batched profile lookup.
+
+    Lists always read the table (two indexed queries) so they keep the original
+    order and see other workers' writes at once; FriendGraph only answers
+    permission checks.
+    """
+
+    def __init__(self, supabase, profiles):
+        self.supabase = supabase
+        self.profiles = profiles
+
+    def friendships(self, user_id: str) -> list[tuple[str, str]]:
+        """(friend_id, friendship_created_at) pairs: rows where the user is user1 first, then user2."""
+        pairs: list[tuple[str, str]] = []
+        res1 = self.supabase.table("friendships").select("user2_id, created_at").eq("user1_id", user_id).execute()
+        pairs.extend((r["user2_id"], r.get("created_at", '')) for r in (res1.data or []) if r.get("user2_id"))
+        res2 = self.supabase.table("friendships").select("user1_id, created_at").eq("user2_id", user_id).execute()
+        pairs.extend((r["user1_id"], r.get("created_at", '')) for r in (res2.data or []) if r.get("user1_id"))
+        return pairs
+
+    def _hydrate(self, pairs: list[tuple[str, str]]) -> list[dict]:
+        profiles = self.profiles.get_many([fid for fid, _ in pairs])
+        # Friends whose user row no longer exists are skipped, as before
+        return [_friend_entry(fid, created, profiles[str(fid)]) for fid, created in pairs if str(fid) in profiles]
+
+    def list_friends(self, user_id: str) -> list[dict]:
+        return self._hydrate(self.friendships(user_id))
+
+    def list_friends_page(self, user_id: str, limit: int, offset: int = 0) -> dict:
+        """One page of friends, newest friendship first; only the page's profiles are loaded."""
+        pairs = sorted(self.friendships(user_id), key=lambda p: (str(p[1] or ''), str(p[0])), reverse=True)
+        window = pairs[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(pairs) else None
+        return {"friends": self._hydrate(window), "total": len(pairs), "next_offset": next_offset}
@@ -30,4 +30,5 @@ create index IF not exists idx_messages_sender on public.messages using btree (s
 
 create index IF not exists idx_messages_receiver on public.messages using btree (receiver_id) TABLESPACE pg_default;
 
-create index IF not exists idx_messages_created_at on public.messages using btree (created_at) TABLESPACE pg_default;
\ No newline at end of file
+create index IF not exists idx_messages_created_at on public.messages using btree (created_at) TABLESPACE pg_default;
+create index IF not exists idx_messages_pair_created on public.messages using btree (sender_id, receiver_id, created_at desc, id desc) TABLESPACE pg_default;
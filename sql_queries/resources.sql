@@ -25,4 +25,7 @@ create index IF not exists idx_resources_category on public.resources using btre
 
 create index IF not exists idx_resources_category_course on public.resources using btree (category, course_id) TABLESPACE pg_default;
 
-create index IF not exists idx_resources_category_type on public.resources using btree (category, resource_type) TABLESPACE pg_default;
\ No newline at end of file
+create index IF not exists idx_resources_category_type on public.resources using btree (category, resource_type) TABLESPACE pg_default;
+create index IF not exists idx_resources_global on public.resources using btree (created_at) TABLESPACE pg_default
+where
+  (course_id is null and class is null);
@@ -0,0 +1,55 @@
+-- Conversation summary for the chat list: one row per peer the user has exchanged
+-- messages with, carrying the latest message (as json) and the number of unread
+-- messages from that peer. Called by the API as rpc('conversation_summaries').
+create or replace function public.conversation_summaries (p_user_id uuid)
+returns table (peer_id uuid, last_message jsonb, unread_count bigint)
+language sql
+stable
+as $$
+  with peer_messages as (
+    select
+      case when m.sender_id = p_user_id then m.receiver_id else m.sender_id end as peer_id,
+      m.*
+    from public.messages m
+    where m.sender_id = p_user_id or m.receiver_id = p_user_id
+  ),
+  last_message as (
+    select distinct on (pm.peer_id)
+      pm.peer_id,
+      to_jsonb(pm) - 'peer_id' as last_message
+    from peer_messages pm
+    order by pm.peer_id, pm.created_at desc, pm.id desc
+  ),
+  unread as (
+    select m.sender_id as peer_id, count(*) as unread_count
+    from public.messages m
+    where m.receiver_id = p_user_id and m.is_read = false
+    group by m.sender_id
+  )
+  select
+    coalesce(l.peer_id, u.peer_id) as peer_id,
+    l.last_message,
+    coalesce(u.unread_count, 0) as unread_count
+  from last_message l
+  full join unread u on u.peer_id = l.peer_id;
+$$;
+
+create index IF not exists idx_messages_receiver_unread on public.messages using btree (receiver_id, is_read, sender_id) TABLESPACE pg_default;
+
+-- Batched download counting: applies many per-resource increments in one atomic
+-- UPDATE (download_count = download_count + n), so concurrent flushes never lose
+-- counts. p_counts is a json array of {"resource_id": uuid, "n": int}.
+-- Called by the API as rpc('increment_resource_downloads').
+create or replace function public.increment_resource_downloads (p_counts jsonb)
+returns void
+language sql
+as $$
+  update public.resources r
+  set download_count = coalesce(r.download_count, 0) + c.n
+  from (
+    select (e->>'resource_id')::uuid as resource_id, sum((e->>'n')::int) as n
+    from jsonb_array_elements(p_counts) e
+    group by 1
+  ) c
+  where r.id = c.resource_id;
+$$;
@@ -0,0 +1,275 @@
+"""
+In-memory stand-in for the supabase client used by the unit tests
+Implements the query-builder subset the services use (filters, order, limit/range,
+the raw `or`/`order` params set by query_utils) over plain lists of dicts, and
+counts every .execute() so tests can assert round-trip budgets
+"""
+import re
+import uuid
+
+
+class Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _split_top(s: str) -> list[str]:
+    """Split on commas that are outside parentheses and double quotes."""
+    out, cur, depth, quoted, escaped = [], "", 0, False, False
+    for ch in s:
+        if escaped:
+            cur += ch
+            escaped = False
+            continue
+        if ch == "\\" and quoted:
+            escaped = True
+            cur += ch
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            out.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    if cur:
+        out.append(cur)
+    return out
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+def _like(pattern: str, ignore_case: bool):
+    rx = re.escape(pattern).replace("%", ".*").replace(r"\*", ".*")
+    return re.compile(f"^{rx}$", re.I if ignore_case else 0)
+
+
+def _compare(op: str, value, target) -> bool:
+    if op == "is":
+        return value is None if target in (None, "null") else value == target
+    if value is None:
+        return False
+    v, t = str(value), str(target)
+    if op == "eq":
+        return v == t
+    if op == "neq":
+        return v != t
+    if op == "lt":
+        return v < t
+    if op == "lte":
+        return v <= t
+    if op == "gt":
+        return v > t
+    if op == "gte":
+        return v >= t
+    if op in ("like", "ilike"):
+        return bool(_like(t, op == "ilike").match(v))
+    raise ValueError(f"unsupported operator {op}")
+
+
+def parse_condition(expr: str):
+    """Predicate for one PostgREST logic-tree node, e.g. `and(a.eq.1,b.lt."x")`."""
+    expr = expr.strip()
+    for kind in ("and", "or"):
+        if expr.startswith(kind + "("):
+            subs = [parse_condition(x) for x in _split_top(expr[len(kind) + 1:-1])]
+            combine = all if kind == "and" else any
+            return lambda row: combine(f(row) for f in subs)
+    col, op, raw = expr.split(".", 2)
+    if op == "in":
+        items = {_unquote(x.strip()) for x in _split_top(raw[1:-1])}
+        return lambda row: row.get(col) is not None and str(row.get(col)) in items
+    target = _unquote(raw)
+    return lambda row: _compare(op, row.get(col), target)
+
+
+class _Params:
+    """Mimics the postgrest request params object that query_utils appends to."""
+
+    def __init__(self, query):
+        self.query = query
+
+    def add(self, key, value):
+        if key == "or":
+            self.query._filters.append(parse_condition("or" + value))
+        elif key == "order":
+            for term in value.split(","):
+                col, _, direction = term.partition(".")
+                self.query._order.append((col, direction == "desc"))
+        else:
+            raise ValueError(f"unsupported param {key}")
+        return self
+
+    def set(self, key, value):
+        if key == "order":
+            self.query._order = []
+        return self.add(key, value)
+
+
+class Query:
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table = table
+        self._op = "select"
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._payload = None
+        self._count = None
+
+    @property
+    def params(self):
+        return _Params(self)
+
+    @params.setter
+    def params(self, value):
+        pass
+
+    # operations
+    def select(self, *columns, count=None):
+        self._op, self._count = "select", count
+        return self
+
+    def insert(self, payload):
+        self._op, self._payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self._op, self._payload = "update", payload
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    # filters
+    def _where(self, op, col, value):
+        self._filters.append(lambda row: _compare(op, row.get(col), value))
+        return self
+
+    def eq(self, col, value):
+        return self._where("eq", col, value)
+
+    def neq(self, col, value):
+        return self._where("neq", col, value)
+
+    def lt(self, col, value):
+        return self._where("lt", col, value)
+
+    def lte(self, col, value):
+        return self._where("lte", col, value)
+
+    def gt(self, col, value):
+        return self._where("gt", col, value)
+
+    def gte(self, col, value):
+        return self._where("gte", col, value)
+
+    def ilike(self, col, pattern):
+        return self._where("ilike", col, pattern)
+
+    def is_(self, col, value):
+        return self._where("is", col, value)
+
+    def in_(self, col, values):
+        allowed = {str(v) for v in values}
+        self._filters.append(lambda row: row.get(col) is not None and str(row.get(col)) in allowed)
+        return self
+
+    def or_(self, expression):
+        self._filters.append(parse_condition(f"or({expression})"))
+        return self
+
+    # shaping
+    def order(self, col, desc=False, **_):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n, **_):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def execute(self):
+        self.client.executed += 1
+        self.client.log.append((self.table, self._op))
+        if self.client.before_execute:
+            self.client.before_execute(self)
+        result = self._run()
+        # Runs after the read, i.e. like a concurrent write landing just after this query
+        if self.client.on_execute:
+            self.client.on_execute(self)
+        return result
+
+    def _run(self):
+        rows = self.client.tables.setdefault(self.table, [])
+        if self._op == "insert":
+            payload = self._payload if isinstance(self._payload, list) else [self._payload]
+            created = []
+            for p in payload:
+                row = dict(p)
+                row.setdefault("id", str(uuid.uuid4()))
+                rows.append(row)
+                created.append(dict(row))
+            return Result(created)
+        matched = [r for r in rows if all(f(r) for f in self._filters)]
+        if self._op == "update":
+            for r in matched:
+                r.update(self._payload)
+            return Result([dict(r) for r in matched])
+        if self._op == "delete":
+            for r in matched:
+                rows.remove(r)
+            return Result([dict(r) for r in matched])
+        for col, desc in reversed(self._order):
+            matched.sort(key=lambda r: (r.get(col) is None, str(r.get(col) or "")), reverse=desc)
+        total = len(matched)
+        matched = matched[self._offset:]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        return Result([dict(r) for r in matched], total if self._count else None)
+
+
+class FakeSupabase:
+    """tables: name -> list of row dicts. `executed` counts round trips.
+
+    before_execute(query) is called before each query runs and may raise to stand in
+    for a server-side error; on_execute(query) is called after it has produced its result.
+    """
+
+    def __init__(self, tables: dict | None = None):
+        self.tables = {name: [dict(r) for r in rows] for name, rows in (tables or {}).items()}
+        self.executed = 0
+        self.log: list[tuple[str, str]] = []
+        self.before_execute = None
+        self.on_execute = None
+        self.rpc_handler = None
+
+    def table(self, name: str) -> Query:
+        return Query(self, name)
+
+    def rpc(self, name: str, params: dict):
+        client = self
+
+        class _Call:
+            def execute(self):
+                client.executed += 1
+                client.log.append((name, "rpc"))
+                if client.rpc_handler is None:
+                    raise Exception(f"function {name} does not exist")
+                return Result(client.rpc_handler(name, params))
+
+        return _Call()
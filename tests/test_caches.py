@@ -0,0 +1,146 @@
+import threading
+import time
+
+import caches
+from caches import EntityCache, FacultyCourseIndex, GlobalResourceSet, StudentClassResolver, TTLCache, is_global_resource
+from fake_supabase import FakeSupabase
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(caches.time, "monotonic", clock)
+    cache = TTLCache(maxsize=10, ttl=5)
+    cache.set("k", 1)
+    assert cache.get("k") == 1
+    clock.now += 5.1
+    assert cache.get("k", None) is None
+    assert cache.stats()["size"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b", None) is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_ttl_cache_invalidate_and_falsy_values():
+    cache = TTLCache()
+    cache.set("empty", [])
+    assert cache.get("empty", None) == []
+    cache.invalidate("empty")
+    assert cache.get("empty", None) is None
+
+
+def test_student_class_resolver_caches_hits_but_not_errors():
+    sb = FakeSupabase({
+        "users": [{"id": "s1", "class": "c-uuid"}],
+        "class": [{"id": "c-uuid", "class": "AIE-A"}],
+    })
+    resolver = StudentClassResolver(sb)
+    first = resolver.resolve("s1")
+    assert "c-uuid" in first and "AIE-A" in first
+    calls = sb.executed
+    assert resolver.resolve("s1") == first
+    assert sb.executed == calls
+    assert resolver.resolve(None) == []
+
+    def fail_once(query):
+        sb.on_execute = None
+        raise ConnectionError("reset")
+
+    sb.on_execute = fail_once
+    assert resolver.resolve("s2") == []
+    # The failure was not cached: the next call looks the student up again
+    sb.tables["users"].append({"id": "s2", "class": "AIE-B"})
+    assert resolver.resolve("s2") == ["AIE-B"]
+
+
+def test_is_global_resource():
+    assert is_global_resource({"course_id": None, "class": ""})
+    assert is_global_resource({"course_id": "null", "class": "None"})
+    assert not is_global_resource({"course_id": "co1", "class": None})
+
+
+def _profiles(n=3):
+    users = [{"id": f"u{i}", "first_name": f"F{i}", "last_name": "L", "email": f"u{i}@x.com"} for i in range(n)]
+    sb = FakeSupabase({"users": users})
+    return sb, EntityCache(sb, "users", "id, first_name, last_name, email")
+
+
+def test_entity_cache_batches_misses_into_one_query():
+    sb, cache = _profiles(5)
+    found = cache.get_many(["u0", "u1", "u1", "missing"])
+    assert set(found) == {"u0", "u1"}
+    assert sb.executed == 1
+    # Hits are served from memory; only the new id is fetched
+    cache.get_many(["u0", "u1", "u2"])
+    assert sb.executed == 2
+    assert cache.stats()["remote_queries"] == 2
+
+
+def test_entity_cache_chunks_long_id_lists():
+    sb, cache = _profiles(EntityCache.CHUNK + 5)
+    assert len(cache.get_many([f"u{i}" for i in range(EntityCache.CHUNK + 5)])) == EntityCache.CHUNK + 5
+    assert sb.executed == 2
+
+
+def test_entity_cache_returns_copies():
+    _, cache = _profiles()
+    cache.get("u0")["first_name"] = "changed"
+    assert cache.get("u0")["first_name"] == "F0"
+
+
+def test_entity_cache_put_writes_through_or_evicts_partial_rows():
+    sb, cache = _profiles()
+    cache.get("u0")
+    cache.put({"id": "u0", "first_name": "New", "last_name": "L", "email": "e"})
+    assert cache.get("u0")["first_name"] == "New"
+    cache.put({"id": "u0", "first_name": "Partial"})
+    calls = sb.executed
+    assert cache.get("u0")["first_name"] == "F0"
+    assert sb.executed == calls + 1
+
+
+def _concurrent(n, call):
+    start = threading.Barrier(n)
+    threads = [threading.Thread(target=lambda: (start.wait(), call())) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_faculty_course_index_loads_once_for_concurrent_callers():
+    sb = FakeSupabase({"courses": [{"id": "co1", "faculty_id": "f1"}, {"id": "co2", "faculty_id": "f2"}]})
+    index = FacultyCourseIndex(sb)
+    sb.before_execute = lambda query: time.sleep(0.02)
+    _concurrent(20, lambda: index.course_ids("f1"))
+    assert index.stats()["loads"] == 1
+    assert index.course_ids("f1") == ["co1"]
+    # warm() still forces a reload
+    index.warm()
+    assert index.stats()["loads"] == 2
+
+
+def test_global_resources_reload_once_after_expiry():
+    sb = FakeSupabase({"resources": [{"id": "r1", "course_id": None, "class": None},
+                                     {"id": "r2", "course_id": "co1", "class": None}]})
+    resources = GlobalResourceSet(sb, ttl=60)
+    assert [r["id"] for r in resources.rows()] == ["r1"]
+    resources._loaded_at -= 61
+    sb.before_execute = lambda query: time.sleep(0.02)
+    _concurrent(20, resources.rows)
+    assert resources.stats()["loads"] == 2
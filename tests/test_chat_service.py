@@ -0,0 +1,86 @@
+from chat_service import ChatActivity, ConversationSummaries
+from fake_supabase import FakeSupabase
+
+
+def _inbox(friends: int, per_friend: int = 3) -> list[dict]:
+    """`per_friend` messages each way between u0 and every friend, u0 never read them."""
+    rows = []
+    for f in range(1, friends + 1):
+        for k in range(per_friend):
+            stamp = f"2026-10-{1 + k:02d}T10:{f % 60:02d}:00"
+            rows.append({"id": f"m{f}-{k}a", "sender_id": "u0", "receiver_id": f"u{f}", "is_read": True, "created_at": stamp})
+            rows.append({"id": f"m{f}-{k}b", "sender_id": f"u{f}", "receiver_id": "u0", "is_read": False, "created_at": stamp + "Z"})
+    return rows
+
+
+def _summarise(friends: int, **kwargs):
+    sb = FakeSupabase({"messages": _inbox(friends)})
+    engine = ConversationSummaries(sb, **kwargs)
+    out = engine.summaries("u0", [f"u{f}" for f in range(1, friends + 1)])
+    return out, sb.executed, engine
+
+
+def test_fallback_query_count_does_not_grow_with_friend_count():
+    small, small_calls, _ = _summarise(5)
+    large, large_calls, _ = _summarise(150)
+    assert small_calls == large_calls
+    assert len(large) == 150
+    assert large["u150"]["unread_count"] == 3
+    assert large["u150"]["last_message"]["id"] == "m150-2b"
+
+
+def test_peers_older_than_the_scan_window_still_get_their_last_message():
+    sb = FakeSupabase({"messages": _inbox(3) + [
+        {"id": "old", "sender_id": "u9", "receiver_id": "u0", "is_read": True, "created_at": "2020-01-01T00:00:00"},
+    ]})
+    engine = ConversationSummaries(sb, page_size=2, max_pages=2)
+    out = engine.summaries("u0", ["u1", "u2", "u3", "u9", "u404"])
+    assert out["u9"]["last_message"]["id"] == "old"
+    assert out["u3"]["last_message"]["id"] == "m3-2b"
+    assert out["u404"]["last_message"] is None
+    assert engine.stats()["peer_lookups"] > 0
+
+
+def test_no_per_peer_lookups_when_the_scan_reaches_the_end_of_history():
+    sb = FakeSupabase({"messages": _inbox(4)})
+    engine = ConversationSummaries(sb)
+    out = engine.summaries("u0", ["u1", "u2", "u404"])
+    assert out["u404"]["last_message"] is None
+    assert engine.stats()["peer_lookups"] == 0
+
+
+def test_rpc_result_is_used_when_the_function_exists():
+    sb = FakeSupabase()
+    sb.rpc_handler = lambda name, params: [{"peer_id": "u1", "last_message": {"id": "m"}, "unread_count": 2}]
+    out = ConversationSummaries(sb).summaries("u0", ["u1", "u2"])
+    assert out == {"u1": {"last_message": {"id": "m"}, "unread_count": 2}, "u2": {"last_message": None, "unread_count": 0}}
+    assert sb.executed == 1
+
+
+def test_activity_answers_locally_only_from_the_verified_read_bound():
+    activity = ChatActivity(recheck=60)
+    pos = ("2026-10-17T10:00:00", "m1")
+    activity.record("a", "b", pos, None, "2026-10-17T10:00:05")
+    assert activity.is_quiet("b", "a", pos, "2026-10-17T10:00:05")
+    # A client holding an older stamp may have missed changes before the bound
+    assert not activity.is_quiet("a", "b", pos, "2026-10-17T09:59:00")
+    # A newer message is never quiet
+    assert not activity.is_quiet("a", "b", ("2026-10-17T09:00:00", "m0"), "2026-10-17T10:00:05")
+
+
+def test_activity_keeps_the_newest_read_stamp_across_record():
+    activity = ChatActivity(recheck=60)
+    pos = ("2026-10-17T10:00:00", "m1")
+    activity.record("a", "b", pos, None, "2026-10-17T10:00:00")
+    activity.note_read("a", "b", "2026-10-17T10:00:10")
+    # A verification whose query returned no read change must not erase the local one
+    activity.record("a", "b", pos, None, "2026-10-17T10:00:02")
+    assert not activity.is_quiet("a", "b", pos, "2026-10-17T10:00:05")
+    assert activity.is_quiet("a", "b", pos, "2026-10-17T10:00:11")
+
+
+def test_activity_without_a_verified_bound_falls_through_to_the_database():
+    activity = ChatActivity(recheck=60)
+    pos = ("2026-10-17T10:00:00", "m1")
+    activity.record("a", "b", pos, None, None)
+    assert not activity.is_quiet("a", "b", pos, "2026-10-17T10:00:05")
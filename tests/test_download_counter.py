@@ -0,0 +1,121 @@
+from download_counter import DownloadCounter
+from fake_supabase import FakeSupabase
+
+
+class APIError(Exception):
+    """Shape of postgrest's APIError: message plus a `code` attribute."""
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+def _counter(resources):
+    sb = FakeSupabase({"resources": [{"id": rid, "download_count": n} for rid, n in resources.items()]})
+    counter = DownloadCounter(sb, flush_interval=60)
+    counter._log_table_missing = True  # logs are not under test here
+    return sb, counter
+
+
+def test_batch_goes_through_the_rpc_in_one_call():
+    sb, counter = _counter({"r1": 0, "r2": 0})
+    calls = []
+    sb.rpc_handler = lambda name, params: calls.append(params) or []
+    for rid in ("r1", "r1", "r2"):
+        counter.record(rid)
+    counter.flush()
+    counter.stop()
+    assert calls == [{"p_counts": [{"resource_id": "r1", "n": 2}, {"resource_id": "r2", "n": 1}]}]
+    assert counter.pending("r1") == 0
+
+
+def test_transient_rpc_error_requeues_instead_of_falling_back():
+    sb, counter = _counter({"r1": 5})
+
+    def flaky(name, params):
+        raise APIError("canceling statement due to statement timeout", "57014")
+
+    sb.rpc_handler = flaky
+    counter.record("r1")
+    counter.record("r1")
+    counter.flush()
+    # Nothing written through the non-atomic path; counts wait for the next flush
+    assert sb.tables["resources"][0]["download_count"] == 5
+    assert counter.pending("r1") == 2
+    assert counter.stats()["rpc_available"] is True
+
+    applied = []
+    sb.rpc_handler = lambda name, params: applied.append(params) or []
+    counter.flush()
+    counter.stop()
+    assert applied == [{"p_counts": [{"resource_id": "r1", "n": 2}]}]
+
+
+def test_missing_function_falls_back_to_per_resource_updates():
+    sb, counter = _counter({"r1": 5})
+
+    def missing(name, params):
+        raise APIError("Could not find the function public.increment_resource_downloads", "PGRST202")
+
+    sb.rpc_handler = missing
+    counter.record("r1")
+    counter.flush()
+    counter.stop()
+    assert sb.tables["resources"][0]["download_count"] == 6
+    assert counter.stats()["rpc_available"] is False
+
+
+GOOD = ["00000000-0000-0000-0000-00000000000%d" % i for i in range(1, 5)]
+
+
+def _reject_bad_uuids(ids):
+    bad = [i for i in ids if i not in GOOD]
+    if bad:
+        raise APIError(f'invalid input syntax for type uuid: "{bad[0]}"', "22P02")
+
+
+def test_bad_id_is_dropped_without_blocking_the_batch():
+    sb, counter = _counter({rid: 0 for rid in GOOD})
+    applied = []
+
+    def rpc(name, params):
+        ids = [c["resource_id"] for c in params["p_counts"]]
+        _reject_bad_uuids(ids)
+        applied.extend(ids)
+        return []
+
+    sb.rpc_handler = rpc
+    for rid in GOOD + ["not-a-uuid"]:
+        counter.record(rid)
+    counter.flush()
+    assert sorted(applied) == GOOD
+    assert counter.pending("not-a-uuid") == 0
+    stats = counter.stats()
+    assert (stats["increments_applied"], stats["increments_dropped"], stats["pending_increments"]) == (4, 1, 0)
+
+    # Later flushes are not poisoned by the dropped id
+    counter.record(GOOD[0])
+    calls = sb.executed
+    counter.flush()
+    counter.stop()
+    assert sb.executed == calls + 1
+    assert applied[-1] == GOOD[0]
+
+
+def test_bad_log_row_only_drops_itself():
+    sb = FakeSupabase({"resources": [], "resource_downloads": []})
+    sb.rpc_handler = lambda name, params: []
+
+    def check(query):
+        if query.table == "resource_downloads" and query._op == "insert":
+            _reject_bad_uuids([r["resource_id"] for r in query._payload])
+
+    sb.before_execute = check
+    counter = DownloadCounter(sb, flush_interval=60, batch_size=10)
+    for rid in GOOD + ["not-a-uuid"] + GOOD:
+        counter.record(rid)
+    counter.flush()
+    counter.stop()
+    logged = [r["resource_id"] for r in sb.tables["resource_downloads"]]
+    assert sorted(logged) == sorted(GOOD * 2)
+    assert counter.stats()["logs_dropped"] == 1
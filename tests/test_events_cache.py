@@ -0,0 +1,82 @@
+from datetime import date
+
+from events_cache import EventBucket, MonthlyEventsCache, month_of, month_range
+from fake_supabase import FakeSupabase
+
+EVENTS = [
+    {"id": "quiz", "start_date": "2026-10-20", "start_time": "10:00:00", "class": "AIE-A", "is_personal": False, "created_by": "f1"},
+    {"id": "talk", "start_date": "2026-10-05", "start_time": None, "class": "AIE-B", "is_personal": False, "created_by": "f1"},
+    {"id": "fest", "start_date": "2026-10-05", "start_time": "09:00:00", "class": None, "is_personal": False, "created_by": "f1"},
+    {"id": "mine", "start_date": "2026-10-07", "start_time": "09:00:00", "class": None, "is_personal": True, "created_by": "s1"},
+    {"id": "theirs", "start_date": "2026-10-08", "start_time": None, "class": None, "is_personal": True, "created_by": "s2"},
+    {"id": "unset", "start_date": "2026-10-09", "start_time": None, "class": "AIE-A", "is_personal": None, "created_by": "f1"},
+    {"id": "nov", "start_date": "2026-11-02", "start_time": None, "class": "AIE-A", "is_personal": False, "created_by": "f1"},
+]
+
+
+def _ids(events):
+    return [e["id"] for e in events]
+
+
+def test_visible_without_a_user_is_everything_sorted():
+    bucket = EventBucket(EVENTS[:6])
+    assert _ids(bucket.visible()) == ["talk", "fest", "mine", "theirs", "unset", "quiz"]
+
+
+def test_students_see_their_class_plus_their_personal_events():
+    bucket = EventBucket(EVENTS[:6])
+    assert _ids(bucket.visible("s1", "student", "AIE-A")) == ["mine", "quiz"]
+
+
+def test_faculty_and_classless_users_see_all_shared_events():
+    bucket = EventBucket(EVENTS[:6])
+    assert _ids(bucket.visible("f1", "faculty", None)) == ["talk", "fest", "quiz"]
+    assert _ids(bucket.visible("s2", "student", None)) == ["talk", "fest", "theirs", "quiz"]
+
+
+def test_without_is_personal_column_every_event_is_shared():
+    rows = [{k: v for k, v in e.items() if k != "is_personal"} for e in EVENTS[:4]]
+    bucket = EventBucket(rows)
+    assert _ids(bucket.visible("s1", "student", "AIE-A")) == ["quiz"]
+    assert _ids(bucket.visible("f1", "faculty")) == ["talk", "fest", "mine", "quiz"]
+
+
+def test_visible_returns_copies():
+    bucket = EventBucket(EVENTS[:1])
+    bucket.visible()[0]["title"] = "changed"
+    assert "title" not in bucket.visible()[0]
+
+
+def test_month_helpers():
+    assert month_range(2026, 12) == (date(2026, 12, 1), date(2027, 1, 1))
+    assert month_of("2026-10-05") == (2026, 10)
+    assert month_of("bad") is None
+
+
+def test_months_are_cached_and_invalidated_individually():
+    sb = FakeSupabase({"events": EVENTS})
+    cache = MonthlyEventsCache(sb, ttl=300)
+    assert _ids(cache.month(2026, 10).visible("f1", "faculty")) == ["talk", "fest", "quiz"]
+    assert _ids(cache.month(2026, 11).visible()) == ["nov"]
+    cache.month(2026, 10)
+    assert sb.executed == 2
+
+    sb.tables["events"].append({"id": "new", "start_date": "2026-10-30", "class": None, "is_personal": False})
+    cache.invalidate("2026-10-30", None)
+    assert "new" in _ids(cache.month(2026, 10).visible())
+    cache.month(2026, 11)
+    assert sb.executed == 3
+
+
+def test_a_fetch_racing_a_write_is_not_cached():
+    sb = FakeSupabase({"events": EVENTS})
+    cache = MonthlyEventsCache(sb, ttl=300)
+
+    def write_after_read(query):
+        sb.on_execute = None
+        sb.tables["events"].append({"id": "late", "start_date": "2026-10-31", "class": None, "is_personal": False})
+        cache.invalidate("2026-10-31")
+
+    sb.on_execute = write_after_read
+    assert "late" not in _ids(cache.month(2026, 10).visible())
+    assert "late" in _ids(cache.month(2026, 10).visible())
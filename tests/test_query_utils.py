@@ -0,0 +1,87 @@
+import pytest
+
+from fake_supabase import FakeSupabase
+from query_utils import decode_cursor, encode_cursor, keyset_after, keyset_before, or_filter, order_by, quote_value
+
+
+class _Params:
+    def __init__(self, items=()):
+        self.items = list(items)
+
+    def add(self, key, value):
+        return _Params(self.items + [(key, value)])
+
+    def set(self, key, value):
+        return _Params([kv for kv in self.items if kv[0] != key] + [(key, value)])
+
+
+class _Builder:
+    """Minimal postgrest builder without or_(), like the pinned client."""
+
+    def __init__(self):
+        self.params = _Params()
+
+
+def test_quote_value_escapes_quotes_and_backslashes():
+    assert quote_value("plain") == '"plain"'
+    assert quote_value('a"b') == '"a\\"b"'
+    assert quote_value("a\\b") == '"a\\\\b"'
+    assert quote_value("2026-10-17T10:00:00+00:00") == '"2026-10-17T10:00:00+00:00"'
+
+
+def test_or_filter_sets_a_single_or_param():
+    q = or_filter(_Builder(), 'a.eq.1,b.eq."x,y"')
+    assert q.params.items == [("or", '(a.eq.1,b.eq."x,y")')]
+
+
+def test_order_by_replaces_chained_orders_with_one_param():
+    q = _Builder()
+    q.params = q.params.add("order", "id.asc")
+    q = order_by(q, "created_at.desc", "id.desc")
+    assert q.params.items == [("order", "created_at.desc,id.desc")]
+
+
+@pytest.mark.parametrize("value", ["x,y", "p(q)", 'say "hi"', "back\\slash", "a.b:c"])
+def test_quoted_values_survive_postgrest_parsing(value):
+    sb = FakeSupabase({"t": [{"id": 1, "name": value}, {"id": 2, "name": "other"}]})
+    q = or_filter(sb.table("t").select("*"), f"name.eq.{quote_value(value)},id.eq.99")
+    assert [r["id"] for r in q.execute().data] == [1]
+
+
+def _messages():
+    return [{"id": f"m{i}", "created_at": f"2026-10-17T10:00:0{i // 2}"} for i in range(8)]
+
+
+def test_keyset_before_and_after_page_through_ties_without_gaps():
+    sb = FakeSupabase({"messages": _messages()})
+    seen, cursor = [], None
+    while True:
+        q = sb.table("messages").select("*")
+        if cursor:
+            q = keyset_before(q, "created_at", "id", *cursor)
+        page = order_by(q, "created_at.desc", "id.desc").limit(3).execute().data
+        seen += [m["id"] for m in page]
+        if len(page) < 3:
+            break
+        cursor = (page[-1]["created_at"], page[-1]["id"])
+    assert seen == [f"m{i}" for i in range(7, -1, -1)]
+
+    q = keyset_after(sb.table("messages").select("*"), "created_at", "id", "2026-10-17T10:00:01", "m2")
+    assert [m["id"] for m in order_by(q, "created_at.asc", "id.asc").execute().data] == ["m3", "m4", "m5", "m6", "m7"]
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2026-10-17T10:00:00+00:00", 42, "x")
+    assert "=" not in cursor
+    assert decode_cursor(cursor, 3) == ["2026-10-17T10:00:00+00:00", "42", "x"]
+
+
+@pytest.mark.parametrize("bad", ["", "!!!", encode_cursor("only-one"), "eyJhIjogMX0"])
+def test_decode_cursor_rejects_malformed_input(bad):
+    with pytest.raises(ValueError):
+        decode_cursor(bad)
+
+
+def test_decode_cursor_checks_the_part_count():
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor("a", "b"), 3)
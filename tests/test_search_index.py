@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from fake_supabase import FakeSupabase
+from search_index import SearchIndex, tokenize
+
+SPECS = {"docs": {"fields": {"title": 2.0, "body": 1.0}, "filters": ("class",)}}
+
+
+def _index(rows):
+    sb = FakeSupabase({"docs": rows})
+    return sb, SearchIndex(sb, specs=SPECS, ttl=600)
+
+
+def _ids(ranked):
+    return [doc_id for doc_id, _ in ranked]
+
+
+def test_tokenize_casefolds_and_joins_lists():
+    assert tokenize("Machine-Learning 101") == ["machine", "learning", "101"]
+    assert tokenize(["SQL", None, "Joins"]) == ["sql", "joins"]
+    assert tokenize(None) == []
+
+
+def test_title_matches_outrank_body_matches():
+    _, index = _index([
+        {"id": "body", "title": "Week one", "body": "graph algorithms"},
+        {"id": "title", "title": "Graph algorithms", "body": "week one"},
+    ])
+    assert _ids(index.search("docs", "graph")) == ["title", "body"]
+
+
+def test_rare_terms_weigh_more_than_common_ones():
+    rows = [{"id": f"c{i}", "title": "notes", "body": ""} for i in range(6)]
+    rows.append({"id": "more_common", "title": "notes notes eigenvalues", "body": ""})
+    rows.append({"id": "more_rare", "title": "notes eigenvalues eigenvalues", "body": ""})
+    _, index = _index(rows)
+    # Same length, same terms: the extra occurrence of the rarer term scores higher
+    assert _ids(index.search("docs", "notes eigenvalues")) == ["more_rare", "more_common"]
+    assert _ids(index.search("docs", "eigen"))[0] == "more_rare"
+
+
+def test_every_token_must_match_and_exact_beats_prefix():
+    _, index = _index([
+        {"id": "exact", "title": "data", "body": ""},
+        {"id": "prefix", "title": "database", "body": ""},
+        {"id": "other", "title": "networks", "body": ""},
+    ])
+    assert _ids(index.search("docs", "data")) == ["exact", "prefix"]
+    assert index.search("docs", "data networks") == []
+    assert index.search("docs", "   ") == []
+
+
+def test_where_filter_and_limit():
+    _, index = _index([
+        {"id": "a", "title": "lab sheet", "body": "", "class": "AIE-A"},
+        {"id": "b", "title": "lab sheet", "body": "", "class": "AIE-B"},
+    ])
+    assert _ids(index.search("docs", "lab", where=lambda attrs: attrs.get("class") == "AIE-B")) == ["b"]
+    assert len(index.search("docs", "lab", limit=1)) == 1
+
+
+def test_upsert_and_remove_update_the_index_in_place():
+    sb, index = _index([{"id": "a", "title": "old title", "body": ""}])
+    index.reload()
+    index.upsert("docs", {"id": "a", "title": "new title", "body": ""})
+    index.upsert("docs", {"id": "b", "title": "another new", "body": ""})
+    assert index.search("docs", "old") == []
+    assert set(_ids(index.search("docs", "new"))) == {"a", "b"}
+    index.remove("docs", "a")
+    assert _ids(index.search("docs", "new")) == ["b"]
+    assert index.stats()["tables"]["docs"]["docs"] == 1
+
+
+def test_hydrate_keeps_rank_order_with_one_query():
+    sb, index = _index([{"id": str(i), "title": "x", "body": ""} for i in range(3)])
+    sb.executed = 0
+    rows = index.hydrate("docs", [("2", 3.0), ("0", 2.0), ("gone", 1.0)])
+    assert [r["id"] for r in rows] == ["2", "0"]
+    assert sb.executed == 1
+
+
+def test_search_raises_when_the_index_cannot_be_built():
+    sb, index = _index([])
+
+    def fail(query):
+        raise ConnectionError("down")
+
+    sb.on_execute = fail
+    with pytest.raises(RuntimeError):
+        index.search("docs", "anything")
+
+
+def test_concurrent_searches_on_a_cold_index_build_it_once():
+    sb, index = _index([{"id": "d1", "title": "Graph algorithms", "body": ""}])
+    sb.before_execute = lambda query: time.sleep(0.02)
+    start = threading.Barrier(3)
+    results = []
+
+    def search():
+        start.wait()
+        results.append(_ids(index.search("docs", "graph")))
+
+    threads = [threading.Thread(target=search) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [["d1"]] * 3
+    assert index.stats()["loads"] == 1
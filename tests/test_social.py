@@ -0,0 +1,77 @@
+import threading
+import time
+
+from fake_supabase import FakeSupabase
+from social import FriendGraph, FriendService
+
+
+class _Profiles:
+    """Stand-in for EntityCache.get_many over a dict of users."""
+
+    def __init__(self, users):
+        self.users = users
+        self.calls = 0
+
+    def get_many(self, ids):
+        self.calls += 1
+        return {str(i): dict(self.users[str(i)]) for i in ids if str(i) in self.users}
+
+
+USERS = {u: {"id": u, "first_name": u.upper(), "last_name": "X", "email": f"{u}@x.com"} for u in ("a", "b", "c", "d")}
+
+
+def test_friend_list_keeps_user1_rows_before_user2_rows_and_reads_the_table():
+    sb = FakeSupabase({"friendships": [
+        {"id": "1", "user1_id": "b", "user2_id": "a", "created_at": "2026-01-03"},
+        {"id": "2", "user1_id": "a", "user2_id": "c", "created_at": "2026-01-01"},
+        {"id": "3", "user1_id": "a", "user2_id": "d", "created_at": "2026-01-02"},
+    ]})
+    service = FriendService(sb, _Profiles(USERS))
+    assert [f["friend_id"] for f in service.list_friends("a")] == ["c", "d", "b"]
+    # A friendship written elsewhere shows up on the next call
+    sb.tables["friendships"].append({"id": "4", "user1_id": "a", "user2_id": "x", "created_at": "2026-01-04"})
+    sb.executed = 0
+    assert [f["friend_id"] for f in service.list_friends("a")] == ["c", "d", "b"]  # x has no profile
+    assert sb.executed == 2
+
+
+def test_friend_page_is_newest_first():
+    sb = FakeSupabase({"friendships": [
+        {"id": "1", "user1_id": "b", "user2_id": "a", "created_at": "2026-01-03"},
+        {"id": "2", "user1_id": "a", "user2_id": "c", "created_at": "2026-01-01"},
+    ]})
+    page = FriendService(sb, _Profiles(USERS)).list_friends_page("a", limit=1)
+    assert [f["friend_id"] for f in page["friends"]] == ["b"]
+    assert page["total"] == 2 and page["next_offset"] == 1
+
+
+def test_graph_positive_checks_cost_no_query_and_negatives_are_confirmed():
+    sb = FakeSupabase({"friendships": [{"id": "1", "user1_id": "a", "user2_id": "b", "created_at": "t"}]})
+    graph = FriendGraph(sb)
+    graph.reload()
+    sb.executed = 0
+    assert graph.are_friends("b", "a")
+    assert sb.executed == 0
+    # Written by another worker after the snapshot: found by the confirm query
+    sb.tables["friendships"].append({"id": "2", "user1_id": "c", "user2_id": "a", "created_at": "t"})
+    assert graph.are_friends("a", "c")
+    assert not graph.are_friends("a", "d")
+    assert sb.executed == 2
+
+
+def test_concurrent_checks_on_a_stale_graph_load_it_once():
+    sb = FakeSupabase({"friendships": [{"id": "1", "user1_id": "a", "user2_id": "b"}]})
+    graph = FriendGraph(sb)
+    sb.before_execute = lambda query: time.sleep(0.02)
+    start = threading.Barrier(20)
+
+    def check():
+        start.wait()
+        assert graph.are_friends("a", "b")
+
+    threads = [threading.Thread(target=check) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert graph.stats()["loads"] == 1
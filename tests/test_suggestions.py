@@ -0,0 +1,79 @@
+import threading
+import time
+
+from fake_supabase import FakeSupabase
+from search_index import SuggestionIndex
+
+
+def _index():
+    sb = FakeSupabase({
+        "courses": [{"id": "co1", "name": "Machine Learning"}, {"id": "co2", "name": "Databases"}],
+        "assignments": [{"id": "a1", "title": "Linear regression", "course_id": "co1"},
+                        {"id": "a2", "title": "Matrix drills", "course_id": "co1"}],
+        "resources": [{"id": "r1", "title": "ML notes", "course_id": "co1", "download_count": 1},
+                      {"id": "r2", "title": "Machine vision slides", "course_id": None, "download_count": 40}],
+        "users": [{"id": "u1", "first_name": "Mary", "last_name": "Lee"}],
+    })
+    return sb, SuggestionIndex(sb, ttl=600)
+
+
+def _texts(items):
+    return [s["text"] for s in items]
+
+
+def test_prefix_matches_any_word_ranked_by_popularity():
+    _, index = _index()
+    # r2 (40 downloads) > co1 (3 attached rows) > a2/u1 (0, shorter text first)
+    assert _texts(index.suggest("ma", k=10)) == ["Machine vision slides", "Machine Learning", "Mary Lee", "Matrix drills"]
+    assert _texts(index.suggest("learn")) == ["Machine Learning"]
+    assert _texts(index.suggest("Machine L")) == ["Machine Learning"]
+    assert index.suggest("zzz") == []
+
+
+def test_top_k_and_kinds():
+    _, index = _index()
+    assert len(index.suggest("m", k=2)) == 2
+    assert [s["type"] for s in index.suggest("ma", kinds=["user"])] == ["user"]
+
+
+def test_lookups_never_query_after_load_and_narrow_from_cached_prefixes():
+    sb, index = _index()
+    index.suggest("ma", k=10)
+    calls = sb.executed
+    assert _texts(index.suggest("mac", k=10)) == ["Machine vision slides", "Machine Learning"]
+    assert _texts(index.suggest("ma", k=10))[0] == "Machine vision slides"
+    assert sb.executed == calls
+    stats = index.stats()
+    assert stats["narrowed"] == 1 and stats["cache_hits"] == 1
+
+
+def test_writes_refresh_results():
+    _, index = _index()
+    index.suggest("ma")
+    index.upsert("assignment", {"id": "a3", "title": "Maps and folds"})
+    assert "Maps and folds" in _texts(index.suggest("maps"))
+    index.upsert("resource", {"id": "r2", "title": "Computer vision slides"})
+    assert "Machine vision slides" not in _texts(index.suggest("ma", k=10))
+    # Popularity survives an update without download_count
+    assert _texts(index.suggest("vision")) == ["Computer vision slides"]
+    index.remove("course", "co1")
+    assert "Machine Learning" not in _texts(index.suggest("ma", k=10))
+
+
+def test_concurrent_keystrokes_on_an_expired_index_build_it_once():
+    sb, index = _index()
+    index.suggest("ma")
+    index._loaded_at -= index.ttl + 1
+    sb.before_execute = lambda query: time.sleep(0.01)
+    start = threading.Barrier(10)
+
+    def type_prefix(prefix):
+        start.wait()
+        index.suggest(prefix)
+
+    threads = [threading.Thread(target=type_prefix, args=("machine"[:n],)) for n in range(1, 11)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert index.stats()["loads"] == 2
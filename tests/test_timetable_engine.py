@@ -0,0 +1,86 @@
+import threading
+import time
+
+from fake_supabase import FakeSupabase
+from timetable_engine import SaturdayIndex, TimetableEngine
+
+
+def _row(rid, day="monday", start="09:00:00", end="10:00:00", cls="AIE-A"):
+    return {"id": rid, "class": cls, "course_id": "co1", "day_of_week": day, "start_time": start, "end_time": end}
+
+
+def test_slots_are_bucketed_and_sorted():
+    sb = FakeSupabase({"timetable": [_row("b", start="11:00", end="12:00"), _row("a"), _row("c", day="tuesday")]})
+    engine = TimetableEngine(sb)
+    assert [s.row["id"] for s in engine.day_slots("Monday", classes=["AIE-A"])] == ["a", "b"]
+    assert [s.row["id"] for s in engine.day_slots("tuesday")] == ["c"]
+
+
+def test_invalidate_during_reload_discards_the_stale_snapshot():
+    sb = FakeSupabase({"timetable": [_row("a")]})
+    engine = TimetableEngine(sb)
+    engine.reload()
+
+    # A write commits and invalidates while the next reload is still fetching
+    def write_during_fetch(query):
+        sb.on_execute = None
+        sb.tables["timetable"].append(_row("new", start="13:00", end="14:00"))
+        engine.invalidate()
+
+    engine.invalidate()
+    sb.on_execute = write_during_fetch
+    ids = [s.row["id"] for s in engine.day_slots("monday")]
+    # The fetch that raced the write was thrown away and refetched
+    assert ids == ["a", "new"]
+    assert engine.stats()["discarded_loads"] == 1
+    assert engine.stats()["stale"] is False
+
+
+def test_saturday_dates_without_a_mapping_do_not_fall_back_to_legacy_rows():
+    sb = FakeSupabase({"saturday_class": [
+        {"id": "s1", "date": "2026-10-17", "class": "AIE-A", "tt_followed": "monday", "created_at": "2026-10-01"},
+        {"id": "s2", "date": None, "class": "AIE-B", "tt_followed": "friday", "created_at": "2026-10-02"},
+    ]})
+    index = SaturdayIndex(sb)
+    assert [r["id"] for r in index.mappings_for("2026-10-17")] == ["s1"]
+    assert index.mappings_for("2026-10-24") == []
+    assert index.stats()["legacy_fallback"] is False
+
+
+def test_saturday_legacy_fallback_only_without_date_column():
+    sb = FakeSupabase({"saturday_class": [
+        {"id": f"s{i}", "class": "AIE-A", "tt_followed": "monday", "created_at": f"2026-10-0{i}"} for i in range(1, 8)
+    ]})
+    index = SaturdayIndex(sb)
+    assert [r["id"] for r in index.mappings_for("2026-10-24")] == ["s7", "s6", "s5", "s4", "s3"]
+
+
+def _concurrent(n, call):
+    start = threading.Barrier(n)
+    threads = [threading.Thread(target=lambda: (start.wait(), call())) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _slow(sb, seconds=0.02):
+    sb.before_execute = lambda query: time.sleep(seconds)
+
+
+def test_concurrent_lookups_after_invalidate_reload_once():
+    sb = FakeSupabase({"timetable": [_row("a")]})
+    engine = TimetableEngine(sb)
+    engine.reload()
+    engine.invalidate()
+    _slow(sb)
+    _concurrent(20, lambda: engine.day_slots("monday"))
+    assert engine.stats()["loads"] == 2
+
+
+def test_concurrent_saturday_lookups_reload_once():
+    sb = FakeSupabase({"saturday_class": [{"id": "s1", "date": "2026-10-17", "class": "AIE-A"}]})
+    index = SaturdayIndex(sb)
+    _slow(sb)
+    _concurrent(20, lambda: index.mappings_for("2026-10-17"))
+    assert index.stats()["loads"] == 1
@@ -0,0 +1,37 @@
+from fake_supabase import FakeSupabase
+from user_search import find_users
+
+USERS = [
+    {"id": "1", "first_name": "Ravi", "last_name": "Kumar", "email": "ravi@x.com", "roll_no": "CB.EN.U4AIE21", "dept": "AIE", "password_hash": "h"},
+    {"id": "2", "first_name": "Ann", "last_name": "Ravindran", "email": "ann@x.com", "roll_no": "R2", "dept": "CSE", "password_hash": "h"},
+    {"id": "3", "first_name": "Zed", "last_name": "Lee", "email": "zed.ravi@x.com", "roll_no": "R3", "dept": "ECE", "password_hash": "h"},
+    {"id": "4", "first_name": "Rav", "last_name": "Exact", "email": "e@x.com", "roll_no": "RAVI", "dept": "ECE", "password_hash": "h"},
+]
+
+
+def _search(q, **kwargs):
+    sb = FakeSupabase({"users": USERS})
+    return [u["id"] for u in find_users(sb, q, **kwargs)], sb
+
+
+def test_exact_roll_no_then_prefix_then_substring_in_one_query():
+    ids, sb = _search("ravi")
+    assert ids == ["4", "1", "2", "3"]
+    assert sb.executed == 1
+
+
+def test_multi_word_queries_match_across_fields():
+    ids, _ = _search("ann ravin")
+    assert ids == ["2"]
+
+
+def test_exclude_limit_and_password_hash():
+    sb = FakeSupabase({"users": USERS})
+    rows = find_users(sb, "ravi", limit=2, exclude_id="4")
+    assert [u["id"] for u in rows] == ["1", "2"]
+    assert all("password_hash" not in u for u in rows)
+
+
+def test_wildcards_and_filter_syntax_are_literal_text():
+    assert _search("%")[0] == []
+    assert _search("a,b)")[0] == []
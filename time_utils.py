@@ -0,0 +1,24 @@
+"""
+Time parsing helpers
+Timetable rows repeat the same handful of start/end strings, so each distinct value
+is parsed once and memoized instead of going through strptime on every request
+"""
+from datetime import datetime, time
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def parse_clock_time(value: str) -> time:
+    """Parse 'HH:MM', 'HH:MM:SS[.ffffff]' or an ISO datetime string into a time.
+
+    Raises ValueError for anything else, like the strptime chain it replaces.
+    """
+    s = str(value).strip()
+    if 'T' in s:
+        return datetime.fromisoformat(s.replace('Z', '')).time()
+    parts = s.split(':')
+    # Fast path for the plain HH:MM / HH:MM:SS values Postgres returns for `time`
+    if len(parts) in (2, 3) and all(p.isdigit() for p in parts):
+        return time(*map(int, parts))
+    return time.fromisoformat(s)
+
@@ -0,0 +1,304 @@
+"""
+In-memory weekly timetable
+Holds every timetable row (with its course name/code) pre-parsed and bucketed so the
+current/next/today class lookups are answered without a round trip to Supabase, plus
+a date-keyed index of the saturday_class mappings
+"""
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import time as dtime
+from typing import NamedTuple
+
+from time_utils import parse_clock_time
+
+PAGE_SIZE = 1000
+
+
+class Slot(NamedTuple):
+    """A timetable row with its parsed start/end times."""
+    start: dtime
+    end: dtime
+    row: dict
+
+
+def slot_for_row(row: dict) -> Slot:
+    return Slot(parse_clock_time(row["start_time"]), parse_clock_time(row["end_time"]), row)
+
+
+def _sort_key(slot: Slot):
+    return (slot.start, slot.end, str(slot.row.get("id") or ""))
+
+
+def _copy(slot: Slot) -> Slot:
+    # Callers annotate rows (status, time_until, ...); never hand out the cached dict
+    return slot._replace(row=dict(slot.row))
+
+
+class TimetableEngine:
+    """Process-local copy of the `timetable` table.
+
+    Rows are bucketed by (class, day_of_week), (course_id, day_of_week) and
+    day_of_week, each bucket sorted by start time. The snapshot is loaded lazily,
+    refreshed after `ttl` seconds and marked stale by invalidate() after writes.
+    A reload whose fetch overlapped an invalidate() is discarded and refetched, so
+    the write is never masked by rows read before it.
+    """
+
+    RELOAD_ATTEMPTS = 3
+
+    def __init__(self, supabase, ttl: float | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("TIMETABLE_CACHE_TTL_SECONDS", "300"))
+        self._by_class_day: dict[tuple[str, str], list[Slot]] = {}
+        self._by_class_ci_day: dict[tuple[str, str], list[Slot]] = {}
+        self._by_course_day: dict[tuple[str, str], list[Slot]] = {}
+        self._by_day: dict[str, list[Slot]] = {}
+        self._rows = 0
+        self._loaded_at: float | None = None
+        self._stale = True
+        # Bumped by invalidate(); reload() only installs rows fetched within one generation
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.discarded_loads = 0
+        self.skipped_rows = 0
+        self.queries = 0
+
+    # ------------------------------------------------------------------ loading
+    def _fetch_all(self) -> list[dict]:
+        rows: list[dict] = []
+        start = 0
+        while True:
+            res = (
+                self.supabase.table("timetable")
+                .select("*, courses(name, code)")
+                .order("id")
+                .range(start, start + PAGE_SIZE - 1)
+                .execute()
+            )
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            start += PAGE_SIZE
+
+    def _needs_reload(self) -> bool:
+        expired = self._loaded_at is not None and (time.monotonic() - self._loaded_at) > self.ttl
+        return self._stale or expired
+
+    def reload(self, force: bool = True) -> bool:
+        """Rebuild every bucket from the table; keeps the old snapshot on failure.
+
+        With force=False the reload is skipped when the snapshot is already fresh,
+        e.g. because another caller reloaded it while this one waited for the lock.
+        """
+        with self._lock:
+            if not force and not self._needs_reload():
+                return True
+            for _ in range(self.RELOAD_ATTEMPTS):
+                generation = self._generation
+                try:
+                    rows = self._fetch_all()
+                except Exception as e:
+                    self.load_errors += 1
+                    print("[timetable] load failed:", repr(e))
+                    return False
+                if self._generation == generation:
+                    break
+                # A write landed while fetching; these rows may predate it
+                self.discarded_loads += 1
+            else:
+                print("[timetable] reload kept racing with writes; snapshot left stale")
+                return False
+            by_class_day: dict[tuple[str, str], list[Slot]] = {}
+            by_class_ci_day: dict[tuple[str, str], list[Slot]] = {}
+            by_course_day: dict[tuple[str, str], list[Slot]] = {}
+            by_day: dict[str, list[Slot]] = {}
+            skipped = 0
+            for row in rows:
+                try:
+                    slot = slot_for_row(row)
+                except Exception:
+                    skipped += 1
+                    continue
+                day = str(row.get("day_of_week") or "").lower()
+                by_day.setdefault(day, []).append(slot)
+                if row.get("class"):
+                    by_class_day.setdefault((str(row["class"]), day), []).append(slot)
+                    by_class_ci_day.setdefault((str(row["class"]).casefold(), day), []).append(slot)
+                if row.get("course_id"):
+                    by_course_day.setdefault((str(row["course_id"]), day), []).append(slot)
+            for bucket in (by_class_day, by_class_ci_day, by_course_day, by_day):
+                for slots in bucket.values():
+                    slots.sort(key=_sort_key)
+            if skipped:
+                print(f"[timetable] skipped {skipped} row(s) with unparseable times")
+            self._by_class_day, self._by_class_ci_day = by_class_day, by_class_ci_day
+            self._by_course_day, self._by_day = by_course_day, by_day
+            self._rows = len(rows) - skipped
+            self.skipped_rows = skipped
+            self._loaded_at = time.monotonic()
+            # An invalidate() while the buckets were being built leaves it stale
+            self._stale = self._generation != generation
+            self.loads += 1
+            return True
+
+    def invalidate(self):
+        """Mark the snapshot stale; the next lookup reloads it."""
+        self._generation += 1
+        self._stale = True
+
+    def _ensure_loaded(self):
+        if self._needs_reload():
+            if not self.reload(force=False) and self._loaded_at is None:
+                raise RuntimeError("timetable could not be loaded")
+
+    # ------------------------------------------------------------------ lookups
+    def _slots(self, day: str, classes: list[str] | None = None, course_ids: list[str] | None = None,
+               ignore_case: bool = False) -> list[Slot]:
+        """Slots for a weekday, sorted by start time, optionally narrowed to classes/courses.
+
+        ignore_case matches class codes case-insensitively (the Saturday mappings used ilike).
+        """
+        self._ensure_loaded()
+        self.queries += 1
+        day = day.lower()
+        if classes is not None:
+            if ignore_case:
+                keys = dict.fromkeys(str(c).casefold() for c in classes)
+                buckets = [self._by_class_ci_day.get((c, day), []) for c in keys]
+            else:
+                buckets = [self._by_class_day.get((str(c), day), []) for c in dict.fromkeys(classes)]
+            slots = buckets[0] if len(buckets) == 1 else list(heapq.merge(*buckets, key=_sort_key))
+            if course_ids is not None:
+                allowed = {str(c) for c in course_ids}
+                slots = [s for s in slots if str(s.row.get("course_id")) in allowed]
+            return slots
+        if course_ids is not None:
+            buckets = [self._by_course_day.get((str(c), day), []) for c in dict.fromkeys(course_ids)]
+            return list(heapq.merge(*buckets, key=_sort_key))
+        return self._by_day.get(day, [])
+
+    def day_slots(self, day: str, classes: list[str] | None = None, course_ids: list[str] | None = None,
+                  ignore_case: bool = False) -> list[Slot]:
+        return [_copy(s) for s in self._slots(day, classes, course_ids, ignore_case)]
+
+    def current(self, day: str, at: dtime, classes: list[str] | None = None, course_ids: list[str] | None = None) -> Slot | None:
+        """The earliest-starting slot running at `at` (start <= at <= end)."""
+        slots = self._slots(day, classes, course_ids)
+        started = bisect_right(slots, at, key=lambda s: s.start)
+        for slot in slots[:started]:
+            if at <= slot.end:
+                return _copy(slot)
+        return None
+
+    def next_after(self, day: str, at: dtime, classes: list[str] | None = None, course_ids: list[str] | None = None) -> Slot | None:
+        """The first slot on `day` starting strictly after `at`."""
+        slots = self._slots(day, classes, course_ids)
+        idx = bisect_right(slots, at, key=lambda s: s.start)
+        return _copy(slots[idx]) if idx < len(slots) else None
+
+    def first_on(self, day: str, classes: list[str] | None = None, course_ids: list[str] | None = None) -> Slot | None:
+        slots = self._slots(day, classes, course_ids)
+        return _copy(slots[0]) if slots else None
+
+    def stats(self) -> dict:
+        return {
+            "rows": self._rows,
+            "class_day_buckets": len(self._by_class_day),
+            "loaded": self._loaded_at is not None,
+            "stale": self._stale,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "discarded_loads": self.discarded_loads,
+            "skipped_rows": self.skipped_rows,
+            "queries": self.queries,
+        }
+
+
+class SaturdayIndex:
+    """date -> saturday_class mappings (which weekday timetable a class follows).
+
+    The whole table is small, so it is loaded at once and reloaded lazily after
+    invalidate() or `ttl` seconds. Only when the table has no `date` column (older
+    schema) does the legacy behaviour apply: the latest 5 rows by created_at answer
+    every date. A date with no mapping otherwise gets none.
+    """
+
+    LEGACY_FALLBACK_ROWS = 5
+
+    def __init__(self, supabase, ttl: float | None = None):
+        self.supabase = supabase
+        self.ttl = ttl or float(os.getenv("SATURDAY_CACHE_TTL_SECONDS", "300"))
+        self._by_date: dict[str, tuple[dict, ...]] = {}
+        self._legacy: tuple[dict, ...] | None = None
+        self._rows = 0
+        self._loaded_at: float | None = None
+        self._stale = True
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+
+    def _needs_reload(self) -> bool:
+        expired = self._loaded_at is not None and (time.monotonic() - self._loaded_at) > self.ttl
+        return self._stale or expired
+
+    def reload(self, force: bool = True) -> bool:
+        with self._lock:
+            # Concurrent lookups queue on the lock; only the first one refetches
+            if not force and not self._needs_reload():
+                return True
+            generation = self._generation
+            try:
+                res = self.supabase.table("saturday_class").select("*").execute()
+            except Exception as e:
+                self.load_errors += 1
+                print("[saturday] load failed:", repr(e))
+                return False
+            rows = res.data or []
+            # select("*") returns every column, so a missing key means a missing column
+            has_date_column = any("date" in r for r in rows)
+            by_date: dict[str, list[dict]] = {}
+            for r in rows:
+                if r.get("date"):
+                    by_date.setdefault(str(r["date"])[:10], []).append(r)
+            legacy = None
+            if rows and not has_date_column:
+                latest = sorted(rows, key=lambda r: str(r.get("created_at") or ""), reverse=True)
+                legacy = tuple(latest[:self.LEGACY_FALLBACK_ROWS])
+            self._by_date = {d: tuple(v) for d, v in by_date.items()}
+            self._legacy = legacy
+            self._rows = len(rows)
+            self._loaded_at = time.monotonic()
+            # Same race as TimetableEngine: a write during the fetch keeps it stale
+            self._stale = self._generation != generation
+            self.loads += 1
+            return True
+
+    def invalidate(self):
+        self._generation += 1
+        self._stale = True
+
+    def mappings_for(self, date: str) -> list[dict]:
+        """Mappings for a YYYY-MM-DD date (copies; [] when none)."""
+        if self._needs_reload():
+            if not self.reload(force=False) and self._loaded_at is None:
+                raise RuntimeError("saturday_class could not be loaded")
+        rows = self._legacy if self._legacy is not None else self._by_date.get(str(date)[:10], ())
+        return [dict(r) for r in rows]
+
+    def stats(self) -> dict:
+        return {
+            "rows": self._rows,
+            "dates": len(self._by_date),
+            "legacy_fallback": self._legacy is not None,
+            "loaded": self._loaded_at is not None,
+            "stale": self._stale,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+        }
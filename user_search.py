@@ -0,0 +1,98 @@
+"""
+User search
+Answers a people search across first_name, last_name, email, roll_no and dept with a
+single PostgREST or-filter, then ranks the candidates by match quality: exact
+roll_no, then prefix matches, then substring matches
+"""
+import re
+
+from query_utils import or_filter, quote_value
+
+SEARCH_FIELDS = ("roll_no", "first_name", "last_name", "email", "dept")
+
+# Candidates fetched per search before ranking; ranking happens on this window
+CANDIDATE_LIMIT = 200
+
+# ilike wildcards and or-filter syntax the user did not mean literally
+_WILDCARDS = re.compile(r"[%*_]")
+
+TIER_EXACT_ROLL = 0
+TIER_PREFIX = 1
+TIER_SUBSTRING = 2
+TIER_TOKENS = 3
+
+
+def _terms(q: str) -> list[str]:
+    return [t for t in _WILDCARDS.sub(" ", q or "").split() if t]
+
+
+def _field_filter(term: str, fields=SEARCH_FIELDS) -> str:
+    pattern = quote_value(f"%{term}%")
+    return ",".join(f"{f}.ilike.{pattern}" for f in fields)
+
+
+def _full_name(row: dict) -> str:
+    return f"{row.get('first_name') or ''} {row.get('last_name') or ''}".strip()
+
+
+def rank_key(row: dict, q: str):
+    """Sort key: (tier, field position, name, id); lower is better."""
+    needle = " ".join(_terms(q)).casefold()
+    if str(row.get("roll_no") or "").casefold() == needle:
+        return (TIER_EXACT_ROLL, 0, _full_name(row).casefold(), str(row.get("id")))
+    best = (TIER_TOKENS, len(SEARCH_FIELDS) + 1)
+    values = [str(row.get(f) or "") for f in SEARCH_FIELDS] + [_full_name(row)]
+    for pos, value in enumerate(values):
+        value = value.casefold()
+        if value.startswith(needle):
+            best = min(best, (TIER_PREFIX, pos))
+        elif needle in value:
+            best = min(best, (TIER_SUBSTRING, pos))
+    return (*best, _full_name(row).casefold(), str(row.get("id")))
+
+
+def find_users(supabase, q: str, limit: int = 20, exclude_id: str | None = None, columns: str = "*") -> list[dict]:
+    """Users matching every word of `q` in some search field, best matches first.
+
+    One query: each word becomes an or-group over SEARCH_FIELDS and the groups are
+    and-ed, so "ann lee" finds Ann Lee. If the combined filter is rejected (e.g. a
+    column missing on an older schema), falls back to one query per field.
+    password_hash is never returned.
+    """
+    terms = _terms(q)
+    if not terms:
+        return []
+    if len(terms) == 1:
+        expression = _field_filter(terms[0])
+    else:
+        expression = "and(" + ",".join(f"or({_field_filter(t)})" for t in terms) + ")"
+    try:
+        query = supabase.table("users").select(columns)
+        if exclude_id:
+            query = query.neq("id", exclude_id)
+        rows = or_filter(query, expression).limit(CANDIDATE_LIMIT).execute().data or []
+    except Exception as e:
+        print("[users] combined search filter failed, querying per field:", repr(e))
+        rows = _find_per_field(supabase, " ".join(terms), exclude_id, columns)
+    rows.sort(key=lambda r: rank_key(r, q))
+    for row in rows:
+        row.pop("password_hash", None)
+    return rows[:limit] if limit else rows
+
+
+def _find_per_field(supabase, q: str, exclude_id: str | None, columns: str) -> list[dict]:
+    rows: list[dict] = []
+    seen: set = set()
+    for field in SEARCH_FIELDS:
+        try:
+            query = supabase.table("users").select(columns).ilike(field, f"%{q}%")
+            if exclude_id:
+                query = query.neq("id", exclude_id)
+            for row in query.limit(CANDIDATE_LIMIT).execute().data or []:
+                if row.get("id") not in seen:
+                    seen.add(row.get("id"))
+                    rows.append(row)
+        except Exception:
+            # Continue to next field if any single search fails
+            continue
+    return rows